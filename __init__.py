@@ -1,5 +1,6 @@
 import os
 import logging
+import click
 from flask import Flask
 from flask_cors import CORS
 from dotenv import load_dotenv
@@ -7,6 +8,9 @@ from dotenv import load_dotenv
 # Simple logging configuration
 import logging
 from controller.web_controller import web_bp
+from repository.fragment_document_repository import FragmentDocumentRepository
+from repository.chat_history_repository import ChatHistoryRepository
+from repository.embedding_codec import EMBEDDING_FORMATS, get_embedding_format
 
 
 def create_app(config_name: str = 'development') -> Flask:
@@ -38,6 +42,12 @@ def create_app(config_name: str = 'development') -> Flask:
     # Setup health check
     _setup_health_check(app)
     
+    # Register maintenance commands
+    _register_commands(app)
+    
+    # Apply pending one-time data migrations
+    _run_migrations()
+    
     return app
 
 
@@ -53,7 +63,7 @@ def _configure_app(app: Flask, config_name: str):
     app.config['DATABASE_URL'] = os.getenv('DATABASE_URL')
     
     # File upload configuration
-    app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB max file size
+    app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_MB', '50')) * 1024 * 1024  # Max request size; uploads are processed in the background
     app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'uploads')
     
     # LangChain and AI configuration
@@ -126,4 +136,39 @@ def _setup_health_check(app: Flask):
             "status": "healthy",
             "service": "MedicoIA Web Application",
             "timestamp": "2025-01-01T00:00:00Z"
-        }
\ No newline at end of file
+        }
+
+
+def _register_commands(app: Flask):
+    """Register maintenance CLI commands (flask --app app <command>)"""
+    
+    @app.cli.command('migrate-embeddings')
+    @click.option('--format', 'storage_format', type=click.Choice(EMBEDDING_FORMATS),
+                  default=None, help='Target storage format (default: EMBEDDING_STORAGE_FORMAT)')
+    @click.option('--batch-size', type=int, default=None, help='Fragments per bulk write')
+    def migrate_embeddings(storage_format, batch_size):
+        """Rewrite stored fragment embeddings in another storage format"""
+        storage_format = storage_format or get_embedding_format()
+        if storage_format == 'int8':
+            click.echo("Warning: int8 quantization is lossy; migrating back will not restore the original values")
+        migrated = FragmentDocumentRepository().migrate_embedding_storage(storage_format, batch_size)
+        click.echo(f"Migrated {migrated} fragment embeddings to {storage_format}")
+    
+    @app.cli.command('rebuild-conversations')
+    def rebuild_conversations():
+        """Recompute the sidebar conversations collection from chat history (also completes the backfill)"""
+        count = ChatHistoryRepository().rebuild_conversations()
+        click.echo(f"Rebuilt {count} conversation summaries")
+
+
+def _run_migrations():
+    """
+    Run one-time data migrations before serving, so the sync and async chat paths both read migrated data.
+    Each migration is recorded in schema_migrations and runs once per database.
+    """
+    try:
+        count = ChatHistoryRepository().backfill_conversations()
+        if count is not None:
+            print(f"Backfilled {count} conversations from chat history")
+    except Exception as e:
+        print(f"Error running data migrations (retry with 'flask rebuild-conversations'): {e}")
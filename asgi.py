@@ -0,0 +1,109 @@
+"""
+ASGI entry point (uvicorn asgi:app).
+Chat messages (POST /chat and POST /conversation/<id>) are served natively: the async chat
+pipeline is awaited on the server's event loop, so a waiting chat holds no worker thread.
+Every other route is the Flask app behind a WSGI adapter.
+"""
+import io
+import os
+import re
+from urllib.parse import quote
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import render_template
+from werkzeug.formparser import FormDataParser
+from werkzeug.http import parse_options_header
+
+from __init__ import create_app
+from controller.web_controller import (
+    get_async_chat_service, render_chat_result, render_conversation_result
+)
+
+flask_app = create_app()
+wsgi_app = WsgiToAsgi(flask_app)
+
+CONVERSATION_PATH = re.compile(r"^/conversation/([^/]+)$")
+
+
+async def app(scope, receive, send):
+    """Route chat POSTs to the async pipeline and everything else to Flask"""
+    if scope["type"] == "http" and scope["method"] == "POST":
+        path = scope["path"]
+        match = CONVERSATION_PATH.match(path)
+        # Without the async pipeline the Flask views fall back to the synchronous service
+        if (path == "/chat" or match) and get_async_chat_service():
+            await _chat(scope, receive, send, match.group(1) if match else None)
+            return
+    await wsgi_app(scope, receive, send)
+
+
+async def _chat(scope, receive, send, path_conversation_id):
+    """Send a chat message and render the page, like the /chat and /conversation/<id> views"""
+    form = await _read_form(scope, receive)
+    if form is None:
+        await _respond(send, 413, b"Request Entity Too Large", b"text/plain; charset=utf-8")
+        return
+
+    message = form.get("message", "")
+    if not message:
+        # Same page the view shows for an empty message
+        await _respond(send, 303, b"", b"text/plain; charset=utf-8", [(b"location", quote(scope["path"]).encode())])
+        return
+
+    async_chat_service = get_async_chat_service()
+    conversation_id = path_conversation_id or form.get("conversation_id") or None
+    try:
+        response = await async_chat_service.send_text_message(
+            message, conversation_id, sidebar_limit=20, include_history=path_conversation_id is not None
+        )
+        with flask_app.test_request_context(scope["path"], method="POST"):
+            if path_conversation_id:
+                html = render_conversation_result(message, path_conversation_id, response)
+            else:
+                html = render_chat_result(message, response)
+    except Exception as e:
+        conversations = await async_chat_service.get_user_conversations(20)
+        with flask_app.test_request_context(scope["path"], method="POST"):
+            action = "continuando conversación" if path_conversation_id else "procesando mensaje"
+            html = render_template(
+                "index.html",
+                error=f"Error {action}: {str(e)}",
+                conversation_id=path_conversation_id,
+                conversations=conversations
+            )
+    await _respond(send, 200, html.encode("utf-8"), b"text/html; charset=utf-8")
+
+
+async def _read_form(scope, receive):
+    """Read and parse a urlencoded or multipart body; None when it exceeds MAX_CONTENT_LENGTH"""
+    max_length = flask_app.config.get("MAX_CONTENT_LENGTH")
+    headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+    body = bytearray()
+    more_body = True
+    while more_body:
+        event = await receive()
+        body.extend(event.get("body", b""))
+        more_body = event.get("more_body", False)
+        if max_length and len(body) > max_length:
+            return None
+
+    mimetype, options = parse_options_header(headers.get("content-type", ""))
+    _, form, _ = FormDataParser(max_content_length=max_length).parse(
+        io.BytesIO(bytes(body)), mimetype, len(body), options
+    )
+    return form
+
+
+async def _respond(send, status, body, content_type, extra_headers=None):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())]
+                   + (extra_headers or [])
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("asgi:app", host="0.0.0.0", port=int(os.getenv("PORT", "5000")))
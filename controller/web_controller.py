@@ -1,5 +1,6 @@
 import os
-from flask import Blueprint, render_template, request, redirect, url_for
+import json
+from flask import Blueprint, render_template, request, redirect, url_for, Response, stream_with_context, jsonify
 from dotenv import load_dotenv
 
 # Load environment variables first
@@ -7,6 +8,7 @@ load_dotenv()
 
 from service.chat_service_impl import ChatServiceImpl
 from service.rag_service_impl import RAGServiceImpl
+from service.async_runtime import get_async_runtime
 
 # Create Blueprint for web views
 web_bp = Blueprint('web', __name__)
@@ -32,6 +34,81 @@ def get_rag_service():
             get_rag_service.instance = None
     return get_rag_service.instance
 
+def get_async_chat_service():
+    """Get async chat pipeline instance, or None when disabled or unavailable"""
+    if not hasattr(get_async_chat_service, 'instance'):
+        get_async_chat_service.instance = None
+        chat_service = get_chat_service()
+        if chat_service and os.getenv('ASYNC_CHAT_ENABLED', 'true').lower() in ('1', 'true', 'yes'):
+            try:
+                from service.async_chat_service_impl import AsyncChatServiceImpl
+                get_async_chat_service.instance = AsyncChatServiceImpl(chat_service)
+            except ImportError as e:
+                print(f"Async chat pipeline not available, using synchronous service: {e}")
+    return get_async_chat_service.instance
+
+def get_ingestion_queue():
+    """Get background ingestion queue instance, or None when disabled or unavailable"""
+    if not hasattr(get_ingestion_queue, 'instance'):
+        get_ingestion_queue.instance = None
+        if os.getenv('INGESTION_QUEUE_ENABLED', 'true').lower() in ('1', 'true', 'yes'):
+            try:
+                from service.ingestion_queue import IngestionJobQueue
+                get_ingestion_queue.instance = IngestionJobQueue(on_file_processed=_index_processed_file)
+            except Exception as e:
+                print(f"Error initializing ingestion queue, processing uploads inline: {e}")
+    return get_ingestion_queue.instance
+
+def _index_processed_file(result):
+    """Apply fragments written or deleted by an ingestion worker to this process's vector index"""
+    rag_service = get_rag_service()
+    if rag_service:
+        rag_service.sync_ingestion_result(result)
+
+def send_chat_message(chat_service, message, conversation_id=None, include_history=False):
+    """
+    Envía un mensaje y obtiene también el sidebar (y opcionalmente el historial previo).
+    Usa el pipeline asíncrono cuando está disponible para solapar las lecturas con la generación.
+    Bajo WSGI el hilo del worker de Flask espera hasta que termina el pipeline; servido con
+    asgi.py, los POST de chat esperan el pipeline directamente en el event loop del servidor.
+    """
+    async_chat_service = get_async_chat_service()
+    if async_chat_service:
+        return get_async_runtime().run(
+            async_chat_service.send_text_message(
+                message, conversation_id, sidebar_limit=20, include_history=include_history
+            ),
+            timeout=float(os.getenv('ASYNC_CHAT_TIMEOUT', '120'))
+        )
+    
+    history = chat_service.get_recent_history(conversation_id) if include_history else []
+    response = chat_service.send_text_message(message, conversation_id)
+    response['conversations'] = chat_service.get_user_conversations(limit=20)
+    response['history'] = history
+    return response
+
+def render_chat_result(message, response):
+    """
+    Renderiza la respuesta de un mensaje nuevo.
+    Compartido con el endpoint ASGI (asgi.py), que atiende los POST de chat sin pasar por Flask.
+    """
+    # Conversaciones para el sidebar (cargadas tras guardar el mensaje)
+    return render_template('index.html',
+                         user_message=message,
+                         bot_response=response.get('response', ''),
+                         conversation_id=response.get('conversation_id', ''),
+                         conversations=response.get('conversations', []))
+
+def render_conversation_result(message, conversation_id, response):
+    """Renderiza la respuesta dentro de una conversación existente (también usado por asgi.py)"""
+    # Historial previo (cargado durante la generación) y sidebar
+    return render_template('index.html',
+                         conversation_history=response.get('history', []),
+                         user_message=message,
+                         bot_response=response.get('response', ''),
+                         conversation_id=conversation_id,
+                         conversations=response.get('conversations', []))
+
 
 @web_bp.route('/')
 def index():
@@ -72,17 +149,10 @@ def chat_page():
                 if not chat_service:
                     raise Exception("Chat service not available")
                 
-                response = chat_service.send_text_message(message, conversation_id)
-                
-                # Obtener conversaciones para el sidebar
-                conversations = chat_service.get_user_conversations(limit=20)
+                response = send_chat_message(chat_service, message, conversation_id)
                 
                 # Renderizar con respuesta
-                return render_template('index.html', 
-                                     user_message=message,
-                                     bot_response=response.get('response', ''),
-                                     conversation_id=response.get('conversation_id', ''),
-                                     conversations=conversations)
+                return render_chat_result(message, response)
             except Exception as e:
                 conversations = chat_service.get_user_conversations(limit=20)
                 return render_template('index.html',
@@ -97,6 +167,44 @@ def chat_page():
         return render_template('index.html', conversations=[], error=str(e))
 
 
+@web_bp.route('/chat/stream', methods=['GET', 'POST'])
+def chat_stream():
+    """
+    Chat con respuesta en streaming
+    Envía los tokens generados por Ollama al navegador mediante Server-Sent Events
+    """
+    message = request.values.get('message', '')
+    conversation_id = request.values.get('conversation_id') or None
+    
+    def sse(event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    
+    def generate():
+        if not message:
+            yield sse('error', {"error": "Mensaje vacío"})
+            return
+        
+        chat_service = get_chat_service()
+        if not chat_service:
+            yield sse('error', {"error": "Chat service not available"})
+            return
+        
+        try:
+            for event in chat_service.stream_text_message(message, conversation_id):
+                yield sse(event.pop('event'), event)
+        except Exception as e:
+            yield sse('error', {"error": f"Error procesando mensaje: {str(e)}"})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Evita que proxies como nginx acumulen la respuesta
+        }
+    )
+
+
 @web_bp.route('/upload', methods=['POST'])
 def upload_image():
     """
@@ -155,19 +263,10 @@ def view_conversation(conversation_id):
                 if not chat_service:
                     raise Exception("Chat service not available")
                 
-                response = chat_service.send_text_message(message, conversation_id)
-                
-                # Obtener historial actualizado
-                history = chat_service.get_conversation_history(conversation_id)
-                conversations = chat_service.get_user_conversations(limit=20)
+                response = send_chat_message(chat_service, message, conversation_id, include_history=True)
                 
                 # Renderizar con el nuevo mensaje y respuesta
-                return render_template('index.html',
-                                     conversation_history=history,
-                                     user_message=message,
-                                     bot_response=response.get('response', ''),
-                                     conversation_id=conversation_id,
-                                     conversations=conversations)
+                return render_conversation_result(message, conversation_id, response)
             except Exception as e:
                 chat_service = get_chat_service()
                 conversations = chat_service.get_user_conversations(limit=20) if chat_service else []
@@ -184,13 +283,25 @@ def view_conversation(conversation_id):
                                  error="Chat service not available",
                                  conversations=[])
         
-        history = chat_service.get_conversation_history(conversation_id)
+        # La página más reciente; ?before=<cursor> muestra la anterior y ?after=<cursor> la siguiente
+        page = chat_service.get_conversation_history(
+            conversation_id, before=request.args.get('before'), after=request.args.get('after')
+        )
         conversations = chat_service.get_user_conversations(limit=20)
         
         return render_template('index.html',
-                             conversation_history=history,
+                             conversation_history=page['entries'],
+                             previous_cursor=page['previous_cursor'],
+                             next_cursor=page['next_cursor'],
                              conversation_id=conversation_id,
                              conversations=conversations)
+    except ValueError as e:
+        # Cursor de paginación mal formado
+        conversations = chat_service.get_user_conversations(limit=20)
+        return render_template('index.html',
+                             error=f"Página de historial no válida: {str(e)}",
+                             conversation_id=conversation_id,
+                             conversations=conversations), 400
     except Exception as e:
         chat_service = get_chat_service()
         conversations = chat_service.get_user_conversations(limit=20) if chat_service else []
@@ -246,10 +357,20 @@ def documents():
             document_type = request.form.get('document_type', 'other')
             specialty = request.form.get('specialty', 'general')
             description = request.form.get('description', '')
+            incremental = request.form.get('incremental') == 'on'
+            
+            # Queue documents for background processing
+            ingestion_queue = get_ingestion_queue()
+            if ingestion_queue:
+                job_id = ingestion_queue.submit(uploaded_files, document_type, specialty, description, incremental)
+                return render_template('documents.html',
+                                     job_id=job_id,
+                                     success_message="Documentos recibidos. Procesando en segundo plano...",
+                                     documents=rag_service.get_all_documents())
             
             # Process documents
             result = rag_service.process_documents(
-                uploaded_files, document_type, specialty, description
+                uploaded_files, document_type, specialty, description, incremental
             )
             
             if result['errors']:
@@ -282,6 +403,18 @@ def documents():
                              documents=[])
 
 
+@web_bp.route('/documents/jobs/<job_id>', methods=['GET'])
+def document_job_status(job_id):
+    """
+    Estado de un trabajo de ingesta en segundo plano (archivos procesados, fragmentos, errores)
+    """
+    ingestion_queue = get_ingestion_queue()
+    job = ingestion_queue.get_job(job_id) if ingestion_queue else None
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
 @web_bp.route('/documents/delete/<document_id>', methods=['POST'])
 def delete_document(document_id):
     """
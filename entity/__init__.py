@@ -6,9 +6,11 @@ Contains all domain entities with MongoDB compatibility.
 from .chat_history import ChatHistory
 from .metadata_document import MetadataDocument
 from .fragment_document import FragmentDocument
+from .conversation_memory import ConversationMemory
 
 __all__ = [
     'ChatHistory',
     'MetadataDocument', 
-    'FragmentDocument'
+    'FragmentDocument',
+    'ConversationMemory'
 ]
\ No newline at end of file
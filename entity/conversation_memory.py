@@ -0,0 +1,52 @@
+from datetime import datetime
+from typing import Optional
+from dataclasses import dataclass, field
+from bson import ObjectId
+
+
+@dataclass
+class ConversationMemory:
+    """
+    Entity holding the rolling summary of a conversation's older turns.
+    Turns up to the (summarized_until, summarized_until_id) key are covered by the summary;
+    later turns are read from chat history.
+    """
+    conversation_id: str
+    summary: str = ""
+    summarized_until: Optional[datetime] = None  # Date of the last turn folded into the summary
+    summarized_until_id: Optional[ObjectId] = None  # Its _id, which orders turns with the same date
+    summarized_turns: int = 0
+    updated_at: datetime = field(default_factory=datetime.now)
+    id: Optional[str] = None
+    
+    def __post_init__(self):
+        """Ensure timestamp is set"""
+        if self.updated_at is None:
+            self.updated_at = datetime.now()
+    
+    def to_dict(self) -> dict:
+        """Convert entity to MongoDB document format"""
+        doc = {
+            "conversation_id": self.conversation_id,
+            "summary": self.summary,
+            "summarized_until": self.summarized_until,
+            "summarized_until_id": self.summarized_until_id,
+            "summarized_turns": self.summarized_turns,
+            "updated_at": self.updated_at
+        }
+        if self.id:
+            doc["_id"] = ObjectId(self.id) if isinstance(self.id, str) else self.id
+        return doc
+    
+    @classmethod
+    def from_dict(cls, doc: dict) -> 'ConversationMemory':
+        """Create entity from MongoDB document"""
+        return cls(
+            id=str(doc.get("_id")) if doc.get("_id") else None,
+            conversation_id=doc["conversation_id"],
+            summary=doc.get("summary", ""),
+            summarized_until=doc.get("summarized_until"),
+            summarized_until_id=doc.get("summarized_until_id"),
+            summarized_turns=doc.get("summarized_turns", 0),
+            updated_at=doc.get("updated_at", datetime.now())
+        )
@@ -14,6 +14,9 @@ class FragmentDocument:
     chunk_index: int
     content: str
     embedding: List[float]  # Vector embeddings for similarity search
+    page_start: Optional[int] = None  # First source page (PDFs only)
+    page_end: Optional[int] = None  # Last source page (PDFs only)
+    content_hash: Optional[str] = None  # SHA-256 of content, used for incremental re-ingestion
     created_at: datetime = field(default_factory=datetime.now)
     updated_at: datetime = field(default_factory=datetime.now)
     id: Optional[str] = None
@@ -32,6 +35,9 @@ class FragmentDocument:
             "chunk_index": self.chunk_index,
             "content": self.content,
             "embedding": self.embedding,
+            "page_start": self.page_start,
+            "page_end": self.page_end,
+            "content_hash": self.content_hash,
             "created_at": self.created_at,
             "updated_at": self.updated_at
         }
@@ -47,7 +53,10 @@ class FragmentDocument:
             id_metadata_document=doc["id_metadata_document"],
             chunk_index=doc["chunk_index"],
             content=doc["content"],
-            embedding=doc["embedding"],
+            embedding=doc.get("embedding"),  # absent when read with a light projection
+            page_start=doc.get("page_start"),
+            page_end=doc.get("page_end"),
+            content_hash=doc.get("content_hash"),
             created_at=doc.get("created_at", datetime.now()),
             updated_at=doc.get("updated_at", datetime.now())
         )
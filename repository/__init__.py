@@ -7,10 +7,15 @@ from .base_repository import BaseRepository
 from .chat_history_repository import ChatHistoryRepository
 from .metadata_document_repository import MetadataDocumentRepository
 from .fragment_document_repository import FragmentDocumentRepository
+from .conversation_memory_repository import ConversationMemoryRepository
+from .mongo_client_registry import get_mongo_client, close_mongo_clients
 
 __all__ = [
     'BaseRepository',
     'ChatHistoryRepository',
     'MetadataDocumentRepository',
-    'FragmentDocumentRepository'
+    'FragmentDocumentRepository',
+    'ConversationMemoryRepository',
+    'get_mongo_client',
+    'close_mongo_clients'
 ]
\ No newline at end of file
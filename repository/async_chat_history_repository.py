@@ -0,0 +1,72 @@
+from typing import List, Dict, Any
+from pymongo.errors import PyMongoError
+from .mongo_client_registry import get_async_mongo_client
+from .chat_history_repository import CONVERSATIONS_COLLECTION, conversation_summary_update
+
+
+class AsyncChatHistoryRepository:
+    """
+    Asyncio (Motor) repository for the chat history collection.
+    Mirrors the read/write operations ChatHistoryRepository offers to the chat path.
+    """
+    
+    def __init__(self, collection_name: str = "chat_history"):
+        self.collection_name = collection_name
+    
+    @property
+    def collection(self):
+        """Collection handle bound to the running event loop's client"""
+        return get_async_mongo_client().get_database("medico_ia")[self.collection_name]
+    
+    @property
+    def conversations(self):
+        """Materialized conversation summary collection bound to the running event loop's client"""
+        return get_async_mongo_client().get_database("medico_ia")[CONVERSATIONS_COLLECTION]
+    
+    async def save(self, entity: Dict[str, Any]) -> str:
+        """Save chat history and return ID"""
+        try:
+            result = await self.collection.insert_one(entity)
+            await self.conversations.update_one(
+                {"_id": entity["conversation_id"]},
+                conversation_summary_update(entity),
+                upsert=True
+            )
+            return str(result.inserted_id)
+        except PyMongoError as e:
+            print(f"Error saving chat history: {e}")
+            raise
+    
+    async def find_by_conversation_id(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """Find all chat histories for a specific conversation"""
+        try:
+            cursor = self.collection.find(
+                {"conversation_id": conversation_id}
+            ).sort([("date", 1), ("_id", 1)])
+            return await cursor.to_list(length=None)
+        except PyMongoError as e:
+            print(f"Error finding chat histories for conversation {conversation_id}: {e}")
+            return []
+    
+    async def find_recent_by_conversation_id(self, conversation_id: str, limit: int) -> List[Dict[str, Any]]:
+        """Find the last `limit` chat histories of a conversation, oldest first"""
+        try:
+            cursor = self.collection.find(
+                {"conversation_id": conversation_id}
+            ).sort([("date", -1), ("_id", -1)]).limit(limit)
+            return list(reversed(await cursor.to_list(length=limit)))
+        except PyMongoError as e:
+            print(f"Error finding recent chat histories for conversation {conversation_id}: {e}")
+            return []
+    
+    async def get_recent_conversations(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Get recent conversations from the materialized summary collection"""
+        try:
+            cursor = self.conversations.find(
+                {},
+                {"last_message": 1, "last_response": 1, "last_date": 1, "message_count": 1}
+            ).sort("last_date", -1).limit(limit)
+            return await cursor.to_list(length=limit)
+        except PyMongoError as e:
+            print(f"Error getting recent conversations: {e}")
+            return []
@@ -1,9 +1,12 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterable
+from itertools import islice
 from pymongo import MongoClient
 from pymongo.collection import Collection
 from pymongo.database import Database
+from pymongo.errors import PyMongoError
 import os
+from .mongo_client_registry import get_mongo_client
 
 
 class BaseRepository(ABC):
@@ -12,19 +15,29 @@ class BaseRepository(ABC):
     Follows Repository pattern for SOLID principles.
     """
     
+    DATABASE_NAME = "medico_ia"  # Nombre fijo de la base de datos
+    
     def __init__(self, collection_name: str):
-        self.client: MongoClient = self._get_mongo_client()
-        self.db: Database = self.client.get_database("medico_ia")  # Nombre fijo de la base de datos
-        self.collection: Collection = self.db[collection_name]
+        self.collection_name = collection_name
+    
+    # The client is looked up on every use, so a repository created before a fork
+    # uses the child's own connection pool rather than the parent's
+    
+    @property
+    def client(self) -> MongoClient:
+        return self._get_mongo_client()
+    
+    @property
+    def db(self) -> Database:
+        return self.client.get_database(self.DATABASE_NAME)
+    
+    @property
+    def collection(self) -> Collection:
+        return self.db[self.collection_name]
     
     def _get_mongo_client(self) -> MongoClient:
-        """Get MongoDB client from environment variables"""
-        mongo_uri = os.getenv('DATABASE_URL')
-        if not mongo_uri:
-            raise ValueError("DATABASE_URL environment variable not found. Please check your .env file.")
-        
-        print(f"Connecting to MongoDB: {mongo_uri[:20]}..." if len(mongo_uri) > 20 else mongo_uri)
-        return MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+        """Get the shared, pooled MongoDB client from environment variables"""
+        return get_mongo_client()
     
     @abstractmethod
     def find_by_id(self, entity_id: str) -> Optional[Dict[str, Any]]:
@@ -51,7 +64,37 @@ class BaseRepository(ABC):
         """Find all entities with optional filters"""
         pass
     
+    def save_many(self, entities: Iterable[Dict[str, Any]], batch_size: Optional[int] = None) -> List[str]:
+        """
+        Save several entities with unordered bulk inserts.
+        Entities are consumed lazily one batch at a time, so a generator keeps memory bounded.
+        Returns the inserted IDs in the same order as the input entities.
+        """
+        iterator = iter(entities)
+        batch_size = max(1, batch_size or int(os.getenv('MONGO_BULK_BATCH_SIZE', '1000')))
+        
+        inserted_ids: List[str] = []
+        try:
+            while True:
+                batch = list(islice(iterator, batch_size))
+                if not batch:
+                    return inserted_ids
+                # IDs are assigned client-side, so they follow input order even when unordered
+                result = self.collection.insert_many(batch, ordered=False)
+                batch_ids = [str(entity_id) for entity_id in result.inserted_ids]
+                self._after_insert_many(batch, batch_ids)
+                inserted_ids.extend(batch_ids)
+        except PyMongoError as e:
+            print(f"Error bulk saving into {self.collection.name}: {e}")
+            raise
+    
+    def _after_insert_many(self, entities: List[Dict[str, Any]], entity_ids: List[str]):
+        """Hook called after each bulk insert batch"""
+        pass
+    
     def close_connection(self):
-        """Close MongoDB connection"""
-        if self.client:
-            self.client.close()
\ No newline at end of file
+        """
+        Release this repository's connection.
+        The client is shared by every repository, so it is only closed on shutdown (close_mongo_clients).
+        """
+        pass
\ No newline at end of file
@@ -1,10 +1,37 @@
-from typing import List, Optional, Dict, Any
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Any, Tuple
 from bson import ObjectId
-from pymongo.errors import PyMongoError
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError, DuplicateKeyError
 from .base_repository import BaseRepository
 from entity.chat_history import ChatHistory
 
 
+# Materialized per-conversation summary (last prompt/response/date, message count) for the sidebar
+CONVERSATIONS_COLLECTION = "conversations"
+
+# One document per one-time data migration: {_id: name, status: "running" | "done", started_at, completed_at}
+MIGRATIONS_COLLECTION = "schema_migrations"
+CONVERSATIONS_BACKFILL = "conversations_backfill"
+
+
+def conversation_summary_update(entity: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Pipeline update folding one saved chat history into its conversation summary.
+    Last-message fields only move forward in time, so out-of-order saves keep the newest turn.
+    """
+    date = entity.get("date") or datetime.now()
+    is_newest = {"$gte": [date, {"$ifNull": ["$last_date", date]}]}
+    return [{"$set": {
+        "last_message": {"$cond": [is_newest, {"$literal": entity.get("prompt", "")}, "$last_message"]},
+        "last_response": {"$cond": [is_newest, {"$literal": entity.get("response", "")}, "$last_response"]},
+        "last_date": {"$max": [{"$ifNull": ["$last_date", date]}, date]},
+        "first_date": {"$min": [{"$ifNull": ["$first_date", date]}, date]},
+        "message_count": {"$add": [{"$ifNull": ["$message_count", 0]}, 1]}
+    }}]
+
+
 class ChatHistoryRepository(BaseRepository):
     """
     Repository for ChatHistory entity operations.
@@ -13,6 +40,34 @@ class ChatHistoryRepository(BaseRepository):
     
     def __init__(self):
         super().__init__("chat_history")
+        self._create_indexes()
+    
+    @property
+    def conversations(self) -> Collection:
+        """Materialized conversation summary collection"""
+        return self.db[CONVERSATIONS_COLLECTION]
+    
+    def _create_indexes(self):
+        """Create necessary indexes for optimal performance"""
+        try:
+            # Skip index creation if using Atlas (requires special permissions)
+            database_url = os.getenv('DATABASE_URL', '')
+            if "mongodb.net" in database_url or "mongodb+srv" in database_url:
+                print("MongoDB Atlas detected, skipping index creation")
+                return
+            
+            # Conversation history in order (filter, sort and keyset pagination); also serves delete_conversation
+            self.collection.create_index([
+                ("conversation_id", 1),
+                ("date", 1),
+                ("_id", 1)
+            ])
+            # Recent messages across conversations
+            self.collection.create_index([("date", -1)])
+            # Sidebar: most recent conversations first
+            self.conversations.create_index([("last_date", -1)])
+        except PyMongoError as e:
+            print(f"Error creating indexes: {e}")
     
     def find_by_id(self, entity_id: str) -> Optional[Dict[str, Any]]:
         """Find chat history by ID"""
@@ -26,6 +81,11 @@ class ChatHistoryRepository(BaseRepository):
         """Save chat history and return ID"""
         try:
             result = self.collection.insert_one(entity)
+            self.conversations.update_one(
+                {"_id": entity["conversation_id"]},
+                conversation_summary_update(entity),
+                upsert=True
+            )
             return str(result.inserted_id)
         except PyMongoError as e:
             print(f"Error saving chat history: {e}")
@@ -66,37 +126,165 @@ class ChatHistoryRepository(BaseRepository):
         try:
             cursor = self.collection.find(
                 {"conversation_id": conversation_id}
-            ).sort("date", 1)
+            ).sort([("date", 1), ("_id", 1)])
             return list(cursor)
         except PyMongoError as e:
             print(f"Error finding chat histories for conversation {conversation_id}: {e}")
             return []
     
+    def find_page(self, conversation_id: str, after: Optional[Tuple[datetime, ObjectId]], limit: int) -> List[Dict[str, Any]]:
+        """
+        Keyset page of a conversation's chat histories in (date, _id) order, starting
+        after the (date, _id) of the last entry of the previous page (from the start when None)
+        """
+        try:
+            query = self._keyset_query(conversation_id, after)
+            cursor = self.collection.find(query).sort([("date", 1), ("_id", 1)]).limit(limit)
+            return list(cursor)
+        except PyMongoError as e:
+            print(f"Error finding chat history page for conversation {conversation_id}: {e}")
+            return []
+    
+    def find_recent_by_conversation_id(self, conversation_id: str, limit: int,
+                                       after: Optional[Tuple[datetime, ObjectId]] = None,
+                                       before: Optional[Tuple[datetime, ObjectId]] = None) -> List[Dict[str, Any]]:
+        """
+        Find the last `limit` chat histories of a conversation, oldest first
+        (only those after the (date, _id) key `after` and before the key `before` if given)
+        """
+        try:
+            query = self._keyset_query(conversation_id, after, before)
+            cursor = self.collection.find(
+                query,
+                {"conversation_id": 1, "prompt": 1, "response": 1, "date": 1}
+            ).sort([("date", -1), ("_id", -1)]).limit(limit)
+            return list(reversed(list(cursor)))
+        except PyMongoError as e:
+            print(f"Error finding recent chat histories for conversation {conversation_id}: {e}")
+            return []
     
     def delete_conversation(self, conversation_id: str) -> bool:
         """Delete all chat histories for a conversation"""
         try:
             result = self.collection.delete_many({"conversation_id": conversation_id})
+            self.conversations.delete_one({"_id": conversation_id})
             return result.deleted_count > 0
         except PyMongoError as e:
             print(f"Error deleting conversation {conversation_id}: {e}")
             return False
     
     def get_recent_conversations(self, limit: int = 10) -> List[Dict[str, Any]]:
-        """Get recent conversations"""
+        """Get recent conversations from the materialized summary collection (an indexed top-`limit` read)"""
         try:
-            pipeline = [
-                {"$group": {
-                    "_id": "$conversation_id",
-                    "last_message": {"$last": "$prompt"},
-                    "last_response": {"$last": "$response"},
-                    "last_date": {"$max": "$date"},
-                    "message_count": {"$sum": 1}
-                }},
-                {"$sort": {"last_date": -1}},
-                {"$limit": limit}
-            ]
-            return list(self.collection.aggregate(pipeline))
+            cursor = self.conversations.find(
+                {},
+                {"last_message": 1, "last_response": 1, "last_date": 1, "message_count": 1}
+            ).sort("last_date", -1).limit(limit)
+            return list(cursor)
         except PyMongoError as e:
             print(f"Error getting recent conversations: {e}")
-            return []
\ No newline at end of file
+            return []
+    
+    def rebuild_conversations(self) -> int:
+        """
+        Recompute the conversations collection from chat_history and return how many conversations it holds.
+        Summaries saved while the rebuild runs are merged, not replaced: the newer last turn and
+        the larger message count win.
+        """
+        rebuilt_at = datetime.now()
+        is_newer = {"$gte": ["$$new.last_date", {"$ifNull": ["$last_date", "$$new.last_date"]}]}
+        pipeline = [
+            {"$sort": {"conversation_id": 1, "date": 1, "_id": 1}},
+            {"$group": {
+                "_id": "$conversation_id",
+                "last_message": {"$last": "$prompt"},
+                "last_response": {"$last": "$response"},
+                "last_date": {"$last": "$date"},
+                "first_date": {"$first": "$date"},
+                "message_count": {"$sum": 1}
+            }},
+            {"$set": {"rebuilt_at": rebuilt_at}},
+            {"$merge": {
+                "into": CONVERSATIONS_COLLECTION,
+                "on": "_id",
+                "whenMatched": [{"$set": {
+                    "last_message": {"$cond": [is_newer, "$$new.last_message", "$last_message"]},
+                    "last_response": {"$cond": [is_newer, "$$new.last_response", "$last_response"]},
+                    "last_date": {"$max": ["$last_date", "$$new.last_date"]},
+                    "first_date": {"$min": ["$first_date", "$$new.first_date"]},
+                    "message_count": {"$max": ["$message_count", "$$new.message_count"]},
+                    "rebuilt_at": "$$new.rebuilt_at"
+                }}],
+                "whenNotMatched": "insert"
+            }}
+        ]
+        self.collection.aggregate(pipeline, allowDiskUse=True)
+        # Conversations left over from deleted history (concurrent saves carry a newer last_date)
+        self.conversations.delete_many({"rebuilt_at": {"$ne": rebuilt_at}, "last_date": {"$lt": rebuilt_at}})
+        count = self.conversations.count_documents({})
+        # A full rebuild also covers the one-time backfill
+        self._complete_migration(CONVERSATIONS_BACKFILL, count)
+        return count
+    
+    def backfill_conversations(self) -> Optional[int]:
+        """
+        One-time migration filling the conversations collection from chat history written before it existed.
+        Tracked by a marker in schema_migrations rather than by the collection being empty, so summaries
+        upserted by new chats do not hide it; only one process runs it. Returns the number of conversations,
+        or None if it was already done or is running elsewhere.
+        """
+        if not self._claim_migration(CONVERSATIONS_BACKFILL):
+            return None
+        try:
+            return self.rebuild_conversations()
+        except Exception:
+            # Release the marker so the next start retries
+            self.db[MIGRATIONS_COLLECTION].delete_one({"_id": CONVERSATIONS_BACKFILL, "status": "running"})
+            raise
+    
+    def _claim_migration(self, name: str) -> bool:
+        """Mark a migration as running in this process; False if it is done or another process holds it"""
+        now = datetime.now()
+        stale = now - timedelta(seconds=int(os.getenv('MIGRATION_LOCK_SECONDS', '600')))
+        try:
+            # Matches only an abandoned run; otherwise the upsert collides with the existing marker
+            self.db[MIGRATIONS_COLLECTION].update_one(
+                {"_id": name, "status": {"$ne": "done"}, "started_at": {"$lt": stale}},
+                {"$set": {"status": "running", "started_at": now}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+    
+    def _complete_migration(self, name: str, count: int):
+        self.db[MIGRATIONS_COLLECTION].update_one(
+            {"_id": name},
+            {"$set": {"status": "done", "completed_at": datetime.now(), "count": count}},
+            upsert=True
+        )
+    
+    @staticmethod
+    def _keyset_query(conversation_id: str, after: Optional[Tuple[datetime, ObjectId]],
+                      before: Optional[Tuple[datetime, ObjectId]] = None) -> Dict[str, Any]:
+        """Chat histories of a conversation between the (date, _id) keys `after` and `before` (unbounded when None)"""
+        query: Dict[str, Any] = {"conversation_id": conversation_id}
+        # Turns saved in the same millisecond are ordered by _id
+        bounds = []
+        if after is not None:
+            after_date, after_id = after
+            bounds.append({"$or": [
+                {"date": {"$gt": after_date}},
+                {"date": after_date, "_id": {"$gt": after_id}}
+            ]})
+        if before is not None:
+            before_date, before_id = before
+            bounds.append({"$or": [
+                {"date": {"$lt": before_date}},
+                {"date": before_date, "_id": {"$lt": before_id}}
+            ]})
+        if len(bounds) == 1:
+            query.update(bounds[0])
+        elif bounds:
+            query["$and"] = bounds
+        return query
@@ -0,0 +1,147 @@
+import os
+from datetime import datetime
+from typing import List, Optional, Dict, Any, Tuple
+from bson import ObjectId
+from bson.binary import Binary
+from pymongo.errors import PyMongoError
+from .base_repository import BaseRepository
+
+
+class ConversationMemoryRepository(BaseRepository):
+    """
+    Repository for ConversationMemory entity operations.
+    Stores one document per conversation, next to chat history: the rolling summary and,
+    optionally, the last Ollama generation context.
+    """
+    
+    def __init__(self):
+        super().__init__("conversation_memory")
+        self._create_indexes()
+    
+    def _create_indexes(self):
+        """Create necessary indexes for optimal performance"""
+        try:
+            # Skip index creation if using Atlas (requires special permissions)
+            database_url = os.getenv('DATABASE_URL', '')
+            if "mongodb.net" in database_url or "mongodb+srv" in database_url:
+                print("MongoDB Atlas detected, skipping index creation")
+                return
+            
+            # One memory document per conversation
+            self.collection.create_index("conversation_id", unique=True)
+        except PyMongoError as e:
+            print(f"Error creating indexes: {e}")
+    
+    def find_by_id(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        """Find conversation memory by ID"""
+        try:
+            return self.collection.find_one({"_id": ObjectId(entity_id)})
+        except (PyMongoError, ValueError) as e:
+            print(f"Error finding conversation memory by ID {entity_id}: {e}")
+            return None
+    
+    def find_by_conversation_id(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """Find the memory document of a conversation"""
+        try:
+            return self.collection.find_one({"conversation_id": conversation_id})
+        except PyMongoError as e:
+            print(f"Error finding conversation memory for {conversation_id}: {e}")
+            return None
+    
+    def save(self, entity: Dict[str, Any]) -> str:
+        """Save conversation memory and return ID"""
+        try:
+            result = self.collection.insert_one(entity)
+            return str(result.inserted_id)
+        except PyMongoError as e:
+            print(f"Error saving conversation memory: {e}")
+            raise
+    
+    def advance_summary(self, conversation_id: str, summary: str, summarized_until: Tuple[datetime, ObjectId],
+                        added_turns: int, expected_until: Tuple[Optional[datetime], Optional[ObjectId]]) -> bool:
+        """
+        Replace the summary and move the (summarized_until, summarized_until_id) watermark forward,
+        only if no other summarization has moved it since expected_until was read (False otherwise)
+        """
+        expected_date, expected_id = expected_until
+        until_date, until_id = summarized_until
+        try:
+            result = self.collection.update_one(
+                {"conversation_id": conversation_id, "summarized_until": expected_date, "summarized_until_id": expected_id},
+                {
+                    "$set": {"summary": summary, "summarized_until": until_date, "summarized_until_id": until_id,
+                             "updated_at": datetime.now()},
+                    "$inc": {"summarized_turns": added_turns}
+                },
+                upsert=expected_date is None
+            )
+            return result.modified_count > 0 or result.upserted_id is not None
+        except PyMongoError as e:
+            # A concurrent first summary wins the unique index race
+            print(f"Error updating conversation memory for {conversation_id}: {e}")
+            return False
+    
+    def find_generation_context(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """Find the stored Ollama generation context of a conversation"""
+        try:
+            return self.collection.find_one(
+                {"conversation_id": conversation_id},
+                {"generation_context": 1, "generation_model": 1}
+            )
+        except PyMongoError as e:
+            print(f"Error finding generation context for {conversation_id}: {e}")
+            return None
+    
+    def save_generation_context(self, conversation_id: str, model: Optional[str], packed_context: Optional[bytes]) -> bool:
+        """Store (or clear, with None) the packed int32 Ollama generation context of a conversation"""
+        try:
+            result = self.collection.update_one(
+                {"conversation_id": conversation_id},
+                {"$set": {
+                    "generation_context": Binary(packed_context) if packed_context else None,
+                    "generation_model": model
+                }},
+                upsert=packed_context is not None
+            )
+            return result.modified_count > 0 or result.upserted_id is not None
+        except PyMongoError as e:
+            print(f"Error saving generation context for {conversation_id}: {e}")
+            return False
+    
+    def update(self, entity_id: str, update_data: Dict[str, Any]) -> bool:
+        """Update conversation memory by ID"""
+        try:
+            result = self.collection.update_one(
+                {"_id": ObjectId(entity_id)},
+                {"$set": update_data}
+            )
+            return result.modified_count > 0
+        except (PyMongoError, ValueError) as e:
+            print(f"Error updating conversation memory {entity_id}: {e}")
+            return False
+    
+    def delete(self, entity_id: str) -> bool:
+        """Delete conversation memory by ID"""
+        try:
+            result = self.collection.delete_one({"_id": ObjectId(entity_id)})
+            return result.deleted_count > 0
+        except (PyMongoError, ValueError) as e:
+            print(f"Error deleting conversation memory {entity_id}: {e}")
+            return False
+    
+    def delete_by_conversation_id(self, conversation_id: str) -> bool:
+        """Delete the memory document of a conversation"""
+        try:
+            result = self.collection.delete_one({"conversation_id": conversation_id})
+            return result.deleted_count > 0
+        except PyMongoError as e:
+            print(f"Error deleting conversation memory for {conversation_id}: {e}")
+            return False
+    
+    def find_all(self, **filters) -> List[Dict[str, Any]]:
+        """Find all conversation memories with optional filters"""
+        try:
+            return list(self.collection.find(filters))
+        except PyMongoError as e:
+            print(f"Error finding conversation memories: {e}")
+            return []
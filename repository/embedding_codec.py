@@ -0,0 +1,76 @@
+import os
+import struct
+from typing import Any, Optional
+
+import numpy as np
+from bson.binary import Binary, USER_DEFINED_SUBTYPE
+
+
+# Storage formats for fragment embeddings; "list" is the plain BSON array of doubles
+EMBEDDING_FORMATS = ("list", "float32", "float16", "int8")
+
+# Binary layout: 1-byte format tag, 3 padding bytes, float32 scale (int8 only), then the packed vector.
+# The 8-byte header keeps the payload aligned for np.frombuffer.
+_HEADER = struct.Struct("<B3xf")
+_TAGS = {"float32": 1, "float16": 2, "int8": 3}
+_DTYPES = {1: np.float32, 2: np.float16, 3: np.int8}
+
+
+def get_embedding_format() -> str:
+    """
+    Configured storage format for new embeddings (EMBEDDING_STORAGE_FORMAT, default list).
+    Atlas $vectorSearch indexes only the list format.
+    """
+    storage_format = os.getenv('EMBEDDING_STORAGE_FORMAT', 'list').lower()
+    if storage_format not in EMBEDDING_FORMATS:
+        raise ValueError(f"Unknown EMBEDDING_STORAGE_FORMAT {storage_format!r}, expected one of {EMBEDDING_FORMATS}")
+    return storage_format
+
+
+def encode_embedding(embedding: Any, storage_format: Optional[str] = None) -> Any:
+    """Convert an embedding to its stored representation (a list or packed BSON binary)"""
+    if embedding is None:
+        return None
+    storage_format = storage_format or get_embedding_format()
+    if storage_format == "list":
+        return embedding if isinstance(embedding, list) else np.asarray(embedding, dtype=np.float64).ravel().tolist()
+
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+
+    scale = 1.0
+    if storage_format == "int8":
+        # Symmetric quantization: the largest magnitude maps to 127
+        peak = float(np.max(np.abs(vector))) if vector.size else 0.0
+        scale = peak / 127.0 if peak > 0 else 1.0
+        packed = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+    else:
+        packed = vector.astype(_DTYPES[_TAGS[storage_format]])
+
+    return Binary(_HEADER.pack(_TAGS[storage_format], scale) + packed.tobytes(), USER_DEFINED_SUBTYPE)
+
+
+def decode_embedding(value: Any) -> Optional[np.ndarray]:
+    """
+    Convert a stored embedding to a NumPy vector.
+    float32 and float16 binaries are returned as zero-copy views over the BSON bytes;
+    int8 is dequantized to float32; legacy lists are converted to float32.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        tag, scale = _HEADER.unpack_from(value)
+        vector = np.frombuffer(value, dtype=_DTYPES[tag], offset=_HEADER.size)
+        if tag == _TAGS["int8"]:
+            return vector.astype(np.float32) * np.float32(scale)
+        return vector
+    return np.asarray(value, dtype=np.float32)
+
+
+def embedding_format_of(value: Any) -> Optional[str]:
+    """Storage format of a stored embedding, or None if there is none"""
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        tag = _HEADER.unpack_from(value)[0]
+        return next(name for name, known_tag in _TAGS.items() if known_tag == tag)
+    return "list"
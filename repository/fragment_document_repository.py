@@ -1,8 +1,13 @@
 import os
-from typing import List, Optional, Dict, Any
+import threading
+from typing import List, Optional, Dict, Any, Tuple, Iterable
 from bson import ObjectId
+from pymongo import UpdateOne
 from pymongo.errors import PyMongoError
 from .base_repository import BaseRepository
+from .vector_index import VectorIndex
+from .ivf_index import IVFIndex
+from .embedding_codec import encode_embedding, decode_embedding, embedding_format_of, get_embedding_format
 
 
 class FragmentDocumentRepository(BaseRepository):
@@ -11,6 +16,20 @@ class FragmentDocumentRepository(BaseRepository):
     Handles document fragments and vector search for RAG system.
     """
     
+    # In-memory vector indexes shared by every repository instance in the process,
+    # keyed by collection full name so all services see the same writes
+    _vector_indexes: Dict[str, Any] = {}
+    _vector_indexes_lock = threading.Lock()
+    # Per-collection build locks: a cold build or load only blocks searches on its own collection
+    _vector_index_build_locks: Dict[str, threading.Lock] = {}
+    
+    # Read projections: LIGHT drops the embedding (most of each document's size),
+    # REFERENCE keeps only what is needed to locate a fragment
+    LIGHT_PROJECTION = {"embedding": 0}
+    REFERENCE_PROJECTION = {"id_metadata_document": 1, "chunk_index": 1, "page_start": 1, "page_end": 1}
+    # What the vector index keeps per fragment
+    INDEX_PROJECTION = {"embedding": 1, "id_metadata_document": 1}
+    
     def __init__(self):
         super().__init__("fragment_document")
         self._create_indexes()
@@ -46,10 +65,11 @@ class FragmentDocumentRepository(BaseRepository):
         except PyMongoError as e:
             print(f"Error creating indexes: {e}")
     
-    def find_by_id(self, entity_id: str) -> Optional[Dict[str, Any]]:
-        """Find fragment document by ID"""
+    def find_by_id(self, entity_id: str, projection: Optional[Dict[str, Any]] = None,
+                   as_array: bool = False) -> Optional[Dict[str, Any]]:
+        """Find fragment document by ID (as_array: embedding as a NumPy vector instead of a list)"""
         try:
-            return self.collection.find_one({"_id": ObjectId(entity_id)})
+            return self._decode(self.collection.find_one({"_id": ObjectId(entity_id)}, projection), as_array)
         except (PyMongoError, ValueError) as e:
             print(f"Error finding fragment document by ID {entity_id}: {e}")
             return None
@@ -57,19 +77,37 @@ class FragmentDocumentRepository(BaseRepository):
     def save(self, entity: Dict[str, Any]) -> str:
         """Save fragment document and return ID"""
         try:
+            entity = self._encode(entity)
             result = self.collection.insert_one(entity)
-            return str(result.inserted_id)
+            fragment_id = str(result.inserted_id)
+            self._index_add(fragment_id, decode_embedding(entity.get("embedding")), entity.get("id_metadata_document"))
+            return fragment_id
         except PyMongoError as e:
             print(f"Error saving fragment document: {e}")
             raise
     
+    def save_many(self, entities: Iterable[Dict[str, Any]], batch_size: Optional[int] = None) -> List[str]:
+        """Bulk save fragment documents (embeddings in the configured storage format)"""
+        return super().save_many((self._encode(entity) for entity in entities), batch_size)
+    
+    def _after_insert_many(self, entities: List[Dict[str, Any]], entity_ids: List[str]):
+        """Index each bulk-inserted batch of fragments"""
+        for fragment_id, entity in zip(entity_ids, entities):
+            self._index_add(fragment_id, decode_embedding(entity.get("embedding")), entity.get("id_metadata_document"))
+    
     def update(self, entity_id: str, update_data: Dict[str, Any]) -> bool:
         """Update fragment document by ID"""
         try:
             result = self.collection.update_one(
                 {"_id": ObjectId(entity_id)},
-                {"$set": update_data}
+                {"$set": self._encode(update_data)}
             )
+            if "embedding" in update_data:
+                metadata_doc_id = update_data.get("id_metadata_document")
+                if metadata_doc_id is None:
+                    stored = self.collection.find_one({"_id": ObjectId(entity_id)}, {"id_metadata_document": 1})
+                    metadata_doc_id = (stored or {}).get("id_metadata_document")
+                self._index_add(entity_id, update_data["embedding"], metadata_doc_id)
             return result.modified_count > 0
         except (PyMongoError, ValueError) as e:
             print(f"Error updating fragment document {entity_id}: {e}")
@@ -79,88 +117,158 @@ class FragmentDocumentRepository(BaseRepository):
         """Delete fragment document by ID"""
         try:
             result = self.collection.delete_one({"_id": ObjectId(entity_id)})
+            self._index_remove([entity_id])
             return result.deleted_count > 0
         except (PyMongoError, ValueError) as e:
             print(f"Error deleting fragment document {entity_id}: {e}")
             return False
     
-    def find_all(self, **filters) -> List[Dict[str, Any]]:
-        """Find all fragment documents with optional filters"""
+    def find_all(self, projection: Optional[Dict[str, Any]] = None, as_array: bool = False,
+                 **filters) -> List[Dict[str, Any]]:
+        """Find all fragment documents with optional filters and field projection"""
         try:
-            cursor = self.collection.find(filters).sort([
+            cursor = self.collection.find(filters, projection).sort([
                 ("id_metadata_document", 1),
                 ("chunk_index", 1)
             ])
-            return list(cursor)
+            return [self._decode(doc, as_array) for doc in cursor]
         except PyMongoError as e:
             print(f"Error finding fragment documents: {e}")
             return []
     
-    def find_by_metadata_document_id(self, metadata_doc_id: str) -> List[Dict[str, Any]]:
+    def find_by_metadata_document_id(self, metadata_doc_id: str,
+                                     projection: Optional[Dict[str, Any]] = None,
+                                     as_array: bool = False) -> List[Dict[str, Any]]:
         """Find all fragments for a specific metadata document"""
         try:
             cursor = self.collection.find(
-                {"id_metadata_document": metadata_doc_id}
+                {"id_metadata_document": metadata_doc_id},
+                projection
             ).sort("chunk_index", 1)
-            return list(cursor)
+            return [self._decode(doc, as_array) for doc in cursor]
         except PyMongoError as e:
             print(f"Error finding fragments for metadata document {metadata_doc_id}: {e}")
             return []
     
+    def find_chunk_hashes(self, metadata_doc_id: str) -> List[Dict[str, Any]]:
+        """
+        Find the position and content hash of every fragment of a metadata document (no embeddings).
+        Content is only returned for legacy fragments stored before hashes were recorded.
+        """
+        try:
+            cursor = self.collection.find(
+                {"id_metadata_document": metadata_doc_id},
+                {"chunk_index": 1, "page_start": 1, "page_end": 1, "content_hash": 1}
+            )
+            fragments = list(cursor)
+            legacy_ids = [doc["_id"] for doc in fragments if not doc.get("content_hash")]
+            if legacy_ids:
+                contents = {
+                    doc["_id"]: doc.get("content", "")
+                    for doc in self.collection.find({"_id": {"$in": legacy_ids}}, {"content": 1})
+                }
+                for doc in fragments:
+                    if doc["_id"] in contents:
+                        doc["content"] = contents[doc["_id"]]
+            return fragments
+        except PyMongoError as e:
+            print(f"Error finding chunk hashes for metadata document {metadata_doc_id}: {e}")
+            return []
+    
+    def update_many_by_id(self, updates: List[Tuple[str, Dict[str, Any]]]) -> int:
+        """Apply several per-fragment $set updates in one bulk write; returns how many were modified"""
+        if not updates:
+            return 0
+        try:
+            result = self.collection.bulk_write(
+                [UpdateOne({"_id": ObjectId(fragment_id)}, {"$set": fields}) for fragment_id, fields in updates],
+                ordered=False
+            )
+            return result.modified_count
+        except PyMongoError as e:
+            print(f"Error bulk updating fragment documents: {e}")
+            raise
+    
+    def delete_by_ids(self, fragment_ids: List[str]) -> int:
+        """Delete several fragments in one query; returns how many were deleted"""
+        if not fragment_ids:
+            return 0
+        try:
+            result = self.collection.delete_many(
+                {"_id": {"$in": [ObjectId(fragment_id) for fragment_id in fragment_ids]}}
+            )
+            self._index_remove(fragment_ids)
+            return result.deleted_count
+        except PyMongoError as e:
+            print(f"Error deleting fragment documents: {e}")
+            raise
+    
     def delete_by_metadata_document_id(self, metadata_doc_id: str) -> bool:
         """Delete all fragments for a specific metadata document"""
         try:
-            result = self.collection.delete_many({"id_metadata_document": metadata_doc_id})
+            query = {"id_metadata_document": metadata_doc_id}
+            fragment_ids = self._find_ids(query)
+            result = self.collection.delete_many(query)
+            self._index_remove(fragment_ids)
             return result.deleted_count > 0
         except PyMongoError as e:
             print(f"Error deleting fragments for metadata document {metadata_doc_id}: {e}")
             return False
     
-    def search_by_text(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
-        """Search fragments by text content"""
+    def search_by_text(self, query: str, limit: int = 10,
+                       projection: Optional[Dict[str, Any]] = LIGHT_PROJECTION,
+                       metadata_ids: Optional[List[str]] = None,
+                       exclude_metadata_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Search fragments by text content, best matches first (without embeddings by default).
+        metadata_ids / exclude_metadata_ids restrict the search to (or away from) those documents.
+        """
         try:
             cursor = self.collection.find(
-                {"$text": {"$search": query}}
-            ).limit(limit)
-            return list(cursor)
+                {"$text": {"$search": query}, **self._metadata_filter(metadata_ids, exclude_metadata_ids)},
+                self._with_score(projection, {"$meta": "textScore"})
+            ).sort([("score", {"$meta": "textScore"})]).limit(limit)
+            return [self._decode(doc) for doc in cursor]
         except PyMongoError as e:
             print(f"Error searching fragments by text '{query}': {e}")
             return []
     
-    def vector_search(self, query_embedding: List[float], limit: int = 5) -> List[Dict[str, Any]]:
+    def vector_search(self, query_embedding: List[float], limit: int = 5,
+                      projection: Optional[Dict[str, Any]] = LIGHT_PROJECTION,
+                      metadata_ids: Optional[List[str]] = None,
+                      exclude_metadata_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """
         Perform vector similarity search using MongoDB Atlas Vector Search.
         For local development, this will use a basic similarity calculation.
+        Hits carry a `score` and, by default, no embedding.
+        metadata_ids / exclude_metadata_ids are applied before scoring; on Atlas the
+        vector index must declare id_metadata_document as a filter field.
         """
         try:
             # MongoDB Atlas vector search pipeline
             # This would work with Atlas Search index
             if self._is_atlas_available():
+                vector_stage = {
+                    "index": "vector_index",
+                    "path": "embedding",
+                    "queryVector": query_embedding,
+                    "numCandidates": limit * 10,
+                    "limit": limit
+                }
+                metadata_filter = self._metadata_filter(metadata_ids, exclude_metadata_ids)
+                if metadata_filter:
+                    vector_stage["filter"] = metadata_filter
                 pipeline = [
-                    {
-                        "$vectorSearch": {
-                            "index": "vector_index",
-                            "path": "embedding",
-                            "queryVector": query_embedding,
-                            "numCandidates": limit * 10,
-                            "limit": limit
-                        }
-                    },
-                    {
-                        "$project": {
-                            "_id": 1,
-                            "id_metadata_document": 1,
-                            "chunk_index": 1,
-                            "content": 1,
-                            "created_at": 1,
-                            "score": {"$meta": "vectorSearchScore"}
-                        }
-                    }
+                    {"$vectorSearch": vector_stage},
+                    {"$addFields": {"score": {"$meta": "vectorSearchScore"}}}
                 ]
+                if projection:
+                    pipeline.append({"$project": self._with_score(projection, 1)})
                 return list(self.collection.aggregate(pipeline))
             else:
                 # Fallback for local development
-                return self._cosine_similarity_search(query_embedding, limit)
+                return self._cosine_similarity_search(query_embedding, limit, projection,
+                                                      metadata_ids, exclude_metadata_ids)
                 
         except PyMongoError as e:
             print(f"Error performing vector search: {e}")
@@ -175,61 +283,218 @@ class FragmentDocumentRepository(BaseRepository):
         except:
             return False
     
-    def _cosine_similarity_search(self, query_embedding: List[float], limit: int) -> List[Dict[str, Any]]:
+    def _cosine_similarity_search(self, query_embedding: List[float], limit: int,
+                                  projection: Optional[Dict[str, Any]] = LIGHT_PROJECTION,
+                                  metadata_ids: Optional[List[str]] = None,
+                                  exclude_metadata_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """
         Fallback cosine similarity search for local development.
-        This is less efficient but works without Atlas Vector Search.
+        Scores against the resident vector index and fetches only the top hits from MongoDB.
+        Metadata filters are applied by the index's per-row document mask, so a scoped query
+        only scans its subset and needs no extra database round-trip.
         """
         try:
-            # Get all documents (this is inefficient for large datasets)
-            all_docs = list(self.collection.find({}))
+            if metadata_ids is not None and not metadata_ids:
+                return []
+            index = self._get_vector_index()
+            hits = index.search(query_embedding, limit, document_ids=metadata_ids,
+                                exclude_document_ids=exclude_metadata_ids)
+            if not hits:
+                return []
             
-            # Calculate cosine similarity for each document
-            scored_docs = []
-            for doc in all_docs:
-                if "embedding" in doc and doc["embedding"]:
-                    similarity = self._cosine_similarity(query_embedding, doc["embedding"])
-                    doc["score"] = similarity
-                    scored_docs.append(doc)
+            scores = {fragment_id: score for fragment_id, score in hits}
+            cursor = self.collection.find(
+                {"_id": {"$in": [ObjectId(fragment_id) for fragment_id, _ in hits]}},
+                projection
+            )
+            docs = []
+            for doc in map(self._decode, cursor):
+                doc["score"] = scores[str(doc["_id"])]
+                docs.append(doc)
             
-            # Sort by similarity and return top results
-            scored_docs.sort(key=lambda x: x["score"], reverse=True)
-            return scored_docs[:limit]
+            docs.sort(key=lambda x: x["score"], reverse=True)
+            return docs
             
         except Exception as e:
             print(f"Error in fallback similarity search: {e}")
             return []
     
-    def _cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
-        """Calculate cosine similarity between two vectors"""
-        try:
-            import math
-            
-            # Ensure vectors are same length
-            if len(vec1) != len(vec2):
-                return 0.0
-            
-            # Calculate dot product
-            dot_product = sum(a * b for a, b in zip(vec1, vec2))
-            
-            # Calculate magnitudes
-            magnitude1 = math.sqrt(sum(a * a for a in vec1))
-            magnitude2 = math.sqrt(sum(a * a for a in vec2))
-            
-            # Avoid division by zero
-            if magnitude1 == 0 or magnitude2 == 0:
-                return 0.0
-            
-            return dot_product / (magnitude1 * magnitude2)
-            
-        except Exception as e:
-            print(f"Error calculating cosine similarity: {e}")
-            return 0.0
+    def rebuild_vector_index(self) -> int:
+        """Reload every fragment embedding into the in-memory index and return its size"""
+        return self._build_vector_index(self._get_vector_index(build=False))
+    
+    def _build_vector_index(self, index) -> int:
+        """Fill the given index from MongoDB (or load its persisted copy) and return its size"""
+        if isinstance(index, IVFIndex) and not index.built and index.load():
+            self._reconcile_vector_index(index)
+            print(f"ANN index loaded from {index.path} with {len(index)} fragments")
+            return len(index)
+        cursor = self.collection.find(
+            {"embedding": {"$exists": True}},
+            self.INDEX_PROJECTION
+        ).batch_size(int(os.getenv('VECTOR_INDEX_BUILD_BATCH_SIZE', '2000')))
+        index.build(self._index_entry(doc) for doc in cursor)
+        print(f"Vector index built with {len(index)} fragments")
+        return len(index)
+    
+    def _reconcile_vector_index(self, index: IVFIndex):
+        """Bring a persisted ANN index up to date with writes made while it was not loaded"""
+        indexed = index.ids()
+        stored = set(self._find_ids({"embedding": {"$exists": True}}))
+        index.remove_many(indexed - stored)
+        missing = list(stored - indexed)
+        batch_size = int(os.getenv('VECTOR_INDEX_BUILD_BATCH_SIZE', '2000'))
+        for start in range(0, len(missing), batch_size):
+            cursor = self.collection.find(
+                {"_id": {"$in": [ObjectId(fragment_id) for fragment_id in missing[start:start + batch_size]]}},
+                self.INDEX_PROJECTION
+            )
+            for doc in cursor:
+                index.add(*self._index_entry(doc))
+    
+    def index_fragments(self, fragment_ids: List[str]) -> int:
+        """
+        Load fragments written by another process into the in-memory index.
+        Returns how many were indexed (0 while the index has not been built yet).
+        """
+        index = self._vector_indexes.get(self.collection.full_name)
+        if index is None or not index.built or not fragment_ids:
+            return 0
+        
+        cursor = self.collection.find(
+            {"_id": {"$in": [ObjectId(fragment_id) for fragment_id in fragment_ids]}},
+            self.INDEX_PROJECTION
+        )
+        return sum(1 for doc in cursor if index.add(*self._index_entry(doc)))
+    
+    def migrate_embedding_storage(self, storage_format: Optional[str] = None, batch_size: Optional[int] = None) -> int:
+        """
+        Rewrite stored embeddings in another storage format (default: EMBEDDING_STORAGE_FORMAT).
+        Fragments already in that format are skipped. Returns how many fragments were rewritten.
+        """
+        storage_format = storage_format or get_embedding_format()
+        batch_size = max(1, batch_size or int(os.getenv('MONGO_BULK_BATCH_SIZE', '1000')))
+        
+        migrated = 0
+        pending: List[UpdateOne] = []
+        cursor = self.collection.find(
+            {"embedding": {"$ne": None}},
+            {"embedding": 1}
+        ).batch_size(batch_size)
+        for doc in cursor:
+            if embedding_format_of(doc["embedding"]) == storage_format:
+                continue
+            encoded = encode_embedding(decode_embedding(doc["embedding"]), storage_format)
+            pending.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"embedding": encoded}}))
+            if len(pending) >= batch_size:
+                migrated += self.collection.bulk_write(pending, ordered=False).modified_count
+                pending = []
+        if pending:
+            migrated += self.collection.bulk_write(pending, ordered=False).modified_count
+        return migrated
+    
+    def unindex_fragments(self, fragment_ids: List[str]):
+        """Drop fragments deleted by another process from the in-memory index"""
+        self._index_remove(fragment_ids)
+    
+    def _get_vector_index(self, build: bool = True):
+        """Get the shared vector index for this collection, building it on first use"""
+        key = self.collection.full_name
+        with self._vector_indexes_lock:
+            index = self._vector_indexes.get(key)
+            if index is None:
+                index = self._create_vector_index(key)
+                self._vector_indexes[key] = index
+                self._vector_index_build_locks[key] = threading.Lock()
+            build_lock = self._vector_index_build_locks[key]
+        if build and not index.built:
+            with build_lock:
+                if not index.built:
+                    self._build_vector_index(index)
+        return index
+    
+    @staticmethod
+    def _create_vector_index(key: str):
+        """
+        Exact flat index by default; VECTOR_INDEX_BACKEND=ivf selects the approximate,
+        disk-backed IVF index (persisted under VECTOR_INDEX_DIR) for large corpora
+        """
+        backend = os.getenv('VECTOR_INDEX_BACKEND', 'flat').lower()
+        if backend == 'ivf':
+            return IVFIndex(os.path.join(os.getenv('VECTOR_INDEX_DIR', '.cache/vector_index'), key))
+        if backend != 'flat':
+            print(f"Unknown VECTOR_INDEX_BACKEND {backend!r}, using flat")
+        return VectorIndex()
+    
+    def _index_add(self, fragment_id: str, embedding: Optional[List[float]], metadata_doc_id: Optional[str]):
+        """Keep the in-memory index in sync after a write (no-op until it is built)"""
+        index = self._vector_indexes.get(self.collection.full_name)
+        if index is not None and index.built:
+            if not index.add(fragment_id, embedding, metadata_doc_id):
+                index.remove(fragment_id)
+    
+    @staticmethod
+    def _index_entry(doc: Dict[str, Any]) -> Tuple[str, Any, Optional[str]]:
+        """(fragment_id, embedding, metadata document ID) of a fragment read with INDEX_PROJECTION"""
+        return str(doc["_id"]), decode_embedding(doc.get("embedding")), doc.get("id_metadata_document")
+    
+    def _index_remove(self, fragment_ids: List[str]):
+        """Drop deleted fragments from the in-memory index"""
+        index = self._vector_indexes.get(self.collection.full_name)
+        if index is not None and fragment_ids:
+            index.remove_many(fragment_ids)
+    
+    @staticmethod
+    def _metadata_filter(metadata_ids: Optional[List[str]],
+                         exclude_metadata_ids: Optional[List[str]]) -> Dict[str, Any]:
+        """Query clause restricting fragments to (or away from) the given metadata documents"""
+        condition = {}
+        if metadata_ids is not None:
+            condition["$in"] = list(metadata_ids)
+        if exclude_metadata_ids:
+            condition["$nin"] = list(exclude_metadata_ids)
+        return {"id_metadata_document": condition} if condition else {}
+    
+    @staticmethod
+    def _with_score(projection: Optional[Dict[str, Any]], score: Any) -> Optional[Dict[str, Any]]:
+        """Add the score field to a projection (only inclusion projections need it listed)"""
+        if projection is None:
+            return {"score": score} if isinstance(score, dict) else None
+        if isinstance(score, dict) or all(projection.values()):
+            return {**projection, "score": score}
+        return projection
+    
+    @staticmethod
+    def _encode(entity: Dict[str, Any]) -> Dict[str, Any]:
+        """Copy of an entity with its embedding in the configured storage format"""
+        if entity.get("embedding") is None:
+            return entity
+        return {**entity, "embedding": encode_embedding(entity["embedding"])}
+    
+    @staticmethod
+    def _decode(doc: Optional[Dict[str, Any]], as_array: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Expose a stored embedding as the list of floats callers have always received
+        (legacy lists are returned untouched, packed binaries are unpacked), or with
+        as_array as a NumPy vector (zero-copy for float32/float16 binaries)
+        """
+        if doc is not None and doc.get("embedding") is not None:
+            if as_array:
+                doc["embedding"] = decode_embedding(doc["embedding"])
+            elif not isinstance(doc["embedding"], list):
+                doc["embedding"] = decode_embedding(doc["embedding"]).tolist()
+        return doc
+    
+    def _find_ids(self, query: Dict[str, Any]) -> List[str]:
+        """Return the IDs of fragments matching a query"""
+        return [str(doc["_id"]) for doc in self.collection.find(query, {"_id": 1})]
     
     def get_fragment_stats(self) -> Dict[str, Any]:
         """Get statistics about document fragments"""
         try:
             pipeline = [
+                # Only the fields the statistics need travel through the pipeline
+                {"$project": {"id_metadata_document": 1, "content": 1}},
                 {"$group": {
                     "_id": "$id_metadata_document",
                     "fragment_count": {"$sum": 1},
@@ -263,7 +528,10 @@ class FragmentDocumentRepository(BaseRepository):
     def delete_by_document_id(self, document_id: str) -> bool:
         """Delete all fragments for a specific document_id"""
         try:
-            result = self.collection.delete_many({"document_id": document_id})
+            query = {"document_id": document_id}
+            fragment_ids = self._find_ids(query)
+            result = self.collection.delete_many(query)
+            self._index_remove(fragment_ids)
             return result.deleted_count > 0
         except PyMongoError as e:
             print(f"Error deleting fragments for document {document_id}: {e}")
@@ -0,0 +1,534 @@
+import os
+import json
+import math
+import time
+import shutil
+import atexit
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .vector_index import VectorIndex
+
+
+# ObjectId hex strings are 24 ASCII characters
+_ID_DTYPE = "S24"
+_FORMAT_VERSION = 2
+
+
+class IVFIndex:
+    """
+    Approximate nearest-neighbour index (IVF-Flat) for large local corpora.
+    Vectors are clustered with spherical k-means and stored on disk grouped by cluster;
+    the files are memory-mapped, so only the probed clusters are paged in.
+    Inserts go to a small in-memory delta that is merged into the on-disk base in the background;
+    deletes are tombstones until the next merge.
+    Every row records its metadata document (per-row codes in documents.npy), so document-scoped
+    searches are masked in NumPy.
+
+    Tunables (env): IVF_NLIST (clusters, default 4*sqrt(n)), IVF_NPROBE (clusters scanned per query;
+    higher = better recall, slower), IVF_TRAIN_SAMPLE, IVF_TRAIN_ITERATIONS, IVF_VECTOR_DTYPE
+    (float32 or float16), IVF_MERGE_MIN / IVF_MERGE_RATIO (delta size that triggers a merge).
+    """
+
+    def __init__(self, path: str,
+                 nlist: Optional[int] = None,
+                 nprobe: Optional[int] = None,
+                 vector_dtype: Optional[str] = None):
+        self.path = path
+        self.nlist = nlist or int(os.getenv('IVF_NLIST', '0'))
+        self.nprobe = nprobe or int(os.getenv('IVF_NPROBE', '16'))
+        self.vector_dtype = np.dtype(vector_dtype or os.getenv('IVF_VECTOR_DTYPE', 'float32'))
+        self.train_sample = int(os.getenv('IVF_TRAIN_SAMPLE', '50000'))
+        self.train_iterations = int(os.getenv('IVF_TRAIN_ITERATIONS', '10'))
+        self.merge_min = int(os.getenv('IVF_MERGE_MIN', '10000'))
+        self.merge_ratio = float(os.getenv('IVF_MERGE_RATIO', '0.1'))
+
+        self._lock = threading.RLock()
+        self._dimension: Optional[int] = None
+        # On-disk base segment
+        self._centroids: Optional[np.ndarray] = None
+        self._vectors: Optional[np.ndarray] = None
+        self._offsets: Optional[np.ndarray] = None
+        self._ids: Optional[np.ndarray] = None
+        self._sorted_ids: Optional[np.ndarray] = None
+        self._sorted_positions: Optional[np.ndarray] = None
+        self._documents: Optional[np.ndarray] = None
+        self._document_codes: Dict[str, int] = {}
+        self._tombstones: Optional[np.ndarray] = None
+        self._tombstone_count = 0
+        # In-memory delta for inserts since the last merge
+        self._delta = VectorIndex()
+        self._delta.built = True
+        # Writes that happen while a background merge runs are replayed onto the merged base
+        self._merge_thread: Optional[threading.Thread] = None
+        self._merge_log: Optional[List[Tuple[str, str, Any, Optional[str]]]] = None
+        self._dirty = False
+        self.built = False
+
+        atexit.register(self.flush)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._base_count() - self._tombstone_count + len(self._delta)
+
+    def __contains__(self, fragment_id: str) -> bool:
+        with self._lock:
+            return fragment_id in self._delta or self._live_base_position(fragment_id) is not None
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return self._dimension
+
+    def build(self, items: Iterable[Tuple[str, Any, Optional[str]]]):
+        """Rebuild the index from (fragment_id, embedding, document_id) triples and persist it"""
+        workdir = tempfile.mkdtemp(prefix=".build-", dir=self._parent_dir())
+        try:
+            raw_path = os.path.join(workdir, "vectors.raw")
+            ids: List[bytes] = []
+            documents: List[bytes] = []
+            dimension = None
+            # First pass streams normalized vectors to disk so the corpus never has to fit in memory
+            with open(raw_path, "wb") as raw:
+                for fragment_id, embedding, document_id in items:
+                    vector = VectorIndex._normalize(embedding)
+                    if vector is None:
+                        continue
+                    if dimension is None:
+                        dimension = vector.shape[0]
+                    if vector.shape[0] != dimension:
+                        print(f"Skipping embedding for fragment {fragment_id}: dimension {vector.shape[0]} != {dimension}")
+                        continue
+                    raw.write(vector.astype(np.float32).tobytes())
+                    ids.append(fragment_id.encode("ascii"))
+                    documents.append(self._encode_document(document_id))
+
+            with self._lock:
+                if not ids:
+                    self._reset_base(None)
+                    shutil.rmtree(self.path, ignore_errors=True)
+                    self._delta.clear()
+                    self._delta.built = True
+                    self.built = True
+                    return
+
+            vectors = np.memmap(raw_path, dtype=np.float32, mode="r", shape=(len(ids), dimension))
+            centroids = self._train(vectors)
+            self._write_base(workdir, vectors, np.array(ids, dtype=_ID_DTYPE),
+                             np.array(documents, dtype=_ID_DTYPE), centroids)
+            del vectors
+            os.unlink(raw_path)
+
+            with self._lock:
+                self._install(workdir)
+                workdir = None
+                self._delta.clear()
+                self._delta.built = True
+                self._dirty = False
+                self.built = True
+        finally:
+            if workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    def load(self) -> bool:
+        """Memory-map a previously persisted index; returns False if none is usable"""
+        with self._lock:
+            try:
+                with open(os.path.join(self.path, "meta.json")) as f:
+                    meta = json.load(f)
+                if meta.get("version") != _FORMAT_VERSION:
+                    return False
+                self._map_base(self.path, meta)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"No usable ANN index at {self.path}: {e}")
+                self._reset_base(None)
+                return False
+
+            self._load_checkpoint()
+            self.built = True
+            return True
+
+    def add(self, fragment_id: str, embedding: Any, document_id: Optional[str] = None) -> bool:
+        """Add or replace a single embedding"""
+        with self._lock:
+            if self._merge_log is not None:
+                self._merge_log.append(("add", fragment_id, embedding, document_id))
+            if not self._delta.add(fragment_id, embedding, document_id):
+                return False
+            if self._dimension is None:
+                self._dimension = self._delta.dimension
+            position = self._live_base_position(fragment_id)
+            if position is not None:
+                self._tombstone(position)
+            self._dirty = True
+            self._maybe_merge()
+            return True
+
+    def remove(self, fragment_id: str) -> bool:
+        """Remove an embedding by fragment ID (a tombstone until the next merge)"""
+        with self._lock:
+            if self._merge_log is not None:
+                self._merge_log.append(("remove", fragment_id, None, None))
+            removed = self._delta.remove(fragment_id)
+            position = self._live_base_position(fragment_id)
+            if position is not None:
+                self._tombstone(position)
+                removed = True
+            self._dirty = self._dirty or removed
+            return removed
+
+    def remove_many(self, fragment_ids: Iterable[str]) -> int:
+        """Remove several embeddings and return how many were present"""
+        with self._lock:
+            return sum(1 for fragment_id in fragment_ids if self.remove(fragment_id))
+
+    def clear(self):
+        """Drop all rows and mark the index as not built"""
+        with self._lock:
+            self._reset_base(None)
+            self._delta.clear()
+            self._delta.built = True
+            self.built = False
+
+    def ids(self) -> Set[str]:
+        """Every live fragment ID (used to reconcile a loaded index with the database)"""
+        with self._lock:
+            live = set(self._delta._ids)
+            if self._ids is not None:
+                alive = ~self._tombstones
+                live.update(fragment_id.decode("ascii") for fragment_id in self._ids[alive])
+            return live
+
+    def search(self, query_embedding: Any, limit: int, nprobe: Optional[int] = None,
+               document_ids: Optional[Iterable[str]] = None,
+               exclude_document_ids: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Return the top `limit` (fragment_id, cosine similarity) pairs, best first.
+        `document_ids` restricts the search to fragments of those documents, which are scanned exactly
+        instead of probing clusters; fragments of `exclude_document_ids` are masked out with the tombstones.
+        """
+        query = VectorIndex._normalize(query_embedding)
+        if query is None or limit <= 0:
+            return []
+
+        with self._lock:
+            if document_ids is not None:
+                document_ids = list(document_ids)
+            if exclude_document_ids is not None:
+                exclude_document_ids = list(exclude_document_ids)
+            hits = self._delta.search(query, limit, document_ids=document_ids,
+                                      exclude_document_ids=exclude_document_ids)
+            if self._centroids is None or query.shape[0] != self._dimension:
+                return hits
+
+            excluded_codes = self._codes(exclude_document_ids)
+            if document_ids is not None:
+                allowed_codes = self._codes(document_ids)
+                # None of the documents has base rows: nothing to scan
+                if not allowed_codes.size:
+                    return hits
+                rows = np.isin(self._documents, allowed_codes) & ~self._tombstones
+                if excluded_codes.size:
+                    rows &= ~np.isin(self._documents, excluded_codes)
+                positions = np.flatnonzero(rows)
+                scores = np.asarray(self._vectors[positions] @ query, dtype=np.float32)
+            else:
+                positions, scores = self._probe(query, nprobe or self.nprobe, excluded_codes)
+
+            if scores.shape[0]:
+                k = min(limit, scores.shape[0])
+                top = np.argpartition(scores, -k)[-k:]
+                hits.extend(
+                    (self._ids[positions[i]].decode("ascii"), float(scores[i]))
+                    for i in top if np.isfinite(scores[i])
+                )
+
+            hits.sort(key=lambda hit: hit[1], reverse=True)
+            return hits[:limit]
+
+    def flush(self):
+        """
+        Persist pending inserts and tombstones next to the base segment.
+        Cheap compared to a merge; called at interpreter exit.
+        """
+        with self._lock:
+            if not self.built or not self._dirty or not os.path.isdir(self.path):
+                return
+            try:
+                count = len(self._delta)
+                delta_ids = np.array([fragment_id.encode("ascii") for fragment_id in self._delta._ids], dtype=_ID_DTYPE)
+                delta_documents = np.array([self._encode_document(document_id)
+                                            for document_id in self._delta._row_documents()], dtype=_ID_DTYPE)
+                delta_vectors = np.empty((0, self._dimension or 0), dtype=np.float32) if count == 0 else self._delta._matrix[:count]
+                tombstones = np.empty(0, dtype=np.int64) if self._tombstones is None else np.flatnonzero(self._tombstones)
+                np.savez(os.path.join(self.path, "checkpoint.tmp.npz"),
+                         delta_ids=delta_ids, delta_documents=delta_documents,
+                         delta_vectors=delta_vectors, tombstones=tombstones)
+                os.replace(os.path.join(self.path, "checkpoint.tmp.npz"), os.path.join(self.path, "checkpoint.npz"))
+                self._dirty = False
+            except OSError as e:
+                print(f"Error saving ANN index checkpoint: {e}")
+
+    # Private helper methods
+
+    def _parent_dir(self) -> str:
+        parent = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(parent, exist_ok=True)
+        return parent
+
+    def _base_count(self) -> int:
+        return 0 if self._ids is None else self._ids.shape[0]
+
+    def _reset_base(self, dimension: Optional[int]):
+        self._dimension = dimension
+        self._centroids = self._vectors = self._offsets = None
+        self._ids = self._sorted_ids = self._sorted_positions = None
+        self._documents = None
+        self._document_codes = {}
+        self._tombstones = None
+        self._tombstone_count = 0
+
+    def _live_base_position(self, fragment_id: str) -> Optional[int]:
+        if self._sorted_ids is None:
+            return None
+        key = np.array(fragment_id.encode("ascii"), dtype=_ID_DTYPE)
+        slot = int(np.searchsorted(self._sorted_ids, key))
+        if slot >= self._sorted_ids.shape[0] or self._sorted_ids[slot] != key:
+            return None
+        position = int(self._sorted_positions[slot])
+        return None if self._tombstones[position] else position
+
+    def _codes(self, document_ids: Optional[List[str]]) -> np.ndarray:
+        """Base-segment codes of the given documents (documents without base rows are skipped)"""
+        if not document_ids:
+            return np.empty(0, dtype=np.int32)
+        return np.array([self._document_codes[document_id] for document_id in document_ids
+                         if document_id in self._document_codes], dtype=np.int32)
+
+    @staticmethod
+    def _encode_document(document_id: Optional[str]) -> bytes:
+        return document_id.encode("ascii") if document_id else b""
+
+    def _probe(self, query: np.ndarray, nprobe: int, excluded_codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Score the rows of the `nprobe` clusters nearest the query; tombstoned and excluded rows score -inf"""
+        nprobe = min(nprobe, self._centroids.shape[0])
+        centroid_scores = self._centroids @ query
+        probed = np.argpartition(centroid_scores, -nprobe)[-nprobe:]
+
+        positions = []
+        scores = []
+        for cluster in probed:
+            start, end = int(self._offsets[cluster]), int(self._offsets[cluster + 1])
+            if start == end:
+                continue
+            cluster_scores = np.asarray(self._vectors[start:end] @ query, dtype=np.float32)
+            cluster_scores[self._tombstones[start:end]] = -np.inf
+            if excluded_codes.size:
+                cluster_scores[np.isin(self._documents[start:end], excluded_codes)] = -np.inf
+            positions.append(np.arange(start, end))
+            scores.append(cluster_scores)
+
+        if not scores:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return np.concatenate(positions), np.concatenate(scores)
+
+    def _load_checkpoint(self):
+        checkpoint_path = os.path.join(self.path, "checkpoint.npz")
+        if not os.path.exists(checkpoint_path):
+            return
+        with np.load(checkpoint_path) as checkpoint:
+            for position in checkpoint["tombstones"]:
+                self._tombstone(int(position))
+            for fragment_id, document_id, vector in zip(checkpoint["delta_ids"], checkpoint["delta_documents"],
+                                                        checkpoint["delta_vectors"]):
+                self._delta.add(fragment_id.decode("ascii"), vector, document_id.decode("ascii") or None)
+
+    def _tombstone(self, position: int):
+        if not self._tombstones[position]:
+            self._tombstones[position] = True
+            self._tombstone_count += 1
+
+    def _train(self, vectors: np.ndarray) -> np.ndarray:
+        """Spherical k-means over a random sample of the corpus"""
+        count = vectors.shape[0]
+        nlist = self.nlist or int(4 * math.sqrt(count))
+        nlist = max(1, min(nlist, count))
+
+        rng = np.random.default_rng(0)
+        sample_size = min(count, max(self.train_sample, nlist))
+        sample = np.asarray(vectors[np.sort(rng.choice(count, sample_size, replace=False))], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(self.train_iterations):
+            labels = self._assign(sample, centroids)
+            order = np.argsort(labels, kind="stable")
+            counts = np.bincount(labels, minlength=nlist)
+            present = np.flatnonzero(counts)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[present]
+            centroids[present] = np.add.reduceat(sample[order], starts, axis=0)
+            # Re-seed empty clusters from random sample points
+            empty = np.flatnonzero(counts == 0)
+            if empty.size:
+                centroids[empty] = sample[rng.choice(sample_size, empty.size, replace=False)]
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids /= np.where(norms == 0, 1, norms)
+        return centroids
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+        labels = np.empty(vectors.shape[0], dtype=np.int64)
+        for start in range(0, vectors.shape[0], chunk_size):
+            chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+            labels[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+        return labels
+
+    def _write_base(self, directory: str, vectors: np.ndarray, ids: np.ndarray, documents: np.ndarray,
+                    centroids: np.ndarray, chunk_size: int = 8192):
+        """Write a base segment with rows grouped by cluster"""
+        labels = self._assign(vectors, centroids)
+        order = np.argsort(labels, kind="stable")
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=centroids.shape[0]))))
+
+        out = np.lib.format.open_memmap(
+            os.path.join(directory, "vectors.npy"), mode="w+",
+            dtype=self.vector_dtype, shape=(vectors.shape[0], vectors.shape[1])
+        )
+        for start in range(0, order.shape[0], chunk_size):
+            # Gather in sorted row order so a memory-mapped source is read sequentially
+            rows = order[start:start + chunk_size]
+            sorted_rows = np.argsort(rows)
+            block = np.empty((rows.shape[0], vectors.shape[1]), dtype=np.float32)
+            block[sorted_rows] = vectors[rows[sorted_rows]]
+            out[start:start + rows.shape[0]] = block
+        out.flush()
+        del out
+
+        ordered_ids = ids[order]
+        sorter = np.argsort(ordered_ids, kind="stable")
+        np.save(os.path.join(directory, "centroids.npy"), centroids.astype(np.float32))
+        np.save(os.path.join(directory, "offsets.npy"), offsets.astype(np.int64))
+        np.save(os.path.join(directory, "ids.npy"), ordered_ids)
+        np.save(os.path.join(directory, "sorted_ids.npy"), ordered_ids[sorter])
+        np.save(os.path.join(directory, "sorted_positions.npy"), sorter.astype(np.int64))
+        document_names, document_codes = np.unique(documents[order], return_inverse=True)
+        np.save(os.path.join(directory, "document_names.npy"), document_names)
+        np.save(os.path.join(directory, "documents.npy"), document_codes.astype(np.int32))
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump({
+                "version": _FORMAT_VERSION,
+                "count": int(vectors.shape[0]),
+                "dimension": int(vectors.shape[1]),
+                "nlist": int(centroids.shape[0]),
+                "vector_dtype": self.vector_dtype.name,
+                "created_at": time.time()
+            }, f)
+
+    def _map_base(self, directory: str, meta: dict):
+        self._reset_base(meta["dimension"])
+        self._centroids = np.load(os.path.join(directory, "centroids.npy"))
+        self._offsets = np.load(os.path.join(directory, "offsets.npy"))
+        self._vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        self._ids = np.load(os.path.join(directory, "ids.npy"), mmap_mode="r")
+        self._sorted_ids = np.load(os.path.join(directory, "sorted_ids.npy"), mmap_mode="r")
+        self._sorted_positions = np.load(os.path.join(directory, "sorted_positions.npy"), mmap_mode="r")
+        self._documents = np.load(os.path.join(directory, "documents.npy"), mmap_mode="r")
+        self._document_codes = {
+            name.decode("ascii"): code
+            for code, name in enumerate(np.load(os.path.join(directory, "document_names.npy")))
+            if name
+        }
+        self._tombstones = np.zeros(self._ids.shape[0], dtype=bool)
+        if self._vectors.shape != (meta["count"], meta["dimension"]):
+            raise ValueError("vectors.npy does not match meta.json")
+
+    def _install(self, directory: str):
+        """Swap a freshly written base directory into place and map it"""
+        retired = None
+        if os.path.exists(self.path):
+            retired = f"{self.path}.old-{os.getpid()}-{threading.get_ident()}"
+            os.replace(self.path, retired)
+        os.replace(directory, self.path)
+        if retired:
+            # Already-mapped files stay readable after unlinking
+            shutil.rmtree(retired, ignore_errors=True)
+        with open(os.path.join(self.path, "meta.json")) as f:
+            self._map_base(self.path, json.load(f))
+
+    def _maybe_merge(self):
+        threshold = max(self.merge_min, int(self.merge_ratio * self._base_count()))
+        if len(self._delta) >= threshold and self._merge_thread is None:
+            self._merge_thread = threading.Thread(target=self._merge, name="ivf-merge", daemon=True)
+            self._merge_thread.start()
+
+    def _merge(self):
+        """Rewrite the base with tombstones dropped and the delta folded in, then replay concurrent writes"""
+        with self._lock:
+            self._merge_log = []
+            base_vectors, base_ids = self._vectors, self._ids
+            base_documents = self._documents
+            base_document_names = {code: name for name, code in self._document_codes.items()}
+            tombstones = None if self._tombstones is None else self._tombstones.copy()
+            delta_ids = list(self._delta._ids)
+            delta_documents = self._delta._row_documents()
+            delta_vectors = None if not delta_ids else self._delta._matrix[:len(delta_ids)].copy()
+            centroids = self._centroids
+            base_count = self._base_count()
+
+        workdir = tempfile.mkdtemp(prefix=".merge-", dir=self._parent_dir())
+        try:
+            parts, id_parts, document_parts = [], [], []
+            if base_count:
+                alive = np.flatnonzero(~tombstones)
+                parts.append(np.asarray(base_vectors[alive], dtype=np.float32))
+                id_parts.append(np.asarray(base_ids[alive]))
+                document_parts.append(np.array([self._encode_document(base_document_names.get(code))
+                                                for code in np.asarray(base_documents[alive]).tolist()],
+                                               dtype=_ID_DTYPE))
+            if delta_ids:
+                parts.append(delta_vectors)
+                id_parts.append(np.array([fragment_id.encode("ascii") for fragment_id in delta_ids], dtype=_ID_DTYPE))
+                document_parts.append(np.array([self._encode_document(document_id) for document_id in delta_documents],
+                                               dtype=_ID_DTYPE))
+
+            has_rows = bool(parts)
+            if has_rows:
+                vectors = np.concatenate(parts)
+                ids = np.concatenate(id_parts)
+                documents = np.concatenate(document_parts)
+                del parts, id_parts, document_parts
+                # Retrain when the corpus has outgrown the clustering
+                if centroids is None or vectors.shape[0] > 2 * base_count:
+                    centroids = self._train(vectors)
+                self._write_base(workdir, vectors, ids, documents, centroids)
+                del vectors, ids, documents
+
+            with self._lock:
+                log = self._merge_log
+                self._merge_log = None
+                if has_rows:
+                    self._install(workdir)
+                    workdir = None
+                else:
+                    self._reset_base(self._dimension)
+                    shutil.rmtree(self.path, ignore_errors=True)
+                self._delta.clear()
+                self._delta.built = True
+                self._dirty = False
+                for operation, fragment_id, embedding, document_id in log:
+                    if operation == "add":
+                        self.add(fragment_id, embedding, document_id)
+                    else:
+                        self.remove(fragment_id)
+                clusters = 0 if self._centroids is None else self._centroids.shape[0]
+                print(f"ANN index merged: {len(self)} vectors in {clusters} clusters")
+        except Exception as e:
+            print(f"Error merging ANN index: {e}")
+            with self._lock:
+                self._merge_log = None
+        finally:
+            with self._lock:
+                self._merge_thread = None
+            if workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
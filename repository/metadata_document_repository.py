@@ -11,6 +11,9 @@ class MetadataDocumentRepository(BaseRepository):
     Handles document metadata for RAG system.
     """
     
+    # Read projection for joining search hits to their document (title, type and specialty)
+    SUMMARY_PROJECTION = {"document_title": 1, "document_type": 1, "metadata.specialty": 1, "version": 1}
+    
     def __init__(self):
         super().__init__("metadata_document")
         self._create_indexes()
@@ -36,6 +39,11 @@ class MetadataDocumentRepository(BaseRepository):
                 ("valid", 1),
                 ("created_at", -1)
             ])
+            # Index for specialty-scoped retrieval
+            self.collection.create_index([
+                ("metadata.specialty", 1),
+                ("valid", 1)
+            ])
         except PyMongoError as e:
             print(f"Error creating indexes: {e}")
     
@@ -56,6 +64,34 @@ class MetadataDocumentRepository(BaseRepository):
             print(f"Error saving metadata document: {e}")
             raise
     
+    def find_latest_by_title(self, document_title: str) -> Optional[Dict[str, Any]]:
+        """Find the highest version of a valid document with this title"""
+        try:
+            return self.collection.find_one(
+                {"document_title": document_title, "valid": True},
+                sort=[("version", -1)]
+            )
+        except PyMongoError as e:
+            print(f"Error finding metadata document by title {document_title}: {e}")
+            return None
+    
+    def increment_version(self, entity_id: str, expected_version: int, update_data: Dict[str, Any]) -> bool:
+        """
+        Bump the version of a metadata document and apply update_data,
+        only if it is still at expected_version (False on a concurrent update)
+        """
+        try:
+            # Documents saved without a version field are version 1
+            version_filter = {"$in": [1, None]} if expected_version == 1 else expected_version
+            result = self.collection.update_one(
+                {"_id": ObjectId(entity_id), "version": version_filter},
+                {"$set": {**update_data, "version": expected_version + 1}}
+            )
+            return result.modified_count > 0
+        except (PyMongoError, ValueError) as e:
+            print(f"Error incrementing version of metadata document {entity_id}: {e}")
+            return False
+    
     def update(self, entity_id: str, update_data: Dict[str, Any]) -> bool:
         """Update metadata document by ID"""
         try:
@@ -90,6 +126,25 @@ class MetadataDocumentRepository(BaseRepository):
             print(f"Error finding metadata documents: {e}")
             return []
     
+    def find_by_ids(self, entity_ids: List[str], projection: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Find several metadata documents by ID in a single query"""
+        try:
+            object_ids = [ObjectId(entity_id) for entity_id in set(entity_ids) if ObjectId.is_valid(entity_id)]
+            if not object_ids:
+                return []
+            return list(self.collection.find({"_id": {"$in": object_ids}}, projection))
+        except PyMongoError as e:
+            print(f"Error finding metadata documents by IDs: {e}")
+            return []
+    
+    def find_ids(self, **filters) -> List[str]:
+        """Return the IDs of metadata documents matching the filters (no validity default)"""
+        try:
+            return [str(doc["_id"]) for doc in self.collection.find(filters, {"_id": 1})]
+        except PyMongoError as e:
+            print(f"Error finding metadata document IDs: {e}")
+            return []
+    
     def find_by_document_type(self, document_type: str) -> List[Dict[str, Any]]:
         """Find metadata documents by type"""
         return self.find_all(document_type=document_type)
@@ -0,0 +1,97 @@
+import os
+import atexit
+import asyncio
+import threading
+from typing import Dict, Tuple, Any, Optional
+from pymongo import MongoClient
+
+
+_clients: Dict[Tuple[int, str], MongoClient] = {}
+_async_clients: Dict[Tuple[int, str, int], Any] = {}
+_clients_lock = threading.Lock()
+
+
+def get_mongo_client(mongo_uri: Optional[str] = None) -> MongoClient:
+    """
+    Get the process-wide MongoClient for a URI, creating it on first use.
+    Every repository shares the same connection pool; clients are never reused across a fork.
+    """
+    mongo_uri = mongo_uri or os.getenv('DATABASE_URL')
+    if not mongo_uri:
+        raise ValueError("DATABASE_URL environment variable not found. Please check your .env file.")
+
+    key = (os.getpid(), mongo_uri)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            print(f"Connecting to MongoDB: {mongo_uri[:20]}..." if len(mongo_uri) > 20 else mongo_uri)
+            client = MongoClient(mongo_uri, **_pool_options())
+            _clients[key] = client
+        return client
+
+
+def get_async_mongo_client(mongo_uri: Optional[str] = None):
+    """
+    Get the Motor client for a URI bound to the running event loop.
+    Motor clients cannot be shared across loops, so there is one per loop and process.
+    """
+    from motor.motor_asyncio import AsyncIOMotorClient
+    
+    mongo_uri = mongo_uri or os.getenv('DATABASE_URL')
+    if not mongo_uri:
+        raise ValueError("DATABASE_URL environment variable not found. Please check your .env file.")
+    
+    loop = asyncio.get_running_loop()
+    key = (os.getpid(), mongo_uri, id(loop))
+    with _clients_lock:
+        client = _async_clients.get(key)
+        if client is None:
+            client = AsyncIOMotorClient(mongo_uri, io_loop=loop, **_pool_options())
+            _async_clients[key] = client
+        return client
+
+
+def close_mongo_clients():
+    """Close every client created by this process"""
+    with _clients_lock:
+        pid = os.getpid()
+        for registry in (_clients, _async_clients):
+            for key in [key for key in registry if key[0] == pid]:
+                try:
+                    registry.pop(key).close()
+                except Exception as e:
+                    print(f"Error closing MongoDB client: {e}")
+
+
+def _pool_options() -> Dict[str, Any]:
+    """Connection pool settings from environment variables"""
+    options: Dict[str, Any] = {
+        "serverSelectionTimeoutMS": 5000,
+        "maxPoolSize": int(os.getenv('MONGO_MAX_POOL_SIZE', '100')),
+        "minPoolSize": int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+    }
+    max_idle_time_ms = os.getenv('MONGO_MAX_IDLE_TIME_MS')
+    if max_idle_time_ms:
+        options["maxIdleTimeMS"] = int(max_idle_time_ms)
+    return options
+
+
+def _reset_after_fork():
+    """
+    Forget clients inherited from the parent process.
+    MongoClient is not fork-safe; the child builds its own pool on next use.
+    """
+    global _clients_lock
+    _clients_lock = threading.Lock()
+    _clients.clear()
+    _async_clients.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+atexit.register(close_mongo_clients)
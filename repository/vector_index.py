@@ -0,0 +1,235 @@
+import threading
+from typing import Dict, List, Optional, Tuple, Iterable, Any
+
+import numpy as np
+
+
+class VectorIndex:
+    """
+    Resident in-memory index of fragment embeddings for local vector search.
+    Stores L2-normalized float32 rows so cosine similarity is a single matrix-vector product.
+    Each row also records its metadata document, so searches scoped to (or away from) documents
+    are masked in NumPy without looking the fragments up in the database.
+    """
+
+    def __init__(self, dimension: Optional[int] = None, initial_capacity: int = 1024):
+        self._lock = threading.RLock()
+        self._dimension = dimension
+        self._initial_capacity = max(1, initial_capacity)
+        self._matrix: Optional[np.ndarray] = None
+        self._ids: List[str] = []
+        self._positions: dict = {}
+        # Per-row document code (-1 when unknown), the document ID each code stands for and its row count;
+        # a code is freed for reuse once its document has no rows left
+        self._documents: Optional[np.ndarray] = None
+        self._document_codes: Dict[str, int] = {}
+        self._document_names: List[Optional[str]] = []
+        self._document_rows: List[int] = []
+        self._free_document_codes: List[int] = []
+        self.built = False
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, fragment_id: str) -> bool:
+        return fragment_id in self._positions
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return self._dimension
+
+    def build(self, items: Iterable[Tuple[str, Any, Optional[str]]]):
+        """Rebuild the index from (fragment_id, embedding, document_id) triples"""
+        with self._lock:
+            self._reset()
+            for fragment_id, embedding, document_id in items:
+                self._add_locked(fragment_id, embedding, document_id)
+            self.built = True
+
+    def add(self, fragment_id: str, embedding: Any, document_id: Optional[str] = None) -> bool:
+        """Add or replace a single embedding"""
+        with self._lock:
+            return self._add_locked(fragment_id, embedding, document_id)
+
+    def remove(self, fragment_id: str) -> bool:
+        """Remove an embedding by fragment ID"""
+        with self._lock:
+            return self._remove_locked(fragment_id)
+
+    def remove_many(self, fragment_ids: Iterable[str]) -> int:
+        """Remove several embeddings and return how many were present"""
+        with self._lock:
+            return sum(1 for fragment_id in fragment_ids if self._remove_locked(fragment_id))
+
+    def clear(self):
+        """Drop all rows and mark the index as not built"""
+        with self._lock:
+            self._reset()
+            self.built = False
+
+    def search(self, query_embedding: Any, limit: int,
+               document_ids: Optional[Iterable[str]] = None,
+               exclude_document_ids: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Return the top `limit` (fragment_id, cosine similarity) pairs, best first.
+        `document_ids` restricts scoring to fragments of those documents (only their rows are scanned);
+        fragments of `exclude_document_ids` are masked out before ranking.
+        """
+        query = self._normalize(query_embedding)
+        if query is None or limit <= 0:
+            return []
+
+        with self._lock:
+            count = len(self._ids)
+            if count == 0 or query.shape[0] != self._dimension:
+                return []
+
+            # Documents with no rows here need no mask; a scope with none of them has nothing to score
+            excluded_codes = self._codes_of(exclude_document_ids)
+            excluded = self._document_mask(excluded_codes, count) if excluded_codes else None
+            if document_ids is not None:
+                allowed_codes = self._codes_of(document_ids)
+                if not allowed_codes:
+                    return []
+                allowed = self._document_mask(allowed_codes, count)
+                rows = np.flatnonzero(allowed if excluded is None else allowed & ~excluded)
+                scores = self._matrix[rows] @ query
+            else:
+                rows = None
+                scores = self._matrix[:count] @ query
+                if excluded is not None:
+                    scores[excluded] = -np.inf
+
+            k = min(limit, scores.shape[0])
+            if k == 0:
+                return []
+            if k < scores.shape[0]:
+                top = np.argpartition(scores, -k)[-k:]
+            else:
+                top = np.arange(scores.shape[0])
+            top = top[np.argsort(scores[top])[::-1]]
+            positions = top if rows is None else rows[top]
+            return [(self._ids[p], float(scores[i])) for i, p in zip(top, positions) if np.isfinite(scores[i])]
+
+    # Private helper methods
+
+    def _reset(self):
+        self._matrix = None
+        self._ids = []
+        self._positions = {}
+        self._documents = None
+        self._document_codes = {}
+        self._document_names = []
+        self._document_rows = []
+        self._free_document_codes = []
+
+    def _document_code(self, document_id: Optional[str]) -> int:
+        """Code of a document for a new row, counting the row against it"""
+        if document_id is None:
+            return -1
+        code = self._document_codes.get(document_id)
+        if code is None:
+            if self._free_document_codes:
+                code = self._free_document_codes.pop()
+                self._document_names[code] = document_id
+            else:
+                code = len(self._document_names)
+                self._document_names.append(document_id)
+                self._document_rows.append(0)
+            self._document_codes[document_id] = code
+        self._document_rows[code] += 1
+        return code
+
+    def _release_document_code(self, code: int):
+        """Drop a row from its document's count, freeing the code with the document's last row"""
+        if code < 0:
+            return
+        self._document_rows[code] -= 1
+        if self._document_rows[code] == 0:
+            del self._document_codes[self._document_names[code]]
+            self._document_names[code] = None
+            self._free_document_codes.append(code)
+
+    def _codes_of(self, document_ids: Optional[Iterable[str]]) -> List[int]:
+        """Codes of the documents that have rows in the index"""
+        if not document_ids:
+            return []
+        return [self._document_codes[document_id] for document_id in document_ids
+                if document_id in self._document_codes]
+
+    def _document_mask(self, codes: List[int], count: int) -> np.ndarray:
+        """Rows [0, count) that belong to one of the document codes"""
+        return np.isin(self._documents[:count], codes)
+
+    def _row_documents(self) -> List[Optional[str]]:
+        """Document ID of every row, in row order"""
+        return [self._document_names[code] if code >= 0 else None
+                for code in self._documents[:len(self._ids)].tolist()] if self._ids else []
+
+    def _add_locked(self, fragment_id: str, embedding: Any, document_id: Optional[str] = None) -> bool:
+        vector = self._normalize(embedding)
+        if vector is None:
+            return False
+
+        if self._dimension is None:
+            self._dimension = vector.shape[0]
+        if vector.shape[0] != self._dimension:
+            print(f"Skipping embedding for fragment {fragment_id}: dimension {vector.shape[0]} != {self._dimension}")
+            return False
+
+        position = self._positions.get(fragment_id)
+        if position is None:
+            position = len(self._ids)
+            self._ensure_capacity(position + 1)
+            self._ids.append(fragment_id)
+            self._positions[fragment_id] = position
+        else:
+            self._release_document_code(int(self._documents[position]))
+
+        self._matrix[position] = vector
+        self._documents[position] = self._document_code(document_id)
+        return True
+
+    def _remove_locked(self, fragment_id: str) -> bool:
+        position = self._positions.pop(fragment_id, None)
+        if position is None:
+            return False
+        self._release_document_code(int(self._documents[position]))
+
+        # Swap the last row into the freed slot to keep the matrix dense
+        last = len(self._ids) - 1
+        if position != last:
+            last_id = self._ids[last]
+            self._matrix[position] = self._matrix[last]
+            self._documents[position] = self._documents[last]
+            self._ids[position] = last_id
+            self._positions[last_id] = position
+        self._ids.pop()
+        return True
+
+    def _ensure_capacity(self, required: int):
+        if self._matrix is None:
+            capacity = max(self._initial_capacity, required)
+            self._matrix = np.zeros((capacity, self._dimension), dtype=np.float32)
+            self._documents = np.full(capacity, -1, dtype=np.int32)
+        elif required > self._matrix.shape[0]:
+            capacity = max(required, self._matrix.shape[0] * 2)
+            grown = np.zeros((capacity, self._dimension), dtype=np.float32)
+            grown[:len(self._ids)] = self._matrix[:len(self._ids)]
+            self._matrix = grown
+            documents = np.full(capacity, -1, dtype=np.int32)
+            documents[:len(self._ids)] = self._documents[:len(self._ids)]
+            self._documents = documents
+
+    @staticmethod
+    def _normalize(embedding: Any) -> Optional[np.ndarray]:
+        """Convert an embedding to a unit-length float32 vector, or None if unusable"""
+        if embedding is None:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        if vector.size == 0:
+            return None
+        norm = float(np.linalg.norm(vector))
+        if norm == 0.0 or not np.isfinite(norm):
+            return None
+        return vector / norm
@@ -0,0 +1,199 @@
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+from repository.async_chat_history_repository import AsyncChatHistoryRepository
+from entity.chat_history import ChatHistory
+from .chat_service_impl import ChatServiceImpl
+from .llm_client import LLMClient, get_llm_client
+
+
+class AsyncChatServiceImpl:
+    """
+    Asyncio variant of the chat pipeline.
+    Runs Ollama generation over a pooled async HTTP client and chat history I/O over Motor,
+    overlapping the independent steps (history and sidebar loads) with retrieval and generation.
+    Blocking steps (retrieval, cache, memory) run on a dedicated, sized thread pool.
+    Served natively from the ASGI entry point (asgi.py); under plain WSGI the calling worker
+    thread still waits for the whole pipeline.
+    """
+
+    def __init__(self, chat_service: ChatServiceImpl):
+        # Retrieval, prompt building and fallbacks are shared with the synchronous service
+        self.chat_service = chat_service
+        self.chat_repository = AsyncChatHistoryRepository()
+        self._http_clients: Dict[int, httpx.AsyncClient] = {}
+
+    async def send_text_message(self, message: str, conversation_id: Optional[str] = None,
+                                sidebar_limit: int = 20, include_history: bool = False) -> Dict[str, Any]:
+        """
+        Process a text-only message using RAG and LLM.
+        Also returns the sidebar conversations and, optionally, the prior conversation history,
+        both loaded while the answer is being generated.
+        """
+        try:
+            # Loaded before a new ID is generated: a new conversation has no earlier turns
+            conversation_state = await self._run_blocking(self.chat_service._get_conversation_state, conversation_id)
+            if not conversation_id:
+                conversation_id = self.chat_service._generate_conversation_id()
+
+            # Earlier turns are independent of this one: load them during generation
+            history_task = asyncio.create_task(
+                self.get_recent_history(conversation_id) if include_history else self._empty()
+            )
+
+            # Retrieval uses the synchronous repositories and in-memory index; keep it off the loop
+            context = await self._run_blocking(self.chat_service._get_rag_context, message)
+            context.update(conversation_state)
+            response, query_embedding = await self._run_blocking(
+                self.chat_service._get_cached_response, message, context
+            )
+            cached = response is not None
+            if not cached:
+                response = await self._generate_llm_response(message, context)
+                await self._run_blocking(self.chat_service._cache_response, message, query_embedding, context, response)
+
+            chat_entry = ChatHistory(
+                conversation_id=conversation_id,
+                prompt=message,
+                response=response["content"]
+            )
+            chat_id = await self.chat_repository.save(chat_entry.to_dict())
+
+            # The sidebar is read after the save so it lists this conversation with its latest message
+            sidebar_task = asyncio.create_task(self.get_user_conversations(sidebar_limit))
+            await self._run_blocking(self.chat_service._record_turn, conversation_id, context, not cached)
+
+            history, conversations = await asyncio.gather(history_task, sidebar_task)
+
+            return {
+                "conversation_id": conversation_id,
+                "response": response["content"],
+                "confidence": response.get("confidence", 0.8),
+                "sources": context.get("sources", []),
+                "context_tokens": context.get("context_tokens", 0),
+                "chat_id": chat_id,
+                "cached": cached,
+                "timestamp": datetime.now().isoformat(),
+                "conversations": conversations,
+                "history": history
+            }
+
+        except Exception as e:
+            print(f"Error processing text message: {e}")
+            return {
+                "error": "Error processing message",
+                "message": str(e)
+            }
+
+    async def get_recent_history(self, conversation_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Retrieve the latest turns of a conversation (one page), oldest first"""
+        try:
+            history_docs = await self.chat_repository.find_recent_by_conversation_id(
+                conversation_id, ChatServiceImpl._history_page_size(limit)
+            )
+            return [ChatServiceImpl._format_history_entry(doc) for doc in history_docs]
+        except Exception as e:
+            print(f"Error retrieving conversation history: {e}")
+            return []
+
+    async def get_user_conversations(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Get recent conversations"""
+        try:
+            conversations = await self.chat_repository.get_recent_conversations(limit)
+            return [ChatServiceImpl._format_conversation(conv) for conv in conversations]
+        except Exception as e:
+            print(f"Error retrieving user conversations: {e}")
+            return []
+
+    async def aclose(self):
+        """Close the HTTP client bound to the running loop"""
+        client = self._http_clients.pop(id(asyncio.get_running_loop()), None)
+        if client is not None:
+            await client.aclose()
+
+    # Private helper methods
+
+    async def _empty(self) -> List[Dict[str, Any]]:
+        return []
+
+    async def _run_blocking(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Run a blocking step on the chat worker pool without holding up the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(
+            _get_blocking_executor(), functools.partial(func, *args)
+        )
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """Keep-alive HTTP client for the running loop (httpx clients are loop-bound)"""
+        loop_id = id(asyncio.get_running_loop())
+        client = self._http_clients.get(loop_id)
+        if client is None:
+            # Same timeouts as the synchronous client (LLM_CONNECT_TIMEOUT / LLM_READ_TIMEOUT)
+            llm_client = get_llm_client()
+            client = httpx.AsyncClient(
+                base_url=os.getenv('OLLAMA_URL', 'http://localhost:11434'),
+                limits=httpx.Limits(
+                    max_connections=int(os.getenv('ASYNC_HTTP_MAX_CONNECTIONS', '200')),
+                    max_keepalive_connections=int(os.getenv('ASYNC_HTTP_MAX_KEEPALIVE', '50'))
+                ),
+                timeout=httpx.Timeout(llm_client.read_timeout, connect=llm_client.connect_timeout)
+            )
+            self._http_clients[loop_id] = client
+        return client
+
+    async def _generate_llm_response(self, message: str, context: Dict[str, Any]) -> Dict[str, Any]:
+        """Generate response using LLM with medical context; only the HTTP call differs from the sync service"""
+        try:
+            prompt = self.chat_service._build_medical_prompt(message, context)
+            try:
+                response = await self._get_http_client().post(
+                    "/api/generate",
+                    json=LLMClient.generate_body(prompt, stream=False, context=context.get("generation_context"))
+                )
+            except httpx.TimeoutException:
+                raise Exception("Ollama model took too long to respond")
+            except httpx.ConnectError:
+                raise Exception("Cannot connect to Ollama. Make sure it's running.")
+
+            if response.status_code != 200:
+                raise Exception(f"Ollama API error: {response.status_code}")
+            return self.chat_service._llm_response_from_result(prompt, context, response.json())
+
+        except Exception as e:
+            return self.chat_service._generation_fallback(message, e)
+
+
+_blocking_executor: Optional[ThreadPoolExecutor] = None
+_blocking_executor_lock = threading.Lock()
+
+
+def _get_blocking_executor() -> ThreadPoolExecutor:
+    """
+    Process-wide pool for the blocking steps of async chats.
+    Sized separately (ASYNC_CHAT_BLOCKING_THREADS) so chats do not queue behind other to_thread work.
+    """
+    global _blocking_executor
+    with _blocking_executor_lock:
+        if _blocking_executor is None:
+            _blocking_executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv('ASYNC_CHAT_BLOCKING_THREADS', '32')),
+                thread_name_prefix="async-chat-blocking"
+            )
+        return _blocking_executor
+
+
+def _reset_after_fork():
+    """Worker threads do not survive a fork; the child starts its own pool"""
+    global _blocking_executor, _blocking_executor_lock
+    _blocking_executor = None
+    _blocking_executor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
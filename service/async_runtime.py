@@ -0,0 +1,63 @@
+import os
+import asyncio
+import threading
+from typing import Any, Coroutine, Optional
+
+
+class AsyncRuntime:
+    """
+    Long-lived asyncio event loop running on a background thread.
+    Lets the synchronous Flask views hand coroutines to one shared loop, so in-flight
+    chats share a single Motor pool and HTTP client instead of pinning their own resources.
+    Used only under WSGI: the submitting view thread blocks in run() until its coroutine finishes.
+    The ASGI entry point (asgi.py) awaits the pipeline on the server's own loop instead.
+    """
+    
+    def __init__(self):
+        # Blocking chat steps run on the chat service's own pool, not the loop's default executor
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="async-runtime", daemon=True)
+        self._thread.start()
+    
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+    
+    def run(self, coroutine: Coroutine, timeout: Optional[float] = None) -> Any:
+        """Run a coroutine on the shared loop and wait for its result"""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result(timeout)
+        except Exception:
+            future.cancel()
+            raise
+    
+    def shutdown(self):
+        """Stop the loop and wait for the thread to exit"""
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=5)
+
+
+_runtime: Optional[AsyncRuntime] = None
+_runtime_lock = threading.Lock()
+
+
+def get_async_runtime() -> AsyncRuntime:
+    """Get the process-wide async runtime, starting it on first use"""
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = AsyncRuntime()
+        return _runtime
+
+
+def _reset_after_fork():
+    """The loop thread does not survive a fork; the child starts its own runtime"""
+    global _runtime, _runtime_lock
+    _runtime = None
+    _runtime_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
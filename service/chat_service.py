@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterator
 from entity.chat_history import ChatHistory
 
 
@@ -22,6 +22,20 @@ class ChatService(ABC):
         """
         pass
     
+    @abstractmethod
+    def stream_text_message(self, message: str, conversation_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Process a text-only message streaming the response as it is generated.
+        
+        Args:
+            message: User's text message
+            conversation_id: Existing conversation to continue, if any
+            
+        Returns:
+            Iterator of events: "start", one "token" per generated chunk, then "done"
+        """
+        pass
+    
     @abstractmethod
     def analyze_image_with_text(self, image_data: bytes, message: str) -> Dict[str, Any]:
         """
@@ -37,15 +51,23 @@ class ChatService(ABC):
         pass
     
     @abstractmethod
-    def get_conversation_history(self, conversation_id: str) -> List[Dict[str, Any]]:
+    def get_conversation_history(self, conversation_id: str, before: Optional[str] = None,
+                                 after: Optional[str] = None, page_size: Optional[int] = None) -> Dict[str, Any]:
         """
-        Retrieve full conversation history by conversation ID.
+        Retrieve one page of a conversation's history, oldest first (the latest page by default).
         
         Args:
             conversation_id: Unique conversation identifier
+            before: previous_cursor of a page, to get the older turns before it
+            after: next_cursor of a page, to get the newer turns after it
+            page_size: Maximum entries per page
             
         Returns:
-            List of chat history entries
+            Dictionary with the page entries, previous_cursor (None on the first page)
+            and next_cursor (None on the latest page)
+            
+        Raises:
+            ValueError: If a cursor is malformed
         """
         pass
     
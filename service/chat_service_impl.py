@@ -1,15 +1,29 @@
+import os
 import uuid
-from datetime import datetime
-from typing import List, Optional, Dict, Any
+from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Any, Iterator, Tuple
 import base64
 import io
+import requests
 from PIL import Image
+from bson import ObjectId
+from bson.errors import InvalidId
 
 from .chat_service import ChatService
 from repository.chat_history_repository import ChatHistoryRepository
 from repository.fragment_document_repository import FragmentDocumentRepository
 from entity.chat_history import ChatHistory
 from .rag_service_impl import RAGServiceImpl
+from .llm_client import get_llm_client
+from .response_cache import get_response_cache
+from .reranker import get_reranker
+from .context_packer import ContextPacker, ContextPassage, get_context_packer
+from .conversation_memory_service import ConversationMemoryService
+from .generation_context_store import get_generation_context_store
+
+
+# MongoDB dates are naive UTC milliseconds; history cursors are relative to this
+_EPOCH = datetime(1970, 1, 1)
 
 
 class ChatServiceImpl(ChatService):
@@ -22,19 +36,34 @@ class ChatServiceImpl(ChatService):
         self.chat_repository = ChatHistoryRepository()
         self.fragment_repository = FragmentDocumentRepository()
         self.rag_service = RAGServiceImpl()  # Initialize RAG service
+        self.llm_client = get_llm_client()  # Shared keep-alive connection pool to Ollama
+        self.response_cache = get_response_cache()  # Semantic cache of generated answers
+        self.reranker = get_reranker()  # Optional second-stage ranking of retrieval candidates
+        self.context_packer = get_context_packer()  # Token-budgeted prompt context
+        # Rolling window of recent turns plus a background-refreshed summary of older ones
+        self.conversation_memory = ConversationMemoryService(self.chat_repository, self.context_packer.token_counter)
+        self.generation_contexts = get_generation_context_store()  # Ollama KV context per conversation
         
     def send_text_message(self, message: str, conversation_id: Optional[str] = None) -> Dict[str, Any]:
         """Process a text-only message using RAG and LLM"""
         try:
+            # Earlier turns of an existing conversation: the Ollama context of the last turn, or a bounded history
+            conversation_state = self._get_conversation_state(conversation_id)
+            
             # Generate or use existing conversation ID
             if not conversation_id:
                 conversation_id = self._generate_conversation_id()
             
             # Retrieve relevant context using RAG
             context = self._get_rag_context(message)
+            context.update(conversation_state)
             
-            # Generate response using LLM with context
-            response = self._generate_llm_response(message, context)
+            # Reuse a cached answer for the same question and sources, otherwise generate one
+            response, query_embedding = self._get_cached_response(message, context)
+            cached = response is not None
+            if not cached:
+                response = self._generate_llm_response(message, context)
+                self._cache_response(message, query_embedding, context, response)
             
             # Save to chat history
             chat_entry = ChatHistory(
@@ -44,13 +73,16 @@ class ChatServiceImpl(ChatService):
             )
             
             chat_id = self.chat_repository.save(chat_entry.to_dict())
+            self._record_turn(conversation_id, context, not cached)
             
             return {
                 "conversation_id": conversation_id,
                 "response": response["content"],
                 "confidence": response.get("confidence", 0.8),
                 "sources": context.get("sources", []),
+                "context_tokens": context.get("context_tokens", 0),
                 "chat_id": chat_id,
+                "cached": cached,
                 "timestamp": datetime.now().isoformat()
             }
             
@@ -61,6 +93,74 @@ class ChatServiceImpl(ChatService):
                 "message": str(e)
             }
     
+    def stream_text_message(self, message: str, conversation_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Process a text-only message streaming the LLM answer token by token.
+        The accumulated answer is saved to chat history once the stream ends.
+        """
+        conversation_state = self._get_conversation_state(conversation_id)
+        if not conversation_id:
+            conversation_id = self._generate_conversation_id()
+        
+        context = self._get_rag_context(message)
+        context.update(conversation_state)
+        cached_response, query_embedding = self._get_cached_response(message, context)
+        yield {
+            "event": "start",
+            "conversation_id": conversation_id,
+            "sources": context.get("sources", []),
+            "context_tokens": context.get("context_tokens", 0),
+            "cached": cached_response is not None
+        }
+        
+        tokens: List[str] = []
+        completed = False
+        try:
+            if cached_response is not None:
+                tokens.append(cached_response["content"])
+                yield {"event": "token", "token": cached_response["content"]}
+            else:
+                for token in self._stream_llm_response(message, context):
+                    tokens.append(token)
+                    yield {"event": "token", "token": token}
+                completed = True
+        except Exception as e:
+            print(f"Error streaming LLM response: {e}")
+            if not tokens:
+                fallback = self._fallback_response(message)["content"]
+                tokens.append(fallback)
+                yield {"event": "token", "token": fallback}
+        finally:
+            # Runs on normal completion and when the client disconnects mid-stream
+            response_text = "".join(tokens).strip()
+            chat_id = None
+            if response_text:
+                try:
+                    chat_entry = ChatHistory(
+                        conversation_id=conversation_id,
+                        prompt=message,
+                        response=response_text
+                    )
+                    chat_id = self.chat_repository.save(chat_entry.to_dict())
+                    self._record_turn(conversation_id, context, completed)
+                except Exception as e:
+                    print(f"Error saving streamed message: {e}")
+        
+        if completed and response_text:
+            self._cache_response(message, query_embedding, context, {
+                "content": response_text,
+                "confidence": 0.85,
+                "reasoning": "Análisis basado en conocimiento médico especializado"
+            })
+        
+        yield {
+            "event": "done",
+            "conversation_id": conversation_id,
+            "chat_id": chat_id,
+            "cached": cached_response is not None,
+            "timestamp": datetime.now().isoformat()
+        }
+    
     def analyze_image_with_text(self, image_data: bytes, message: str, conversation_id: Optional[str] = None) -> Dict[str, Any]:
         """Analyze medical image with accompanying text using multimodal LLM"""
         try:
@@ -90,6 +190,9 @@ class ChatServiceImpl(ChatService):
             )
             
             chat_id = self.chat_repository.save(chat_entry.to_dict())
+            if self.generation_contexts:
+                # The image turn is not part of the stored Ollama context; the next turn rebuilds from history
+                self.generation_contexts.discard(conversation_id)
             
             return {
                 "conversation_id": conversation_id,
@@ -108,25 +211,52 @@ class ChatServiceImpl(ChatService):
                 "message": str(e)
             }
     
-    def get_conversation_history(self, conversation_id: str) -> List[Dict[str, Any]]:
-        """Retrieve full conversation history"""
+    def get_conversation_history(self, conversation_id: str, before: Optional[str] = None,
+                                 after: Optional[str] = None, page_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Retrieve one keyset-paginated page of conversation history, oldest first; the latest page by default.
+        `previous_cursor` is passed back as `before` for the older turns (None on the first page),
+        `next_cursor` as `after` for the newer ones (None on the latest page).
+        A malformed cursor raises ValueError.
+        """
+        page_size = self._history_page_size(page_size)
+        before_key = self._decode_cursor(before)
+        after_key = self._decode_cursor(after)
         try:
-            history_docs = self.chat_repository.find_by_conversation_id(conversation_id)
-            
-            history = []
-            for doc in history_docs:
-                chat_entry = ChatHistory.from_dict(doc)
-                history.append({
-                    "id": chat_entry.id,
-                    "prompt": chat_entry.prompt,
-                    "response": chat_entry.response,
-                    "date": chat_entry.date.isoformat()
-                })
+            # One extra entry tells whether another page follows in the reading direction;
+            # the cursor's own entry lies in the other direction
+            if after_key is not None:
+                history_docs = self.chat_repository.find_page(conversation_id, after_key, page_size + 1)
+                has_newer = len(history_docs) > page_size
+                history_docs = history_docs[:page_size]
+                has_older = True
+            else:
+                history_docs = self.chat_repository.find_recent_by_conversation_id(
+                    conversation_id, page_size + 1, before=before_key
+                )
+                has_older = len(history_docs) > page_size
+                history_docs = history_docs[-page_size:]
+                has_newer = before_key is not None
             
-            return history
+            return {
+                "entries": [self._format_history_entry(doc) for doc in history_docs],
+                "previous_cursor": self._encode_cursor(history_docs[0]) if has_older and history_docs else None,
+                "next_cursor": self._encode_cursor(history_docs[-1]) if has_newer and history_docs else None
+            }
             
         except Exception as e:
             print(f"Error retrieving conversation history: {e}")
+            return {"entries": [], "previous_cursor": None, "next_cursor": None}
+    
+    def get_recent_history(self, conversation_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Retrieve the latest turns of a conversation (one page), oldest first"""
+        try:
+            history_docs = self.chat_repository.find_recent_by_conversation_id(
+                conversation_id, self._history_page_size(limit)
+            )
+            return [self._format_history_entry(doc) for doc in history_docs]
+        except Exception as e:
+            print(f"Error retrieving recent conversation history: {e}")
             return []
     
     def get_user_conversations(self, limit: int = 10) -> List[Dict[str, Any]]:
@@ -134,17 +264,7 @@ class ChatServiceImpl(ChatService):
         try:
             conversations = self.chat_repository.get_recent_conversations(limit)
             
-            formatted_conversations = []
-            for conv in conversations:
-                formatted_conversations.append({
-                    "conversation_id": conv["_id"],
-                    "last_message": conv.get("last_message", ""),
-                    "last_response": conv.get("last_response", ""),
-                    "last_date": conv.get("last_date").isoformat() if conv.get("last_date") else "",
-                    "message_count": conv.get("message_count", 0)
-                })
-            
-            return formatted_conversations
+            return [self._format_conversation(conv) for conv in conversations]
             
         except Exception as e:
             print(f"Error retrieving user conversations: {e}")
@@ -153,6 +273,9 @@ class ChatServiceImpl(ChatService):
     def delete_conversation(self, conversation_id: str) -> bool:
         """Delete an entire conversation"""
         try:
+            self.conversation_memory.forget(conversation_id)
+            if self.generation_contexts:
+                self.generation_contexts.discard(conversation_id)
             return self.chat_repository.delete_conversation(conversation_id)
         except Exception as e:
             print(f"Error deleting conversation: {e}")
@@ -164,107 +287,288 @@ class ChatServiceImpl(ChatService):
         """Generate a unique conversation ID"""
         return f"conv_{uuid.uuid4().hex[:12]}"
     
+    @staticmethod
+    def _history_page_size(page_size: Optional[int]) -> int:
+        """Requested page size, defaulting to HISTORY_PAGE_SIZE and capped at HISTORY_MAX_PAGE_SIZE"""
+        page_size = page_size or int(os.getenv('HISTORY_PAGE_SIZE', '20'))
+        return max(1, min(page_size, int(os.getenv('HISTORY_MAX_PAGE_SIZE', '100'))))
+    
+    @staticmethod
+    def _encode_cursor(doc: Dict[str, Any]) -> str:
+        """Opaque history cursor: the entry's date (ms since epoch, as stored by MongoDB) and ID"""
+        milliseconds = (doc["date"] - _EPOCH) // timedelta(milliseconds=1)
+        return f"{milliseconds}.{doc['_id']}"
+    
+    @staticmethod
+    def _decode_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, ObjectId]]:
+        if not cursor:
+            return None
+        try:
+            milliseconds, entry_id = cursor.split(".", 1)
+            return _EPOCH + timedelta(milliseconds=int(milliseconds)), ObjectId(entry_id)
+        except (ValueError, InvalidId):
+            raise ValueError(f"Invalid history cursor {cursor!r}")
+    
+    @staticmethod
+    def _format_history_entry(doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Format a chat history document for the views"""
+        chat_entry = ChatHistory.from_dict(doc)
+        return {
+            "id": chat_entry.id,
+            "prompt": chat_entry.prompt,
+            "response": chat_entry.response,
+            "date": chat_entry.date.isoformat()
+        }
+    
+    @staticmethod
+    def _format_conversation(conv: Dict[str, Any]) -> Dict[str, Any]:
+        """Format a conversation summary for the sidebar"""
+        return {
+            "conversation_id": conv["_id"],
+            "last_message": conv.get("last_message", ""),
+            "last_response": conv.get("last_response", ""),
+            "last_date": conv.get("last_date").isoformat() if conv.get("last_date") else "",
+            "message_count": conv.get("message_count", 0)
+        }
+    
+    @staticmethod
+    def _format_pages(page_start: Optional[int], page_end: Optional[int]) -> str:
+        """Page citation for a fragment (empty for unpaginated documents)"""
+        if not page_start:
+            return ""
+        if page_end and page_end != page_start:
+            return f"pp. {page_start}-{page_end}"
+        return f"p. {page_start}"
+    
+    def _passage_label(self, passage: ContextPassage) -> str:
+        """Citation header for a packed passage"""
+        pages = self._format_pages(passage.page_start, passage.page_end)
+        return f"{passage.document_title}, {pages}" if pages else passage.document_title
+    
     def _get_rag_context(self, query: str) -> Dict[str, Any]:
-        """Retrieve relevant context using RAG system"""
+        """Retrieve relevant context using RAG system, packed into the CONTEXT_TOKEN_BUDGET"""
         try:
-            # Search for similar documents using RAG
-            similar_docs = self.rag_service.search_similar_documents(query, limit=3)
+            # Search for similar documents using RAG; with reranking, a wider candidate set is narrowed first
+            limit = self.context_packer.candidates
+            if self.reranker:
+                candidates = self.rag_service.search_similar_documents(query, limit=max(self.reranker.candidates, limit))
+                similar_docs = self.reranker.rerank(query, candidates, limit=limit)
+            else:
+                similar_docs = self.rag_service.search_similar_documents(query, limit=limit)
             
-            if similar_docs:
-                # Combine context from multiple documents
-                context_parts = []
+            packed = self.context_packer.pack(similar_docs, self._passage_label)
+            if packed.passages:
                 sources = []
-                
-                for doc in similar_docs:
-                    context_parts.append(f"[{doc['document_title']}]: {doc['content'][:500]}")
+                for passage in packed.passages:
+                    best = max(passage.hits, key=lambda hit: hit.get('score', 0.0))
                     sources.append({
-                        "title": doc['document_title'],
-                        "type": doc['document_type'],
-                        "specialty": doc['specialty'],
-                        "relevance": doc['score']
+                        "title": passage.document_title,
+                        "type": passage.document_type,
+                        "specialty": passage.specialty,
+                        "pages": self._format_pages(passage.page_start, passage.page_end),
+                        "relevance": best['score'],
+                        "rerank_score": best.get('rerank_score'),
+                        "vector_score": best.get('vector_score'),
+                        "text_score": best.get('text_score'),
+                        "tokens": passage.tokens
                     })
                 
-                combined_context = "\n\n".join(context_parts)
-                avg_score = sum(doc['score'] for doc in similar_docs) / len(similar_docs)
+                fragment_ids = [fragment_id for passage in packed.passages for fragment_id in passage.fragment_ids]
+                avg_score = sum(source['relevance'] for source in sources) / len(sources)
+                print(f"RAG context: {packed.tokens_used}/{packed.token_budget} tokens, "
+                      f"{len(packed.passages)} passages from {packed.candidates} candidates")
                 
                 return {
-                    "context": combined_context,
+                    "context": ContextPacker.render(packed.passages, self._passage_label),
                     "sources": sources,
-                    "relevance_score": avg_score
+                    "relevance_score": avg_score,
+                    "context_tokens": packed.tokens_used,
+                    "fragment_ids": fragment_ids,
+                    "metadata_ids": list(dict.fromkeys(passage.metadata_id for passage in packed.passages))
                 }
             else:
                 return {
                     "context": "No se encontraron documentos relevantes en la base de conocimiento médica.",
                     "sources": [],
-                    "relevance_score": 0.0
+                    "relevance_score": 0.0,
+                    "context_tokens": 0,
+                    "fragment_ids": [],
+                    "metadata_ids": []
                 }
                 
         except Exception as e:
             print(f"Error retrieving RAG context: {e}")
-            return {"context": "", "sources": [], "relevance_score": 0.0}
+            return {"context": "", "sources": [], "relevance_score": 0.0, "context_tokens": 0,
+                    "fragment_ids": [], "metadata_ids": []}
+    
+    def _get_cached_response(self, message: str, context: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[List[float]]]:
+        """
+        Look up a cached answer for this question and retrieved fragments.
+        Returns the cached response (or None) and the query embedding used for the lookup.
+        """
+        # Answers to follow-up questions depend on the conversation, so they are never shared
+        if not self.response_cache or self._is_follow_up(context):
+            return None, None
+        try:
+            # Served from the embedding cache: retrieval already embedded this query
+            query_embedding = self.rag_service.embed_query(message)
+            return self.response_cache.get(message, query_embedding, context.get("fragment_ids", [])), query_embedding
+        except Exception as e:
+            print(f"Error reading response cache: {e}")
+            return None, None
+    
+    def _cache_response(self, message: str, query_embedding: Optional[List[float]],
+                        context: Dict[str, Any], response: Dict[str, Any]):
+        """Cache a generated answer; fallback answers are never cached"""
+        if not self.response_cache or response.get("fallback") or self._is_follow_up(context):
+            return
+        self.response_cache.put(
+            message,
+            query_embedding,
+            context.get("fragment_ids", []),
+            context.get("metadata_ids", []),
+            response
+        )
     
     def _generate_llm_response(self, message: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Generate response using LLM with medical context"""
         try:
-            import os
-            import requests
+            # Create medical prompt
+            medical_prompt = self._build_medical_prompt(message, context)
+            
+            # Request through the shared keep-alive Ollama client
+            try:
+                result = self.llm_client.generate(
+                    medical_prompt,
+                    model=os.getenv('OLLAMA_MODEL', 'AlthosKal/medicoia'),
+                    context=context.get("generation_context")
+                )
+            except requests.exceptions.Timeout:
+                raise Exception("Ollama model took too long to respond")
+            except requests.exceptions.ConnectionError:
+                raise Exception("Cannot connect to Ollama. Make sure it's running.")
             
-            # Get configuration from environment
-            ollama_url = os.getenv('OLLAMA_URL', 'http://localhost:11434')
-            ollama_model = os.getenv('OLLAMA_MODEL', 'AlthosKal/medicoia')
+            return self._llm_response_from_result(medical_prompt, context, result)
             
-            # Create medical prompt
-            medical_prompt = f"""Eres un asistente médico especializado. Tu trabajo es proporcionar información médica educativa y sugerencias generales.
+        except Exception as e:
+            return self._generation_fallback(message, e)
+    
+    def _llm_response_from_result(self, prompt: str, context: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+        """Turn a non-streaming /api/generate result into a chat response (shared by the sync and async pipelines)"""
+        self._record_generation(prompt, context, result)
+        llm_response = result.get("response", "")
+        if not llm_response:
+            raise Exception("Empty response from Ollama")
+        return {
+            "content": llm_response.strip(),
+            "confidence": 0.85,
+            "reasoning": "Análisis basado en conocimiento médico especializado"
+        }
+    
+    def _record_generation(self, prompt: str, context: Dict[str, Any], result: Dict[str, Any]):
+        """Keep the returned Ollama context for the next turn and calibrate the token estimate"""
+        context["next_generation_context"] = result.get("context")
+        self.context_packer.token_counter.observe(
+            prompt, result.get("prompt_eval_count"), reused_context=bool(context.get("generation_context"))
+        )
+    
+    def _generation_fallback(self, message: str, error: Exception) -> Dict[str, Any]:
+        """Fallback answer when generation fails"""
+        print(f"Error generating LLM response: {error}")
+        return self._fallback_response(message)
+    
+    def _stream_llm_response(self, message: str, context: Dict[str, Any]) -> Iterator[str]:
+        """Stream response tokens from Ollama's NDJSON /api/generate stream"""
+        # Only connecting and the gap between tokens are bounded, not the whole answer
+        read_timeout = float(os.getenv('OLLAMA_STREAM_READ_TIMEOUT', '60'))
+        
+        try:
+            prompt = self._build_medical_prompt(message, context)
+            for chunk in self.llm_client.stream_generate(
+                prompt,
+                model=os.getenv('OLLAMA_MODEL', 'AlthosKal/medicoia'),
+                read_timeout=read_timeout,
+                context=context.get("generation_context")
+            ):
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    self._record_generation(prompt, context, chunk)
+                        
+        except requests.exceptions.Timeout:
+            raise Exception("Ollama model took too long to respond")
+        except requests.exceptions.ConnectionError:
+            raise Exception("Cannot connect to Ollama. Make sure it's running.")
+    
+    def _build_medical_prompt(self, message: str, context: Dict[str, Any]) -> str:
+        """
+        Build the medical prompt sent to the LLM.
+        When continuing from a previous turn's Ollama context, the instructions and earlier turns
+        are already evaluated, so only the new sources and question are sent.
+        """
+        if context.get("generation_context"):
+            return f"""
+
+Contexto médico relevante: {context.get("context", "No hay contexto específico disponible")}
+
+Pregunta del usuario: {message}
+
+Respuesta médica profesional:"""
+        return f"""Eres un asistente médico especializado. Tu trabajo es proporcionar información médica educativa y sugerencias generales.
 
 IMPORTANTE: Siempre recuerda al usuario que:
 1. Esta información es solo educativa
 2. No reemplaza la consulta médica profesional
 3. Debe buscar atención médica si tiene síntomas graves
 
-Contexto médico relevante: {context.get("context", "No hay contexto específico disponible")}
+{self._format_history(context)}Contexto médico relevante: {context.get("context", "No hay contexto específico disponible")}
 
 Pregunta del usuario: {message}
 
 Respuesta médica profesional:"""
-            
-            # Make direct request to Ollama API
-            try:
-                response = requests.post(
-                    f"{ollama_url}/api/generate",
-                    json={
-                        "model": ollama_model,
-                        "prompt": medical_prompt,
-                        "stream": False
-                    },
-                    timeout=30  # Reduced timeout
+    
+    def _get_conversation_state(self, conversation_id: Optional[str]) -> Dict[str, Any]:
+        """
+        Earlier turns for the prompt: the Ollama context returned by the previous turn when
+        it is still available, otherwise the rolling history and summary
+        """
+        model = os.getenv('OLLAMA_MODEL', 'AlthosKal/medicoia')
+        generation_context = self.generation_contexts.get(conversation_id, model) if self.generation_contexts else None
+        if generation_context:
+            return {"generation_context": generation_context, "history": ""}
+        return {"generation_context": None, "history": self.conversation_memory.render(conversation_id)}
+    
+    def _record_turn(self, conversation_id: str, context: Dict[str, Any], generated: bool):
+        """After a turn is saved: keep its Ollama context for the next turn and refresh the summary"""
+        if self.generation_contexts:
+            if generated:
+                self.generation_contexts.put(
+                    conversation_id, os.getenv('OLLAMA_MODEL', 'AlthosKal/medicoia'), context.get("next_generation_context")
                 )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    llm_response = result.get("response", "")
-                    if not llm_response:
-                        raise Exception("Empty response from Ollama")
-                else:
-                    raise Exception(f"Ollama API error: {response.status_code}")
-                    
-            except requests.exceptions.Timeout:
-                raise Exception("Ollama model took too long to respond")
-            except requests.exceptions.ConnectionError:
-                raise Exception("Cannot connect to Ollama. Make sure it's running.")
-            
-            return {
-                "content": llm_response.strip(),
-                "confidence": 0.85,
-                "reasoning": "Análisis basado en conocimiento médico especializado"
-            }
-            
-        except Exception as e:
-            print(f"Error generating LLM response: {e}")
-            return {
-                "content": f"Como asistente médico especializado, puedo ayudarte con información sobre '{message}'. Sin embargo, es importante recordar que esta información es solo educativa y no reemplaza la consulta con un profesional médico. Te recomiendo consultar con un doctor para una evaluación completa de tu situación.",
-                "confidence": 0.7,
-                "reasoning": "Respuesta de respaldo por error en el sistema principal"
-            }
+            else:
+                # A cached or fallback answer was not generated on top of the stored context
+                self.generation_contexts.discard(conversation_id)
+        self.conversation_memory.record_turn(conversation_id)
+    
+    @staticmethod
+    def _is_follow_up(context: Dict[str, Any]) -> bool:
+        """Answers that depend on earlier turns must not be shared through the response cache"""
+        return bool(context.get("history") or context.get("generation_context"))
+    
+    @staticmethod
+    def _format_history(context: Dict[str, Any]) -> str:
+        """Conversation memory section of the prompt (empty for the first turn)"""
+        history = context.get("history")
+        return f"{history}\n\n" if history else ""
+    
+    def _fallback_response(self, message: str) -> Dict[str, Any]:
+        """Canned answer used when the LLM is unavailable"""
+        return {
+            "content": f"Como asistente médico especializado, puedo ayudarte con información sobre '{message}'. Sin embargo, es importante recordar que esta información es solo educativa y no reemplaza la consulta con un profesional médico. Te recomiendo consultar con un doctor para una evaluación completa de tu situación.",
+            "confidence": 0.7,
+            "reasoning": "Respuesta de respaldo por error en el sistema principal",
+            "fallback": True
+        }
     
     def _process_medical_image(self, image_data: bytes) -> Optional[Dict[str, Any]]:
         """Process and validate medical image"""
@@ -0,0 +1,244 @@
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+
+@dataclass
+class ContextPassage:
+    """One or more adjacent chunks of a document, packed into the prompt as a unit"""
+    metadata_id: str
+    document_title: str
+    document_type: str
+    specialty: str
+    chunk_start: int
+    chunk_end: int
+    content: str
+    score: float
+    page_start: Optional[int] = None
+    page_end: Optional[int] = None
+    fragment_ids: List[str] = field(default_factory=list)
+    hits: List[Dict[str, Any]] = field(default_factory=list)
+    tokens: int = 0
+    truncated: bool = False
+
+
+@dataclass
+class PackedContext:
+    """Passages chosen for the prompt, best first, with the tokens they use"""
+    passages: List[ContextPassage]
+    tokens_used: int
+    token_budget: int
+    candidates: int
+
+
+class TokenCounter:
+    """
+    Token counts for the configured Ollama model.
+    Uses a Hugging Face tokenizer when CONTEXT_TOKENIZER names one (needs the tokenizers package);
+    otherwise estimates from a characters-per-token ratio that is calibrated against the
+    prompt_eval_count Ollama reports for OLLAMA_MODEL.
+    """
+
+    def __init__(self, tokenizer_name: Optional[str] = None, chars_per_token: Optional[float] = None):
+        self.tokenizer_name = tokenizer_name or os.getenv('CONTEXT_TOKENIZER')
+        self.chars_per_token = chars_per_token or float(os.getenv('CONTEXT_CHARS_PER_TOKEN', '3.5'))
+        self.max_drift = float(os.getenv('CONTEXT_CALIBRATION_MAX_DRIFT', '1.5'))
+        self._lock = threading.Lock()
+        self._tokenizer = self._load_tokenizer(self.tokenizer_name) if self.tokenizer_name else None
+        # Running totals from Ollama responses (characters sent, tokens evaluated)
+        self._observed_chars = 0
+        self._observed_tokens = 0
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+        return max(1, int(len(text) / self.chars_per_token + 0.5))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Longest prefix of `text` within `max_tokens`, cut back to a sentence or word boundary"""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        if self._tokenizer is not None:
+            encoding = self._tokenizer.encode(text, add_special_tokens=False)
+            prefix = text[:encoding.offsets[max_tokens - 1][1]]
+        else:
+            prefix = text[:int(max_tokens * self.chars_per_token)]
+        for separator in ("\n\n", "\n", ". ", " "):
+            position = prefix.rfind(separator, len(prefix) // 2)
+            if position != -1:
+                return prefix[:position + len(separator)].rstrip()
+        return prefix
+
+    def observe(self, prompt: str, prompt_eval_count: Optional[int], reused_context: bool = False):
+        """
+        Calibrate the estimate from a fully evaluated prompt and its reported token count.
+        prompt_eval_count leaves out tokens Ollama served from its cache (a reused `context`, a repeated
+        prefix), which would inflate the ratio: calls that reused a context are ignored, and so are samples
+        whose ratio exceeds the current one by more than CONTEXT_CALIBRATION_MAX_DRIFT.
+        """
+        if self._tokenizer is not None or reused_context or not prompt or not prompt_eval_count:
+            return
+        if len(prompt) / prompt_eval_count > self.chars_per_token * self.max_drift:
+            return
+        with self._lock:
+            self._observed_chars += len(prompt)
+            self._observed_tokens += int(prompt_eval_count)
+            # Only replace the configured ratio once there is a meaningful sample
+            if self._observed_tokens >= 500:
+                self.chars_per_token = self._observed_chars / self._observed_tokens
+
+    @staticmethod
+    def _load_tokenizer(name: str):
+        try:
+            from tokenizers import Tokenizer
+        except ImportError:
+            print("CONTEXT_TOKENIZER is set but the tokenizers package is not installed, estimating token counts")
+            return None
+        try:
+            return Tokenizer.from_pretrained(name)
+        except Exception as e:
+            print(f"Error loading tokenizer {name}: {e}")
+            return None
+
+
+class ContextPacker:
+    """
+    Builds the RAG context for a prompt within a token budget.
+    Adjacent chunks of the same document are merged (removing the chunk overlap), then passages
+    are chosen greedily by score per token; the best passage that does not fit whole is
+    truncated to fill what is left of the budget.
+    """
+
+    def __init__(self,
+                 token_budget: Optional[int] = None,
+                 candidates: Optional[int] = None,
+                 min_passage_tokens: Optional[int] = None,
+                 token_counter: Optional[TokenCounter] = None):
+        self.token_budget = token_budget or int(os.getenv('CONTEXT_TOKEN_BUDGET', '1024'))
+        self.candidates = candidates or int(os.getenv('CONTEXT_CANDIDATES', '8'))
+        self.min_passage_tokens = min_passage_tokens or int(os.getenv('CONTEXT_MIN_PASSAGE_TOKENS', '48'))
+        self.token_counter = token_counter or TokenCounter()
+
+    def pack(self, hits: List[Dict[str, Any]], label: Callable[[ContextPassage], str]) -> PackedContext:
+        """
+        Select passages from ranked search hits.
+        `label` renders a passage's citation header, which counts against the budget.
+        """
+        passages = self._merge_adjacent(hits)
+        for passage in passages:
+            passage.tokens = self.token_counter.count(self._render(label(passage), passage.content))
+
+        by_density = sorted(passages, key=lambda passage: (passage.score / max(passage.tokens, 1), passage.score),
+                            reverse=True)
+        selected: List[ContextPassage] = []
+        remaining = self.token_budget
+        for passage in by_density:
+            if passage.tokens <= remaining:
+                selected.append(passage)
+                remaining -= passage.tokens
+            elif remaining >= self.min_passage_tokens and not any(chosen.truncated for chosen in selected):
+                header = self.token_counter.count(self._render(label(passage), ""))
+                content = self.token_counter.truncate(passage.content, remaining - header)
+                if content:
+                    passage.content = content
+                    passage.truncated = True
+                    passage.tokens = self.token_counter.count(self._render(label(passage), content))
+                    if passage.tokens <= remaining:
+                        selected.append(passage)
+                        remaining -= passage.tokens
+
+        selected.sort(key=lambda passage: passage.score, reverse=True)
+        return PackedContext(
+            passages=selected,
+            tokens_used=self.token_budget - remaining,
+            token_budget=self.token_budget,
+            candidates=len(hits)
+        )
+
+    @staticmethod
+    def render(passages: List[ContextPassage], label: Callable[[ContextPassage], str]) -> str:
+        """Prompt text for the packed passages"""
+        return "\n\n".join(ContextPacker._render(label(passage), passage.content) for passage in passages)
+
+    # Private helper methods
+
+    @staticmethod
+    def _render(label: str, content: str) -> str:
+        return f"[{label}]: {content}"
+
+    def _merge_adjacent(self, hits: List[Dict[str, Any]]) -> List[ContextPassage]:
+        """Group hits into passages of consecutive chunks per document"""
+        by_document: Dict[str, List[Dict[str, Any]]] = {}
+        for hit in hits:
+            by_document.setdefault(hit.get('metadata_id'), []).append(hit)
+
+        passages = []
+        for metadata_id, document_hits in by_document.items():
+            document_hits.sort(key=lambda hit: hit.get('chunk_index', 0))
+            passage = None
+            for hit in document_hits:
+                chunk_index = hit.get('chunk_index', 0)
+                if passage is not None and chunk_index == passage.chunk_end + 1:
+                    passage.content = self._join_overlapping(passage.content, hit.get('content', ''))
+                    passage.chunk_end = chunk_index
+                    passage.score = max(passage.score, self._score(hit))
+                    passage.page_end = hit.get('page_end') or passage.page_end
+                    passage.fragment_ids.append(hit.get('fragment_id'))
+                    passage.hits.append(hit)
+                    continue
+                if passage is not None and chunk_index == passage.chunk_end:
+                    continue  # duplicate hit for the same chunk
+                passage = ContextPassage(
+                    metadata_id=metadata_id,
+                    document_title=hit.get('document_title', 'Unknown'),
+                    document_type=hit.get('document_type', 'unknown'),
+                    specialty=hit.get('specialty', 'general'),
+                    chunk_start=chunk_index,
+                    chunk_end=chunk_index,
+                    content=hit.get('content', ''),
+                    score=self._score(hit),
+                    page_start=hit.get('page_start'),
+                    page_end=hit.get('page_end'),
+                    fragment_ids=[hit.get('fragment_id')],
+                    hits=[hit]
+                )
+                passages.append(passage)
+        return passages
+
+    @staticmethod
+    def _score(hit: Dict[str, Any]) -> float:
+        """Reranker score when the hit was reranked, otherwise the retrieval score"""
+        score = hit.get('rerank_score')
+        return float(score if score is not None else hit.get('score', 0.0) or 0.0)
+
+    @staticmethod
+    def _join_overlapping(previous: str, following: str, probe: int = 32) -> str:
+        """Concatenate consecutive chunks, dropping the text the chunker repeated at the start of `following`"""
+        head = following[:probe]
+        if head:
+            lower = max(0, len(previous) - len(following))
+            position = previous.rfind(head, lower)
+            while position != -1:
+                tail = previous[position:]
+                if following.startswith(tail):
+                    return previous + following[len(tail):]
+                position = previous.rfind(head, lower, position + len(head) - 1)
+        return f"{previous}\n{following}"
+
+
+_context_packer: Optional[ContextPacker] = None
+_context_packer_lock = threading.Lock()
+
+
+def get_context_packer() -> ContextPacker:
+    """Get the process-wide context packer (shared so token calibration accumulates)"""
+    global _context_packer
+    with _context_packer_lock:
+        if _context_packer is None:
+            _context_packer = ContextPacker()
+        return _context_packer
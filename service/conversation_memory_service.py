@@ -0,0 +1,166 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from bson import ObjectId
+
+from repository.chat_history_repository import ChatHistoryRepository
+from repository.conversation_memory_repository import ConversationMemoryRepository
+from .context_packer import TokenCounter
+from .llm_client import get_llm_client
+
+# Sorts after every real _id of the same date
+_MAX_OBJECT_ID = ObjectId("f" * 24)
+
+
+class ConversationMemoryService:
+    """
+    Bounded conversation memory for prompts: a summary of older turns (capped at MEMORY_SUMMARY_TOKENS)
+    plus every turn the summary does not cover yet, verbatim (each capped at MEMORY_TURN_TOKENS).
+    That is the last MEMORY_WINDOW_TURNS turns plus up to MEMORY_SUMMARY_EVERY that have left the window
+    but are not summarized yet, so prompt size stays bounded however long the conversation gets.
+    The summary is refreshed in the background once MEMORY_SUMMARY_EVERY turns have left the window.
+    """
+
+    # Shared by every instance, so a conversation is never queued twice
+    _pending: Set[str] = set()
+    _pending_lock = threading.Lock()
+
+    def __init__(self,
+                 chat_repository: ChatHistoryRepository,
+                 token_counter: TokenCounter,
+                 window_turns: Optional[int] = None,
+                 summary_every: Optional[int] = None):
+        self.chat_repository = chat_repository
+        self.memory_repository = ConversationMemoryRepository()
+        self.token_counter = token_counter
+        self.window_turns = window_turns or int(os.getenv('MEMORY_WINDOW_TURNS', '4'))
+        self.summary_every = summary_every or int(os.getenv('MEMORY_SUMMARY_EVERY', '4'))
+        self.turn_tokens = int(os.getenv('MEMORY_TURN_TOKENS', '150'))
+        self.summary_tokens = int(os.getenv('MEMORY_SUMMARY_TOKENS', '256'))
+        # Older turns folded into the summary per background pass (long backlogs catch up over several turns)
+        self.summary_batch = int(os.getenv('MEMORY_SUMMARY_BATCH', '20'))
+
+    def render(self, conversation_id: Optional[str]) -> str:
+        """Prompt section with the conversation summary and recent turns (empty for a new conversation)"""
+        if not conversation_id:
+            return ""
+        memory = self.memory_repository.find_by_conversation_id(conversation_id) or {}
+        # Turns that left the window but are not in the summary yet stay verbatim until they are folded in
+        turns = self.chat_repository.find_recent_by_conversation_id(
+            conversation_id, self.window_turns + self.summary_every, after=self._watermark(memory)
+        )
+        if not turns and not memory.get("summary"):
+            return ""
+
+        parts = []
+        summary = memory.get("summary")
+        if summary:
+            parts.append(f"Resumen de la conversación previa: {self.token_counter.truncate(summary, self.summary_tokens)}")
+
+        recent = []
+        for turn in turns:
+            recent.append(f"Usuario: {self.token_counter.truncate(turn['prompt'], self.turn_tokens)}")
+            recent.append(f"Asistente: {self.token_counter.truncate(turn['response'], self.turn_tokens)}")
+        if recent:
+            parts.append("Conversación reciente:\n" + "\n".join(recent))
+        return "\n\n".join(parts)
+
+    def record_turn(self, conversation_id: str):
+        """Schedule a background summary refresh for the conversation (at most one queued per conversation)"""
+        with self._pending_lock:
+            if conversation_id in self._pending:
+                return
+            self._pending.add(conversation_id)
+        _get_summary_executor().submit(self._refresh_summary, conversation_id)
+
+    def forget(self, conversation_id: str):
+        """Drop the stored summary of a deleted conversation"""
+        self.memory_repository.delete_by_conversation_id(conversation_id)
+
+    # Private helper methods
+
+    def _refresh_summary(self, conversation_id: str):
+        with self._pending_lock:
+            self._pending.discard(conversation_id)
+        try:
+            memory = self.memory_repository.find_by_conversation_id(conversation_id) or {}
+            unsummarized = self.chat_repository.find_page(
+                conversation_id, self._watermark(memory), self.window_turns + self.summary_batch + 1
+            )
+            # Turns still inside the rolling window are sent verbatim, not summarized
+            outside_window = unsummarized[:max(0, len(unsummarized) - self.window_turns)][:self.summary_batch]
+            if len(outside_window) < self.summary_every:
+                return
+
+            summary = self._summarize(memory.get("summary", ""), outside_window)
+            if summary:
+                last = outside_window[-1]
+                self.memory_repository.advance_summary(
+                    conversation_id, summary, (last["date"], last["_id"]), len(outside_window),
+                    (memory.get("summarized_until"), memory.get("summarized_until_id"))
+                )
+        except Exception as e:
+            print(f"Error refreshing summary for conversation {conversation_id}: {e}")
+
+    @staticmethod
+    def _watermark(memory: Dict[str, Any]) -> Optional[Tuple[datetime, ObjectId]]:
+        """(date, _id) key of the last summarized turn, or None before the first summary"""
+        summarized_until = memory.get("summarized_until")
+        if summarized_until is None:
+            return None
+        # Summaries written before the _id was stored covered every turn of their date
+        return summarized_until, memory.get("summarized_until_id") or _MAX_OBJECT_ID
+
+    def _summarize(self, previous_summary: str, turns: List[Dict[str, Any]]) -> str:
+        transcript = "\n".join(
+            f"Usuario: {turn['prompt']}\nAsistente: {self.token_counter.truncate(turn['response'], self.turn_tokens * 2)}"
+            for turn in turns
+        )
+        prompt = f"""Actualiza el resumen de una conversación entre un usuario y un asistente médico.
+Conserva síntomas, antecedentes, medicamentos, datos del paciente y recomendaciones ya dadas.
+Escribe un solo párrafo de como máximo {int(self.summary_tokens * 0.6)} palabras, sin introducciones.
+
+Resumen actual: {previous_summary or "(vacío)"}
+
+Nuevos turnos:
+{transcript}
+
+Resumen actualizado:"""
+        result = get_llm_client().generate(
+            prompt,
+            model=os.getenv('MEMORY_SUMMARY_MODEL') or os.getenv('OLLAMA_MODEL', 'AlthosKal/medicoia'),
+            options={"temperature": 0, "num_predict": self.summary_tokens}
+        )
+        return result.get("response", "").strip()
+
+
+_summary_executor: Optional[ThreadPoolExecutor] = None
+_summary_executor_lock = threading.Lock()
+
+
+def _get_summary_executor() -> ThreadPoolExecutor:
+    """
+    Process-wide summary worker, shared by every ConversationMemoryService.
+    One thread: summaries are cheap to defer and must not compete with answer generation.
+    """
+    global _summary_executor
+    with _summary_executor_lock:
+        if _summary_executor is None:
+            _summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-memory")
+        return _summary_executor
+
+
+def _reset_after_fork():
+    """The worker thread does not survive a fork; the child starts its own"""
+    global _summary_executor, _summary_executor_lock
+    _summary_executor = None
+    _summary_executor_lock = threading.Lock()
+    ConversationMemoryService._pending = set()
+    ConversationMemoryService._pending_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,82 @@
+import os
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Callable, List, Optional, Dict, Iterable, Iterator, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class EmbeddingBatcher:
+    """
+    Groups texts into fixed-size batches for an embed_documents-style backend.
+    Keeps a bounded number of batches in flight and returns embeddings in input order.
+    """
+
+    def __init__(self,
+                 embed_batch: Callable[[List[str]], List[List[float]]],
+                 batch_size: Optional[int] = None,
+                 max_in_flight: Optional[int] = None):
+        self.embed_batch = embed_batch
+        self.batch_size = max(1, batch_size or int(os.getenv('EMBEDDING_BATCH_SIZE', '64')))
+        self.max_in_flight = max(1, max_in_flight or int(os.getenv('EMBEDDING_MAX_IN_FLIGHT', '4')))
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed all texts, one backend call per batch"""
+        if not texts:
+            return []
+
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1 or self.max_in_flight == 1:
+            results = []
+            for batch in batches:
+                results.extend(self._embed_checked(batch))
+            return results
+
+        results: List[Optional[List[List[float]]]] = [None] * len(batches)
+        with ThreadPoolExecutor(max_workers=min(self.max_in_flight, len(batches))) as executor:
+            pending: Dict[Future, int] = {}
+            next_batch = 0
+
+            while next_batch < len(batches) or pending:
+                # Top up the in-flight window
+                while next_batch < len(batches) and len(pending) < self.max_in_flight:
+                    future = executor.submit(self._embed_checked, batches[next_batch])
+                    pending[future] = next_batch
+                    next_batch += 1
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[pending.pop(future)] = future.result()
+
+        embeddings = []
+        for batch_result in results:
+            embeddings.extend(batch_result)
+        return embeddings
+
+    def embed_stream(self, items: Iterable[T], key: Callable[[T], str] = str) -> Iterator[Tuple[T, List[float]]]:
+        """
+        Embed a lazily produced sequence, yielding (item, embedding) pairs in input order.
+        At most max_in_flight batches are pending, so the producer is only read ahead by that much.
+        """
+        iterator = iter(items)
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            pending = deque()
+            while True:
+                batch = list(islice(iterator, self.batch_size))
+                if not batch:
+                    break
+                pending.append((batch, executor.submit(self._embed_checked, [key(item) for item in batch])))
+                if len(pending) >= self.max_in_flight:
+                    batch, future = pending.popleft()
+                    yield from zip(batch, future.result())
+
+            while pending:
+                batch, future = pending.popleft()
+                yield from zip(batch, future.result())
+
+    def _embed_checked(self, batch: List[str]) -> List[List[float]]:
+        embeddings = self.embed_batch(batch)
+        if len(embeddings) != len(batch):
+            raise ValueError(f"Embedding backend returned {len(embeddings)} vectors for {len(batch)} texts")
+        return embeddings
@@ -0,0 +1,227 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Any
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache keyed by (model name, SHA-256 of normalized text).
+    A memory LRU tier sits in front of a SQLite store with size-based eviction.
+    """
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 memory_items: Optional[int] = None,
+                 max_disk_bytes: Optional[int] = None):
+        self.path = path or os.getenv('EMBEDDING_CACHE_PATH', os.path.join('.cache', 'embeddings.sqlite3'))
+        self.memory_items = memory_items if memory_items is not None else int(os.getenv('EMBEDDING_CACHE_MEMORY_ITEMS', '10000'))
+        self.max_disk_bytes = max_disk_bytes if max_disk_bytes is not None else int(os.getenv('EMBEDDING_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+
+        self._lock = threading.RLock()
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._connection = self._open_store()
+        self._disk_bytes = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """Normalize text so trivially different inputs share a cache entry"""
+        return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+    @classmethod
+    def make_key(cls, model: str, text: str) -> str:
+        digest = hashlib.sha256(cls.normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{model}:{digest}"
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Look up embeddings for several texts; missing entries are None"""
+        keys = [self.make_key(model, text) for text in texts]
+        results: List[Optional[List[float]]] = [None] * len(keys)
+
+        with self._lock:
+            disk_lookup: Dict[str, List[int]] = {}
+            for position, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    results[position] = vector
+                else:
+                    disk_lookup.setdefault(key, []).append(position)
+
+            if disk_lookup:
+                found = self._read_disk(list(disk_lookup))
+                for key, positions in disk_lookup.items():
+                    vector = found.get(key)
+                    if vector is None:
+                        self._counters["misses"] += len(positions)
+                        continue
+                    self._counters["disk_hits"] += len(positions)
+                    self._remember(key, vector)
+                    for position in positions:
+                        results[position] = vector
+
+        return results
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        """Store embeddings; zero vectors (failed-embedding placeholders) are never cached"""
+        rows = []
+        now = time.time()
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                if not vector or not any(vector):
+                    continue
+                key = self.make_key(model, text)
+                vector = list(vector)
+                self._remember(key, vector)
+                blob = array("f", vector).tobytes()
+                rows.append((key, model, len(vector), blob, len(blob), now))
+
+            if not rows:
+                return
+            try:
+                with self._connection:
+                    for row in rows:
+                        previous = self._connection.execute(
+                            "SELECT size FROM embeddings WHERE key = ?", (row[0],)
+                        ).fetchone()
+                        self._connection.execute(
+                            "INSERT OR REPLACE INTO embeddings (key, model, dimension, vector, size, last_access) "
+                            "VALUES (?, ?, ?, ?, ?, ?)", row
+                        )
+                        self._disk_bytes += row[4] - (previous[0] if previous else 0)
+                self._evict_disk()
+            except sqlite3.Error as e:
+                print(f"Error writing embedding cache: {e}")
+
+    def wrap(self, model: str, embed_batch: Callable[[List[str]], List[List[float]]]) -> Callable[[List[str]], List[List[float]]]:
+        """Return an embed-batch function that only sends cache misses to the backend"""
+        def cached_embed_batch(texts: List[str]) -> List[List[float]]:
+            results = self.get_many(model, texts)
+            missing: Dict[str, List[int]] = {}
+            for position, vector in enumerate(results):
+                if vector is None:
+                    missing.setdefault(self.normalize_text(texts[position]), []).append(position)
+
+            if missing:
+                pending_texts = [texts[positions[0]] for positions in missing.values()]
+                computed = embed_batch(pending_texts)
+                self.put_many(model, pending_texts, computed)
+                for positions, vector in zip(missing.values(), computed):
+                    for position in positions:
+                        results[position] = vector
+            return results
+
+        return cached_embed_batch
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and tier sizes"""
+        with self._lock:
+            hits = self._counters["memory_hits"] + self._counters["disk_hits"]
+            lookups = hits + self._counters["misses"]
+            return {
+                **self._counters,
+                "hits": hits,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes
+            }
+
+    def clear(self):
+        """Drop every cached embedding from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            with self._connection:
+                self._connection.execute("DELETE FROM embeddings")
+            self._disk_bytes = 0
+
+    # Private helper methods
+
+    def _open_store(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, dimension INTEGER NOT NULL, "
+            "vector BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)")
+        connection.commit()
+        return connection
+
+    def _read_disk(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        try:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for key, blob in self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ):
+                    found[key] = array("f", blob).tolist()
+            if found:
+                with self._connection:
+                    self._connection.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                        [(time.time(), key) for key in found]
+                    )
+        except sqlite3.Error as e:
+            print(f"Error reading embedding cache: {e}")
+        return found
+
+    def _remember(self, key: str, vector: List[float]):
+        if self.memory_items <= 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        """Delete least recently used rows until the store is back under 90% of its budget"""
+        if self.max_disk_bytes <= 0 or self._disk_bytes <= self.max_disk_bytes:
+            return
+        target = int(self.max_disk_bytes * 0.9)
+        with self._connection:
+            cursor = self._connection.execute("SELECT key, size FROM embeddings ORDER BY last_access ASC")
+            evicted = []
+            for key, size in cursor:
+                if self._disk_bytes <= target:
+                    break
+                evicted.append((key,))
+                self._disk_bytes -= size
+            cursor.close()
+            self._connection.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+        self._counters["evictions"] += len(evicted)
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Get the process-wide embedding cache, or None when disabled via EMBEDDING_CACHE_ENABLED"""
+    global _embedding_cache
+    if os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() not in ('1', 'true', 'yes'):
+        return None
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            try:
+                _embedding_cache = EmbeddingCache()
+            except (sqlite3.Error, OSError) as e:
+                print(f"Error opening embedding cache: {e}")
+                return None
+        return _embedding_cache
@@ -0,0 +1,95 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from repository.conversation_memory_repository import ConversationMemoryRepository
+
+
+class GenerationContextStore:
+    """
+    Last Ollama generation context (the `context` token array from /api/generate) per conversation.
+    Passing it back on the next turn lets Ollama continue from the already evaluated tokens instead of
+    re-prefilling the whole conversation. Kept in an LRU; with OLLAMA_CONTEXT_SPILL it is also written to
+    the conversation_memory collection so it survives restarts and is shared between workers.
+    Contexts longer than OLLAMA_CONTEXT_MAX_TOKENS are dropped, so the next turn starts a fresh,
+    summary-based prompt instead of growing without bound.
+    """
+
+    def __init__(self,
+                 max_entries: Optional[int] = None,
+                 max_tokens: Optional[int] = None,
+                 spill: Optional[bool] = None):
+        self.max_entries = max_entries or int(os.getenv('OLLAMA_CONTEXT_CACHE_SIZE', '256'))
+        self.max_tokens = max_tokens or int(os.getenv('OLLAMA_CONTEXT_MAX_TOKENS', '3072'))
+        if spill is None:
+            spill = os.getenv('OLLAMA_CONTEXT_SPILL', 'false').lower() in ('1', 'true', 'yes')
+        self.memory_repository = ConversationMemoryRepository() if spill else None
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, List[int]]]" = OrderedDict()
+
+    def get(self, conversation_id: Optional[str], model: str) -> Optional[List[int]]:
+        """Context to continue this conversation with `model`, or None"""
+        if not conversation_id:
+            return None
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is not None:
+                self._entries.move_to_end(conversation_id)
+        if entry is None and self.memory_repository:
+            entry = self._load(conversation_id)
+            if entry is not None:
+                self._remember(conversation_id, entry)
+        if entry is None or entry[0] != model:
+            return None
+        return entry[1]
+
+    def put(self, conversation_id: str, model: str, context: Optional[List[int]]):
+        """Store the context returned by the latest turn (or drop it when missing or too long)"""
+        if not context or len(context) > self.max_tokens:
+            self.discard(conversation_id)
+            return
+        self._remember(conversation_id, (model, list(context)))
+        if self.memory_repository:
+            packed = np.asarray(context, dtype=np.int32).tobytes()
+            self.memory_repository.save_generation_context(conversation_id, model, packed)
+
+    def discard(self, conversation_id: str):
+        """Forget a conversation's context"""
+        with self._lock:
+            self._entries.pop(conversation_id, None)
+        if self.memory_repository:
+            self.memory_repository.save_generation_context(conversation_id, None, None)
+
+    # Private helper methods
+
+    def _remember(self, conversation_id: str, entry: Tuple[str, List[int]]):
+        with self._lock:
+            self._entries[conversation_id] = entry
+            self._entries.move_to_end(conversation_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, conversation_id: str) -> Optional[Tuple[str, List[int]]]:
+        doc = self.memory_repository.find_generation_context(conversation_id)
+        if not doc or not doc.get("generation_context"):
+            return None
+        return doc.get("generation_model"), np.frombuffer(doc["generation_context"], dtype=np.int32).tolist()
+
+
+_generation_context_store: Optional[GenerationContextStore] = None
+_generation_context_store_lock = threading.Lock()
+
+
+def get_generation_context_store() -> Optional[GenerationContextStore]:
+    """Get the process-wide generation context store, or None when disabled via OLLAMA_CONTEXT_REUSE"""
+    global _generation_context_store
+    if os.getenv('OLLAMA_CONTEXT_REUSE', 'true').lower() not in ('1', 'true', 'yes'):
+        return None
+    with _generation_context_store_lock:
+        if _generation_context_store is None:
+            _generation_context_store = GenerationContextStore()
+        return _generation_context_store
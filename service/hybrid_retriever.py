@@ -0,0 +1,78 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from repository.fragment_document_repository import FragmentDocumentRepository
+
+
+class HybridRetriever:
+    """
+    Combines full-text ($text, BM25-style) and vector candidate generation.
+    Both searches run concurrently; their rankings are merged with weighted reciprocal rank fusion
+    and deduplicated by fragment ID.
+    """
+
+    def __init__(self,
+                 fragment_repository: FragmentDocumentRepository,
+                 embed_query: Callable[[str], List[float]],
+                 vector_weight: Optional[float] = None,
+                 text_weight: Optional[float] = None,
+                 rrf_k: Optional[int] = None,
+                 candidates: Optional[int] = None):
+        self.fragment_repository = fragment_repository
+        self.embed_query = embed_query
+        self.vector_weight = vector_weight if vector_weight is not None else float(os.getenv('HYBRID_VECTOR_WEIGHT', '1.0'))
+        self.text_weight = text_weight if text_weight is not None else float(os.getenv('HYBRID_TEXT_WEIGHT', '1.0'))
+        self.rrf_k = rrf_k or int(os.getenv('HYBRID_RRF_K', '60'))
+        self.candidates = candidates or int(os.getenv('HYBRID_CANDIDATES', '20'))
+        # Text search runs here while the calling thread embeds the query and runs the vector search
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('HYBRID_SEARCH_THREADS', '8')),
+            thread_name_prefix="hybrid-search"
+        )
+
+    def search(self, query: str, limit: int = 5,
+               projection: Optional[Dict[str, Any]] = FragmentDocumentRepository.LIGHT_PROJECTION,
+               metadata_ids: Optional[List[str]] = None,
+               exclude_metadata_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Return up to `limit` fragments ranked by fused score.
+        `score` is the fused score scaled to [0, 1] (1.0 = ranked first by both searches);
+        `vector_score` and `text_score` carry the original scores when a search found the fragment.
+        Both searches apply the same metadata document filter.
+        """
+        candidates = max(self.candidates, limit)
+        scope = {"metadata_ids": metadata_ids, "exclude_metadata_ids": exclude_metadata_ids}
+        text_future = self._executor.submit(self._text_search, query, candidates, projection, scope)
+
+        vector_hits = self.fragment_repository.vector_search(
+            self.embed_query(query), limit=candidates, projection=projection, **scope
+        )
+        text_hits = text_future.result()
+
+        return self.fuse(vector_hits, text_hits, limit)
+
+    def fuse(self, vector_hits: List[Dict[str, Any]], text_hits: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+        """Weighted reciprocal rank fusion of two ranked hit lists, deduplicated by fragment ID"""
+        fused: Dict[str, Dict[str, Any]] = {}
+        for hits, weight, source in ((vector_hits, self.vector_weight, "vector"), (text_hits, self.text_weight, "text")):
+            for rank, hit in enumerate(hits, start=1):
+                fragment_id = str(hit["_id"])
+                entry = fused.get(fragment_id)
+                if entry is None:
+                    entry = fused[fragment_id] = {**hit, "fused_score": 0.0, "vector_score": None, "text_score": None}
+                entry["fused_score"] += weight / (self.rrf_k + rank)
+                entry[f"{source}_score"] = hit.get("score")
+                entry[f"{source}_rank"] = rank
+
+        best_possible = (self.vector_weight + self.text_weight) / (self.rrf_k + 1)
+        ranked = sorted(fused.values(), key=lambda entry: entry["fused_score"], reverse=True)[:limit]
+        for entry in ranked:
+            entry["score"] = entry.pop("fused_score") / best_possible if best_possible > 0 else 0.0
+        return ranked
+
+    def _text_search(self, query: str, limit: int, projection: Optional[Dict[str, Any]],
+                     scope: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if self.text_weight <= 0:
+            return []
+        return self.fragment_repository.search_by_text(query, limit=limit, projection=projection, **scope)
@@ -0,0 +1,179 @@
+import os
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from .text_extraction import limit_extraction_workers
+
+
+# Per-process RAG service used by the pool workers
+_worker_rag_service = None
+
+
+def _process_file_in_worker(file_path: str, filename: str, document_type: str,
+                            specialty: str, description: str, incremental: bool) -> Dict[str, Any]:
+    """Worker-process entry point: extract, chunk, embed and store one uploaded file"""
+    global _worker_rag_service
+    if _worker_rag_service is None:
+        from .rag_service_impl import RAGServiceImpl
+        _worker_rag_service = RAGServiceImpl()
+    return _worker_rag_service.process_file(file_path, filename, document_type, specialty, description, incremental)
+
+
+@dataclass
+class IngestionJob:
+    """Progress of one /documents upload processed in the background"""
+    job_id: str
+    files_total: int
+    upload_dir: str
+    status: str = "processing"
+    files_done: int = 0
+    fragments_written: int = 0
+    processed_documents: List[Dict[str, Any]] = field(default_factory=list)
+    errors: List[Dict[str, Any]] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "files_total": self.files_total,
+            "files_done": self.files_done,
+            "fragments_written": self.fragments_written,
+            "processed_documents": [
+                {key: doc[key] for key in ("document_id", "metadata_id", "filename", "fragment_count", "version")}
+                for doc in self.processed_documents
+            ],
+            "errors": list(self.errors),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+
+class IngestionJobQueue:
+    """
+    Local job queue for document uploads.
+    Accepts files, returns a job ID immediately and processes each file on a process pool,
+    tracking per-job progress (files done, fragments written, errors).
+    """
+
+    def __init__(self,
+                 max_workers: Optional[int] = None,
+                 on_file_processed: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.max_workers = max_workers or int(os.getenv('INGESTION_WORKERS', str(max(1, (os.cpu_count() or 2) - 1))))
+        self.retention_seconds = float(os.getenv('INGESTION_JOB_RETENTION_SECONDS', '3600'))
+        self.on_file_processed = on_file_processed
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, IngestionJob] = {}
+        self._executor = self._create_executor()
+
+    def submit(self, files, document_type: str, specialty: str, description: str = "",
+               incremental: bool = False) -> str:
+        """Store the uploaded files and queue them for processing; returns the job ID"""
+        job_id = f"job_{uuid.uuid4().hex[:12]}"
+        upload_dir = tempfile.mkdtemp(prefix=f"{job_id}_")
+
+        # The request's file streams must be consumed before the handler returns
+        stored = []
+        for file in files:
+            if file.filename == '':
+                continue
+            path = os.path.join(upload_dir, f"{len(stored)}{Path(file.filename).suffix.lower()}")
+            file.save(path)
+            stored.append((path, file.filename))
+
+        job = IngestionJob(job_id=job_id, files_total=len(stored), upload_dir=upload_dir)
+        with self._lock:
+            self._prune_finished_jobs()
+            self._jobs[job_id] = job
+            if not stored:
+                self._finish_job(job)
+
+        for path, filename in stored:
+            future = self._submit_task(path, filename, document_type, specialty, description, incremental)
+            future.add_done_callback(
+                lambda done, job=job, path=path, filename=filename: self._on_file_done(job, path, filename, done)
+            )
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the current progress of a job, or None if it is unknown or expired"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    # Private helper methods
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # Spawned workers never inherit the web process's Mongo sockets or threads
+        context = multiprocessing.get_context(os.getenv('INGESTION_START_METHOD', 'spawn'))
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=context,
+            # Workers split the CPUs for their own PDF extraction pools instead of each taking all of them
+            initializer=limit_extraction_workers,
+            initargs=(self.max_workers,)
+        )
+
+    def _submit_task(self, *args) -> Future:
+        try:
+            return self._executor.submit(_process_file_in_worker, *args)
+        except BrokenProcessPool:
+            print("Ingestion process pool broken, recreating it")
+            self._executor = self._create_executor()
+            return self._executor.submit(_process_file_in_worker, *args)
+
+    def _on_file_done(self, job: IngestionJob, path: str, filename: str, future: Future):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+        result = None
+        error = None
+        try:
+            result = future.result()
+        except Exception as e:
+            error = str(e)
+
+        with self._lock:
+            job.files_done += 1
+            if result is not None:
+                job.processed_documents.append(result)
+                job.fragments_written += result["fragments_written"]
+            else:
+                job.errors.append({"filename": filename, "error": error})
+            if job.files_done >= job.files_total:
+                self._finish_job(job)
+
+        if result is not None and self.on_file_processed:
+            try:
+                self.on_file_processed(result)
+            except Exception as e:
+                print(f"Error in ingestion completion hook: {e}")
+
+    def _finish_job(self, job: IngestionJob):
+        if not job.errors:
+            job.status = "completed"
+        else:
+            job.status = "completed_with_errors" if job.processed_documents else "failed"
+        job.finished_at = time.time()
+        shutil.rmtree(job.upload_dir, ignore_errors=True)
+
+    def _prune_finished_jobs(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < cutoff]:
+            del self._jobs[job_id]
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import random
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class LLMClient:
+    """
+    Shared HTTP client for Ollama generation and embedding requests.
+    Owns a keep-alive connection pool, split connect/read timeouts and
+    jittered exponential backoff on connection failures.
+    """
+
+    def __init__(self,
+                 ollama_url: Optional[str] = None,
+                 pool_size: Optional[int] = None,
+                 connect_timeout: Optional[float] = None,
+                 read_timeout: Optional[float] = None,
+                 max_retries: Optional[int] = None,
+                 retry_backoff: Optional[float] = None):
+        self.ollama_url = (ollama_url or os.getenv('OLLAMA_URL', 'http://localhost:11434')).rstrip('/')
+        self.pool_size = pool_size or int(os.getenv('LLM_POOL_SIZE', '10'))
+        self.connect_timeout = connect_timeout or float(os.getenv('LLM_CONNECT_TIMEOUT', '5'))
+        self.read_timeout = read_timeout or float(os.getenv('LLM_READ_TIMEOUT', '30'))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('LLM_MAX_RETRIES', '3'))
+        self.retry_backoff = retry_backoff or float(os.getenv('LLM_RETRY_BACKOFF', '0.5'))
+
+        self.session = requests.Session()
+        # Retries are handled in post() so only connection failures are retried
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def post(self, url: str, json_body: Dict[str, Any], stream: bool = False,
+             read_timeout: Optional[float] = None, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """
+        POST with the pooled session.
+        Connection errors (including connect timeouts) are retried; read timeouts are not,
+        since the server may already be generating.
+        """
+        timeout: Tuple[float, float] = (self.connect_timeout, read_timeout or self.read_timeout)
+        attempt = 0
+        while True:
+            try:
+                return self.session.post(url, json=json_body, stream=stream, timeout=timeout, headers=headers)
+            except requests.exceptions.ConnectionError:
+                if attempt >= self.max_retries:
+                    raise
+                # Full jitter keeps concurrent workers from retrying in lockstep
+                time.sleep(random.uniform(0, self.retry_backoff * (2 ** attempt)))
+                attempt += 1
+
+    def generate(self, prompt: str, model: Optional[str] = None,
+                 options: Optional[Dict[str, Any]] = None, read_timeout: Optional[float] = None,
+                 response_format: Optional[str] = None, context: Optional[List[int]] = None) -> Dict[str, Any]:
+        """
+        Non-streaming Ollama /api/generate call returning the parsed JSON body.
+        response_format="json" constrains the model to emit valid JSON;
+        context continues from a previous call's returned `context`.
+        """
+        body = self.generate_body(prompt, model, stream=False, options=options, context=context)
+        if response_format:
+            body["format"] = response_format
+
+        response = self.post(f"{self.ollama_url}/api/generate", body, read_timeout=read_timeout)
+        if response.status_code != 200:
+            raise Exception(f"Ollama API error: {response.status_code}")
+        return response.json()
+
+    def stream_generate(self, prompt: str, model: Optional[str] = None,
+                        options: Optional[Dict[str, Any]] = None, read_timeout: Optional[float] = None,
+                        context: Optional[List[int]] = None) -> Iterator[Dict[str, Any]]:
+        """Streaming Ollama /api/generate call yielding each NDJSON chunk (the last one carries `context`)"""
+        body = self.generate_body(prompt, model, stream=True, options=options, context=context)
+
+        with self.post(f"{self.ollama_url}/api/generate", body, stream=True, read_timeout=read_timeout) as response:
+            if response.status_code != 200:
+                raise Exception(f"Ollama API error: {response.status_code}")
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise Exception(f"Ollama stream error: {chunk['error']}")
+                yield chunk
+                if chunk.get("done"):
+                    break
+
+    @staticmethod
+    def generate_body(prompt: str, model: Optional[str] = None, stream: bool = False,
+                      options: Optional[Dict[str, Any]] = None, context: Optional[List[int]] = None) -> Dict[str, Any]:
+        """
+        Request body for /api/generate.
+        OLLAMA_KEEP_ALIVE (e.g. "30m") keeps the model, and with it the evaluated prompt cache, loaded between turns.
+        """
+        body: Dict[str, Any] = {
+            "model": model or os.getenv('OLLAMA_MODEL', 'AlthosKal/medicoia'),
+            "prompt": prompt,
+            "stream": stream
+        }
+        if options:
+            body["options"] = options
+        if context:
+            body["context"] = context
+        keep_alive = os.getenv('OLLAMA_KEEP_ALIVE')
+        if keep_alive:
+            body["keep_alive"] = int(keep_alive) if keep_alive.lstrip('-').isdigit() else keep_alive
+        return body
+
+    def embed_openai(self, texts: List[str], model: str, api_key: str) -> List[List[float]]:
+        """OpenAI embeddings request for a batch of texts, returned in input order"""
+        base_url = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1').rstrip('/')
+        response = self.post(
+            f"{base_url}/embeddings",
+            {"model": model, "input": texts},
+            headers={"Authorization": f"Bearer {api_key}"}
+        )
+        if response.status_code != 200:
+            raise Exception(f"OpenAI embeddings API error: {response.status_code} {response.text[:200]}")
+        data = response.json()["data"]
+        return [item["embedding"] for item in sorted(data, key=lambda item: item["index"])]
+
+    def close(self):
+        """Close every pooled connection"""
+        self.session.close()
+
+
+_llm_client: Optional[LLMClient] = None
+_llm_client_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    """Get the process-wide LLM client, creating it on first use"""
+    global _llm_client
+    with _llm_client_lock:
+        if _llm_client is None:
+            _llm_client = LLMClient()
+        return _llm_client
+
+
+def _reset_after_fork():
+    """Pooled sockets must not be shared with a forked child"""
+    global _llm_client, _llm_client_lock
+    _llm_client = None
+    _llm_client_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
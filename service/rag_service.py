@@ -6,14 +6,17 @@ from abc import ABC, abstractmethod
 # LangChain imports for RAG
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
-from langchain_openai import OpenAIEmbeddings
 from langchain.vectorstores import MongoDBAtlasVectorSearch
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
-from langchain_ollama import OllamaLLM
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
 
 from repository.fragment_document_repository import FragmentDocumentRepository
 from repository.metadata_document_repository import MetadataDocumentRepository
+from .embedding_batcher import EmbeddingBatcher
+from .embedding_cache import EmbeddingCache, get_embedding_cache
+from .llm_client import get_llm_client
 
 
 class RAGService(ABC):
@@ -35,6 +38,55 @@ class RAGService(ABC):
         pass
 
 
+class PooledOllamaLLM(LLM):
+    """LangChain LLM that calls Ollama through the shared keep-alive LLM client"""
+    
+    model: str
+    temperature: float = 0.1
+    top_p: float = 0.9
+    
+    @property
+    def _llm_type(self) -> str:
+        return "ollama-pooled"
+    
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        options: Dict[str, Any] = {"temperature": self.temperature, "top_p": self.top_p}
+        if stop:
+            options["stop"] = stop
+        return get_llm_client().generate(prompt, model=self.model, options=options).get("response", "")
+
+
+class PooledOpenAIEmbeddings(Embeddings):
+    """LangChain embeddings that call the OpenAI API through the shared keep-alive LLM client"""
+    
+    def __init__(self, api_key: str, model: str):
+        self.api_key = api_key
+        self.model = model
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return get_llm_client().embed_openai([text[:8000] for text in texts], model=self.model, api_key=self.api_key)
+    
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """LangChain embeddings wrapper that serves repeated texts from the embedding cache"""
+    
+    def __init__(self, embeddings: Embeddings, model: str, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+        self._embed_documents = cache.wrap(model, embeddings.embed_documents)
+        self._embed_query = cache.wrap(model, lambda texts: [embeddings.embed_query(text) for text in texts])
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_documents(texts)
+    
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_query([text])[0]
+
+
 class LangChainRAGService(RAGService):
     """
     LangChain-based RAG service implementation for medical knowledge retrieval.
@@ -48,6 +100,7 @@ class LangChainRAGService(RAGService):
         
         # Initialize embeddings
         self.embeddings = self._initialize_embeddings()
+        self.embedding_batcher = EmbeddingBatcher(self.embeddings.embed_documents)
         
         # Initialize text splitter
         self.text_splitter = RecursiveCharacterTextSplitter(
@@ -65,26 +118,29 @@ class LangChainRAGService(RAGService):
         # Initialize QA chain
         self.qa_chain = self._initialize_qa_chain()
     
-    def _initialize_embeddings(self) -> OpenAIEmbeddings:
+    def _initialize_embeddings(self) -> Embeddings:
         """Initialize OpenAI embeddings"""
         try:
             api_key = os.getenv('OPENAI_KEY') or os.getenv('OPENAI_API_KEY')
             if not api_key:
                 raise ValueError("OPENAI_KEY or OPENAI_API_KEY not found in environment variables")
             
-            return OpenAIEmbeddings(
-                openai_api_key=api_key,
-                model=os.getenv('EMBEDDING_MODEL', 'text-embedding-ada-002')
+            model = os.getenv('EMBEDDING_MODEL', 'text-embedding-ada-002')
+            embeddings = PooledOpenAIEmbeddings(
+                api_key=api_key,
+                model=model
             )
+            
+            cache = get_embedding_cache()
+            return CachedEmbeddings(embeddings, model, cache) if cache else embeddings
         except Exception as e:
             self.logger.error(f"Error initializing embeddings: {e}")
             raise
     
-    def _initialize_llm(self) -> OllamaLLM:
+    def _initialize_llm(self) -> LLM:
         """Initialize Ollama LLM"""
         try:
-            return OllamaLLM(
-                base_url=os.getenv('OLLAMA_URL', 'http://localhost:11434'),
+            return PooledOllamaLLM(
                 model=os.getenv('LLAVA_MODEL', 'llava:latest'),
                 temperature=0.1,
                 top_p=0.9
@@ -166,18 +222,19 @@ class LangChainRAGService(RAGService):
                 # Split document into chunks
                 chunks = self.text_splitter.split_text(doc_text)
                 
-                # Process each chunk
-                for i, chunk in enumerate(chunks):
-                    # Generate embedding
-                    embedding = self.embeddings.embed_query(chunk)
-                    
-                    # Save fragment
-                    self.fragment_repo.save({
+                # Generate embeddings in batches
+                embeddings = self.embedding_batcher.embed(chunks)
+                
+                # Save all fragments with bulk inserts
+                self.fragment_repo.save_many([
+                    {
                         "id_metadata_document": metadata_id,
                         "chunk_index": i,
                         "content": chunk,
                         "embedding": embedding
-                    })
+                    }
+                    for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+                ])
             
             self.logger.info(f"Successfully added {len(documents)} documents to knowledge base")
             return True
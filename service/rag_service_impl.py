@@ -1,14 +1,22 @@
 import os
 import uuid
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
 import tempfile
 from pathlib import Path
+from bson import ObjectId
 
 from entity.metadata_document import MetadataDocument
 from entity.fragment_document import FragmentDocument
 from repository.metadata_document_repository import MetadataDocumentRepository
 from repository.fragment_document_repository import FragmentDocumentRepository
+from .embedding_batcher import EmbeddingBatcher
+from .embedding_cache import get_embedding_cache
+from .llm_client import get_llm_client
+from .response_cache import get_response_cache
+from .text_extraction import PageStream, SUPPORTED_EXTENSIONS
+from .text_chunker import TextChunk, TextChunker, content_hash
+from .hybrid_retriever import HybridRetriever
 
 
 class RAGServiceImpl:
@@ -17,13 +25,25 @@ class RAGServiceImpl:
     Handles document upload, processing, and vector search.
     """
     
+    EMBEDDING_MODEL = "text-embedding-3-small"
+    
     def __init__(self):
         self.metadata_repository = MetadataDocumentRepository()
         self.fragment_repository = FragmentDocumentRepository()
+        self.embedding_cache = get_embedding_cache()
+        self._embed_texts = (
+            self.embedding_cache.wrap(self.EMBEDDING_MODEL, self._request_embeddings)
+            if self.embedding_cache else self._request_embeddings
+        )
+        self.embedding_batcher = EmbeddingBatcher(self._generate_embeddings_batch)
+        self.text_chunker = TextChunker()
+        self.hybrid_retriever = HybridRetriever(self.fragment_repository, self._generate_embeddings)
         
-    def process_documents(self, files, document_type: str, specialty: str, description: str = "") -> Dict[str, Any]:
+    def process_documents(self, files, document_type: str, specialty: str, description: str = "",
+                          incremental: bool = False) -> Dict[str, Any]:
         """
-        Process uploaded documents and store them in the RAG system
+        Process uploaded documents and store them in the RAG system.
+        With incremental=True an upload whose title matches an existing document updates it in place.
         """
         try:
             results = {
@@ -39,7 +59,7 @@ class RAGServiceImpl:
                 try:
                     # Process single document
                     doc_result = self._process_single_document(
-                        file, document_type, specialty, description
+                        file, document_type, specialty, description, incremental
                     )
                     results["processed_documents"].append(doc_result)
                     results["total_fragments"] += doc_result["fragment_count"]
@@ -59,12 +79,10 @@ class RAGServiceImpl:
                 "total_fragments": 0
             }
     
-    def _process_single_document(self, file, document_type: str, specialty: str, description: str) -> Dict[str, Any]:
+    def _process_single_document(self, file, document_type: str, specialty: str, description: str,
+                                 incremental: bool = False) -> Dict[str, Any]:
         """Process a single document file"""
         
-        # Generate unique document ID
-        document_id = f"doc_{uuid.uuid4().hex[:12]}"
-        
         # Get file info
         filename = file.filename
         file_extension = Path(filename).suffix.lower()
@@ -75,43 +93,7 @@ class RAGServiceImpl:
             temp_path = temp_file.name
         
         try:
-            # Extract text from document
-            text_content = self._extract_text_from_file(temp_path, file_extension)
-            
-            # Create chunks/fragments
-            fragments = self._create_text_fragments(text_content, document_id)
-            
-            # Create metadata document
-            metadata_doc = MetadataDocument(
-                document_id=document_id,
-                title=filename,
-                description=description,
-                document_type=document_type,
-                specialty=specialty,
-                file_path=temp_path,  # In production, store in proper file storage
-                file_extension=file_extension,
-                fragment_count=len(fragments),
-                created_date=datetime.now()
-            )
-            
-            # Save metadata
-            metadata_id = self.metadata_repository.save(metadata_doc.to_dict())
-            
-            # Save fragments
-            fragment_ids = []
-            for fragment in fragments:
-                fragment_id = self.fragment_repository.save(fragment.to_dict())
-                fragment_ids.append(fragment_id)
-            
-            return {
-                "document_id": document_id,
-                "metadata_id": metadata_id,
-                "fragment_ids": fragment_ids,
-                "fragment_count": len(fragments),
-                "filename": filename,
-                "file_extension": file_extension
-            }
-            
+            return self.process_file(temp_path, filename, document_type, specialty, description, incremental)
         finally:
             # Clean up temporary file
             try:
@@ -119,200 +101,307 @@ class RAGServiceImpl:
             except:
                 pass
     
-    def _extract_text_from_file(self, file_path: str, file_extension: str) -> str:
-        """Extract text content from various file formats"""
+    def process_file(self, file_path: str, filename: str, document_type: str, specialty: str, description: str = "",
+                     incremental: bool = False) -> Dict[str, Any]:
+        """
+        Process a document already stored on disk.
+        Used directly by the background ingestion workers.
+        """
+        
+        # Generate unique document ID
+        document_id = f"doc_{uuid.uuid4().hex[:12]}"
+        file_extension = Path(filename).suffix.lower()
+        
+        if file_extension not in SUPPORTED_EXTENSIONS:
+            raise Exception(f"Unsupported file format: {file_extension}")
+        
+        if incremental:
+            existing = self.metadata_repository.find_latest_by_title(filename)
+            if existing:
+                return self._update_existing_document(
+                    existing, file_path, filename, file_extension, document_type, specialty, description
+                )
+        
+        # Create and save metadata document first so fragments can reference it
+        metadata_doc = MetadataDocument(
+            document_title=filename,
+            document_type=document_type,
+            metadata={
+                "document_id": document_id,
+                "description": description,
+                "specialty": specialty,
+                "file_extension": file_extension,
+                "page_count": 0,
+                "fragment_count": 0
+            }
+        )
+        metadata_id = self.metadata_repository.save(metadata_doc.to_dict())
         
         try:
-            if file_extension == '.txt':
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return f.read()
-            
-            elif file_extension == '.pdf':
-                try:
-                    import PyPDF2
-                    with open(file_path, 'rb') as f:
-                        reader = PyPDF2.PdfReader(f)
-                        text = ""
-                        for page in reader.pages:
-                            text += page.extract_text() + "\n"
-                        return text
-                except ImportError:
-                    # Fallback using pdfplumber if available
-                    try:
-                        import pdfplumber
-                        with pdfplumber.open(file_path) as pdf:
-                            text = ""
-                            for page in pdf.pages:
-                                page_text = page.extract_text()
-                                if page_text:
-                                    text += page_text + "\n"
-                            return text
-                    except ImportError:
-                        raise Exception("PDF processing libraries not available. Install PyPDF2 or pdfplumber.")
-            
-            elif file_extension in ['.doc', '.docx']:
-                try:
-                    import docx
-                    doc = docx.Document(file_path)
-                    text = ""
-                    for paragraph in doc.paragraphs:
-                        text += paragraph.text + "\n"
-                    return text
-                except ImportError:
-                    raise Exception("python-docx library not available for DOC/DOCX files.")
-            
-            elif file_extension == '.md':
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return f.read()
-            
-            else:
-                raise Exception(f"Unsupported file format: {file_extension}")
-                
-        except Exception as e:
-            raise Exception(f"Error extracting text from {file_extension}: {str(e)}")
+            # Extraction -> chunking -> embedding -> bulk insert, one bounded batch at a time
+            pages = PageStream(file_path, file_extension)
+            fragment_ids = self.fragment_repository.save_many(
+                fragment.to_dict()
+                for fragment in self._embed_chunks(self.text_chunker.iter_chunks(pages), metadata_id)
+            )
+        except Exception:
+            # Do not leave a half-ingested document behind
+            self.fragment_repository.delete_by_metadata_document_id(metadata_id)
+            self.metadata_repository.delete(metadata_id)
+            raise
+        
+        self.metadata_repository.update(metadata_id, {
+            "metadata.fragment_count": len(fragment_ids),
+            "metadata.page_count": pages.page_count
+        })
+        
+        return {
+            "document_id": document_id,
+            "metadata_id": metadata_id,
+            "fragment_ids": fragment_ids,
+            "deleted_fragment_ids": [],
+            "fragment_count": len(fragment_ids),
+            "fragments_written": len(fragment_ids),
+            "version": 1,
+            "filename": filename,
+            "file_extension": file_extension,
+            "page_count": pages.page_count,
+            "pages_per_second": round(pages.pages_per_second, 1)
+        }
     
-    def _create_text_fragments(self, text: str, document_id: str) -> List[FragmentDocument]:
-        """Create text fragments from document content"""
+    def _update_existing_document(self, existing: Dict[str, Any], file_path: str, filename: str, file_extension: str,
+                                  document_type: str, specialty: str, description: str) -> Dict[str, Any]:
+        """
+        Re-ingest a new version of an existing document.
+        Chunks whose content hash is already stored are kept (re-positioned if needed); only new
+        chunks are embedded and inserted, and chunks that disappeared are deleted in bulk.
+        """
+        metadata_id = str(existing["_id"])
+        version = existing.get("version", 1)
         
-        # Simple chunking strategy - split by paragraphs and limit size
-        paragraphs = text.split('\n\n')
-        fragments = []
+        # Stored fragments grouped by content hash (identical chunks may repeat)
+        reusable: Dict[str, List[Dict[str, Any]]] = {}
+        for fragment in self.fragment_repository.find_chunk_hashes(metadata_id):
+            chunk_hash = fragment.get("content_hash") or content_hash(fragment.get("content", ""))
+            reusable.setdefault(chunk_hash, []).append(fragment)
         
-        current_chunk = ""
-        chunk_size = 1000  # characters
-        overlap = 200  # character overlap
+        moved: List[Tuple[str, Dict[str, Any]]] = []
+        kept_count = 0
         
-        for paragraph in paragraphs:
-            paragraph = paragraph.strip()
-            if not paragraph:
-                continue
-            
-            # If adding this paragraph exceeds chunk size, save current chunk
-            if len(current_chunk) + len(paragraph) > chunk_size and current_chunk:
-                fragment = self._create_fragment(current_chunk, document_id, len(fragments))
-                fragments.append(fragment)
+        def changed_chunks(chunks: Iterable[TextChunk]) -> Iterator[TextChunk]:
+            nonlocal kept_count
+            for chunk in chunks:
+                chunk_hash = chunk.content_hash
+                matches = reusable.get(chunk_hash)
+                if not matches:
+                    yield chunk
+                    continue
                 
-                # Start new chunk with overlap
-                words = current_chunk.split()
-                overlap_words = words[-20:] if len(words) > 20 else words  # Last 20 words for overlap
-                current_chunk = " ".join(overlap_words) + " " + paragraph
-            else:
-                current_chunk += " " + paragraph if current_chunk else paragraph
+                fragment = matches.pop()
+                kept_count += 1
+                position = {
+                    "chunk_index": chunk.chunk_index,
+                    "page_start": chunk.page_start,
+                    "page_end": chunk.page_end,
+                    "content_hash": chunk_hash
+                }
+                if any(fragment.get(field) != value for field, value in position.items()):
+                    moved.append((str(fragment["_id"]), position))
         
-        # Add final chunk
-        if current_chunk:
-            fragment = self._create_fragment(current_chunk, document_id, len(fragments))
-            fragments.append(fragment)
+        # IDs are assigned up front so a failed update can remove exactly what it inserted
+        inserted_ids: List[str] = []
         
-        return fragments
-    
-    def _create_fragment(self, content: str, document_id: str, sequence_number: int) -> FragmentDocument:
-        """Create a single fragment document"""
+        def with_ids(fragments: Iterable[FragmentDocument]) -> Iterator[Dict[str, Any]]:
+            for fragment in fragments:
+                fragment.id = str(ObjectId())
+                inserted_ids.append(fragment.id)
+                yield fragment.to_dict()
         
-        fragment_id = f"frag_{uuid.uuid4().hex[:12]}"
+        pages = PageStream(file_path, file_extension)
+        try:
+            self.fragment_repository.save_many(
+                with_ids(self._embed_chunks(changed_chunks(self.text_chunker.iter_chunks(pages)), metadata_id))
+            )
+        except Exception:
+            self.fragment_repository.delete_by_ids(inserted_ids)
+            raise
+        
+        stale_ids = [str(fragment["_id"]) for fragments in reusable.values() for fragment in fragments]
+        self.fragment_repository.update_many_by_id(moved)
+        self.fragment_repository.delete_by_ids(stale_ids)
+        
+        fragment_count = kept_count + len(inserted_ids)
+        updated = self.metadata_repository.increment_version(metadata_id, version, {
+            "document_type": document_type,
+            "metadata.description": description or existing.get("metadata", {}).get("description", ""),
+            "metadata.specialty": specialty,
+            "metadata.page_count": pages.page_count,
+            "metadata.fragment_count": fragment_count,
+            "updated_at": datetime.now()
+        })
+        if not updated:
+            raise Exception(f"Document {filename} was modified concurrently (expected version {version})")
+        
+        # Cached answers built from the previous version are no longer valid
+        response_cache = get_response_cache()
+        if response_cache:
+            response_cache.invalidate_document(metadata_id)
         
-        # Generate embeddings (placeholder - will implement with actual embeddings)
-        embeddings = self._generate_embeddings(content)
+        print(f"Updated {filename} to version {version + 1}: {kept_count} chunks kept, "
+              f"{len(inserted_ids)} added, {len(stale_ids)} removed")
         
+        return {
+            "document_id": existing.get("metadata", {}).get("document_id"),
+            "metadata_id": metadata_id,
+            "fragment_ids": inserted_ids,
+            "deleted_fragment_ids": stale_ids,
+            "fragment_count": fragment_count,
+            "fragments_written": len(inserted_ids),
+            "version": version + 1,
+            "filename": filename,
+            "file_extension": file_extension,
+            "page_count": pages.page_count,
+            "pages_per_second": round(pages.pages_per_second, 1)
+        }
+    
+    def _embed_chunks(self, chunks: Iterable[TextChunk], metadata_id: str) -> Iterator[FragmentDocument]:
+        """Create fragments from streamed chunks"""
+        # Embeddings are requested in batches, a bounded number at a time
+        for chunk, embedding in self.embedding_batcher.embed_stream(chunks, key=lambda chunk: chunk.content):
+            yield self._create_fragment(
+                chunk.content, metadata_id, chunk.chunk_index, embedding,
+                page_start=chunk.page_start,
+                page_end=chunk.page_end,
+                content_hash=chunk.content_hash
+            )
+    
+    def _create_fragment(self, content: str, metadata_id: str, chunk_index: int, embedding: List[float],
+                         page_start: Optional[int] = None, page_end: Optional[int] = None,
+                         content_hash: Optional[str] = None) -> FragmentDocument:
+        """Create a single fragment document"""
         return FragmentDocument(
-            fragment_id=fragment_id,
-            document_id=document_id,
+            id_metadata_document=metadata_id,
+            chunk_index=chunk_index,
             content=content,
-            sequence_number=sequence_number,
-            embeddings=embeddings,
-            created_date=datetime.now()
+            embedding=embedding,
+            page_start=page_start,
+            page_end=page_end,
+            content_hash=content_hash
         )
     
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a search query (served from the embedding cache when repeated)"""
+        return self._generate_embeddings(query)
+    
     def _generate_embeddings(self, text: str) -> List[float]:
         """
-        Generate embeddings for text content
-        TODO: Implement with actual embedding model (OpenAI, sentence-transformers, etc.)
+        Generate the embedding for a single text (a one-item batch through the embedding cache;
+        OpenAI text-embedding-3-small when OPENAI_API_KEY is set, otherwise a zero placeholder)
         """
+        return self._generate_embeddings_batch([text])[0]
+    
+    def _generate_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for several texts, serving repeats from the embedding cache"""
+        return self._embed_texts(texts)
+    
+    def _request_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for several texts with a single backend request"""
         try:
-            # Try OpenAI embeddings first
-            import openai
-            openai.api_key = os.getenv('OPENAI_API_KEY') or os.getenv('OPENAI_KEY')
+            api_key = os.getenv('OPENAI_API_KEY') or os.getenv('OPENAI_KEY')
             
-            if openai.api_key:
-                response = openai.embeddings.create(
-                    model="text-embedding-3-small",
-                    input=text[:8000]  # Limit text length
+            if api_key:
+                # Shared keep-alive client; results come back in input order
+                return get_llm_client().embed_openai(
+                    [text[:8000] for text in texts],  # Limit text length
+                    model=self.EMBEDDING_MODEL,
+                    api_key=api_key
                 )
-                return response.data[0].embedding
             else:
                 # Fallback: return placeholder embeddings
-                return [0.0] * 1536  # OpenAI embedding dimension
+                return [[0.0] * 1536 for _ in texts]  # OpenAI embedding dimension
                 
         except Exception as e:
             print(f"Error generating embeddings: {e}")
             # Return placeholder embeddings
-            return [0.0] * 1536
+            return [[0.0] * 1536 for _ in texts]
     
-    def search_similar_documents(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+    def search_similar_documents(self, query: str, limit: int = 5, mode: Optional[str] = None,
+                                 document_type: Optional[str] = None,
+                                 specialty: Optional[str] = None) -> List[Dict[str, Any]]:
         """
-        Search for similar documents using vector similarity
+        Search for similar documents.
+        mode "hybrid" (default, RETRIEVAL_MODE) fuses full-text and vector rankings; "vector" uses embeddings only.
+        document_type and specialty scope the search to matching documents; invalidated documents are never returned.
         """
         try:
-            # Generate query embeddings
-            query_embeddings = self._generate_embeddings(query)
-            
-            # Search fragments (simplified - in production use proper vector search)
-            all_fragments = self.fragment_repository.find_all()
-            
-            # Calculate similarity and rank (simplified)
-            scored_fragments = []
-            for fragment in all_fragments:
-                # Simple similarity calculation (cosine similarity would be better)
-                similarity_score = self._calculate_similarity(query, fragment.get('content', ''))
-                
-                scored_fragments.append({
-                    'fragment': fragment,
-                    'score': similarity_score
-                })
+            scope = self._metadata_scope(document_type, specialty)
+            if scope.get("metadata_ids") == []:
+                return []
             
-            # Sort by score and limit results
-            scored_fragments.sort(key=lambda x: x['score'], reverse=True)
-            top_fragments = scored_fragments[:limit]
-            
-            # Get metadata for each fragment
-            results = []
-            for item in top_fragments:
-                fragment = item['fragment']
-                document_id = fragment.get('document_id')
-                
-                # Get document metadata
-                metadata_docs = self.metadata_repository.find_by_document_id(document_id)
-                metadata = metadata_docs[0] if metadata_docs else {}
-                
-                results.append({
-                    'content': fragment.get('content', ''),
-                    'score': item['score'],
-                    'document_title': metadata.get('title', 'Unknown'),
-                    'document_type': metadata.get('document_type', 'unknown'),
-                    'specialty': metadata.get('specialty', 'general')
-                })
-            
-            return results
+            mode = mode or os.getenv('RETRIEVAL_MODE', 'hybrid')
+            if mode == 'hybrid':
+                fragments = self.hybrid_retriever.search(query, limit=limit, **scope)
+            else:
+                # Top-k vector search; hits come back without their embeddings
+                fragments = self.fragment_repository.vector_search(
+                    self._generate_embeddings(query), limit=limit,
+                    projection=FragmentDocumentRepository.LIGHT_PROJECTION, **scope
+                )
+            return self._join_document_metadata(fragments)
             
         except Exception as e:
             print(f"Error searching documents: {e}")
             return []
     
-    def _calculate_similarity(self, query: str, content: str) -> float:
+    def _metadata_scope(self, document_type: Optional[str], specialty: Optional[str]) -> Dict[str, Any]:
         """
-        Simple text similarity calculation
-        TODO: Replace with proper vector similarity
+        Translate metadata filters into a fragment filter applied before scoring:
+        an allow list of valid matching documents when scoped, otherwise a deny list of invalidated ones
         """
-        query_words = set(query.lower().split())
-        content_words = set(content.lower().split())
+        filters = {}
+        if document_type:
+            filters["document_type"] = document_type
+        if specialty:
+            filters["metadata.specialty"] = specialty
+        if filters:
+            return {"metadata_ids": self.metadata_repository.find_ids(valid=True, **filters)}
+        return {"exclude_metadata_ids": self.metadata_repository.find_ids(valid=False)}
+    
+    def _join_document_metadata(self, fragments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Build search results, joining document metadata in a single batched lookup"""
+        if not fragments:
+            return []
         
-        if not query_words or not content_words:
-            return 0.0
+        metadata_ids = [fragment.get('id_metadata_document') for fragment in fragments]
+        metadata_by_id = {
+            str(doc['_id']): doc
+            for doc in self.metadata_repository.find_by_ids(
+                metadata_ids, projection=MetadataDocumentRepository.SUMMARY_PROJECTION
+            )
+        }
         
-        intersection = query_words.intersection(content_words)
-        union = query_words.union(content_words)
+        results = []
+        for fragment in fragments:
+            metadata_id = fragment.get('id_metadata_document')
+            metadata = metadata_by_id.get(metadata_id, {})
+            extra = metadata.get('metadata', {})
+            
+            results.append({
+                'fragment_id': str(fragment.get('_id')),
+                'metadata_id': metadata_id,
+                'chunk_index': fragment.get('chunk_index', 0),
+                'page_start': fragment.get('page_start'),
+                'page_end': fragment.get('page_end'),
+                'content': fragment.get('content', ''),
+                'score': fragment.get('score', 0.0),
+                'vector_score': fragment.get('vector_score', fragment.get('score')),
+                'text_score': fragment.get('text_score'),
+                'document_title': metadata.get('document_title', 'Unknown'),
+                'document_type': metadata.get('document_type', 'unknown'),
+                'specialty': extra.get('specialty', 'general')
+            })
         
-        return len(intersection) / len(union) if union else 0.0
+        return results
     
     def get_all_documents(self) -> List[Dict[str, Any]]:
         """Get all stored documents with metadata"""
@@ -322,20 +411,38 @@ class RAGServiceImpl:
             print(f"Error getting documents: {e}")
             return []
     
+    def sync_ingestion_result(self, result: Dict[str, Any]):
+        """Apply a document processed by another process to this process's index and caches"""
+        self.fragment_repository.index_fragments(result.get("fragment_ids", []))
+        self.fragment_repository.unindex_fragments(result.get("deleted_fragment_ids", []))
+        if result.get("version", 1) > 1:
+            response_cache = get_response_cache()
+            if response_cache:
+                response_cache.invalidate_document(result["metadata_id"])
+    
     def delete_document(self, document_id: str) -> bool:
         """Delete a document and all its fragments"""
         try:
-            # Delete all fragments for this document
-            self.fragment_repository.delete_by_document_id(document_id)
+            # Documents are addressed by their metadata ID; fall back to the legacy document_id
+            metadata_ids = [document_id] if ObjectId.is_valid(document_id) and self.metadata_repository.find_by_id(document_id) else [
+                str(doc['_id']) for doc in self.metadata_repository.find_by_document_id(document_id)
+            ]
+            
+            for metadata_id in metadata_ids:
+                # Delete all fragments for this document
+                self.fragment_repository.delete_by_metadata_document_id(metadata_id)
+                
+                # Delete metadata document
+                self.metadata_repository.delete(metadata_id)
             
-            # Delete metadata document
-            metadata_docs = self.metadata_repository.find_by_document_id(document_id)
-            for doc in metadata_docs:
-                if doc.get('id'):
-                    self.metadata_repository.delete(doc['id'])
+            # Cached answers built from these documents are no longer valid
+            response_cache = get_response_cache()
+            if response_cache:
+                for metadata_id in metadata_ids:
+                    response_cache.invalidate_document(metadata_id)
             
             return True
             
         except Exception as e:
             print(f"Error deleting document: {e}")
-            return False
\ No newline at end of file
+            return False
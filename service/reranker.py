@@ -0,0 +1,229 @@
+import os
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+
+from .llm_client import get_llm_client
+from .response_cache import SemanticResponseCache
+
+
+class Reranker:
+    """
+    Second-stage ranking of retrieval candidates.
+    Candidates are scored in concurrent batches by the Ollama model (RERANK_BACKEND=ollama)
+    or a local cross-encoder (RERANK_BACKEND=cross-encoder, needs sentence-transformers).
+    Scoring must finish within a latency budget, otherwise the first-stage order is kept and
+    batches that have not started are cancelled, so a slow backend is not handed more work.
+    At most RERANK_MAX_QUEUED batches wait for a scoring thread; requests beyond that skip reranking.
+    Scores are cached per (query, fragment) pair.
+    """
+
+    def __init__(self,
+                 backend: Optional[str] = None,
+                 model: Optional[str] = None,
+                 candidates: Optional[int] = None,
+                 batch_size: Optional[int] = None,
+                 budget_seconds: Optional[float] = None,
+                 cache_size: Optional[int] = None):
+        self.backend = (backend or os.getenv('RERANK_BACKEND', 'ollama')).lower()
+        self.model = model or os.getenv('RERANK_MODEL') or (
+            os.getenv('OLLAMA_MODEL', 'AlthosKal/medicoia') if self.backend == 'ollama'
+            else 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+        )
+        self.candidates = candidates or int(os.getenv('RERANK_CANDIDATES', '50'))
+        self.batch_size = max(1, batch_size or int(os.getenv('RERANK_BATCH_SIZE', '10')))
+        self.budget_seconds = budget_seconds or float(os.getenv('RERANK_BUDGET_SECONDS', '2.0'))
+        self.cache_size = cache_size or int(os.getenv('RERANK_CACHE_SIZE', '10000'))
+        # Passages are truncated before scoring to bound prompt size
+        self.max_passage_chars = int(os.getenv('RERANK_MAX_PASSAGE_CHARS', '1000'))
+
+        if self.backend not in ('ollama', 'cross-encoder'):
+            raise ValueError(f"Unknown RERANK_BACKEND {self.backend!r}, expected 'ollama' or 'cross-encoder'")
+
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cross_encoder = None
+        self._cross_encoder_lock = threading.Lock()
+        threads = int(os.getenv('RERANK_THREADS', '4'))
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="rerank")
+        # Batches submitted and not yet finished (running or queued), bounded by threads + RERANK_MAX_QUEUED
+        self._max_in_flight = threads + int(os.getenv('RERANK_MAX_QUEUED', str(2 * threads)))
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self._counters = {"reranked": 0, "timeouts": 0, "errors": 0, "cache_hits": 0, "skipped": 0}
+        self._counters_lock = threading.Lock()
+
+    def rerank(self, query: str, hits: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+        """
+        Return the best `limit` hits by rerank score (`rerank_score`, 0-1).
+        Falls back to the first `limit` hits in their original order when scoring
+        errors out or does not finish within the budget.
+        """
+        if len(hits) <= 1:
+            return hits[:limit]
+
+        deadline = time.monotonic() + self.budget_seconds
+        normalized = SemanticResponseCache.normalize_query(query)
+        scores = self._cached_scores(normalized, hits)
+
+        pending = [hit for hit in hits if hit['fragment_id'] not in scores]
+        batches = [pending[start:start + self.batch_size] for start in range(0, len(pending), self.batch_size)]
+        if not self._reserve(len(batches)):
+            # Scoring is already backed up; queueing more would only delay answer generation
+            self._count("skipped")
+            return hits[:limit]
+        futures = [self._executor.submit(self._score_batch, query, normalized, batch) for batch in batches]
+        for future in futures:
+            future.add_done_callback(self._release)
+
+        done, not_done = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+        if not_done:
+            # Batches already running finish and fill the cache; queued ones are dropped
+            for future in not_done:
+                future.cancel()
+            self._count("timeouts")
+            print(f"Rerank budget of {self.budget_seconds}s exceeded, keeping first-stage order")
+            return hits[:limit]
+        try:
+            for future in done:
+                scores.update(future.result())
+        except Exception as e:
+            self._count("errors")
+            print(f"Error reranking candidates: {e}")
+            return hits[:limit]
+
+        self._count("reranked")
+        reranked = [{**hit, 'rerank_score': scores[hit['fragment_id']]} for hit in hits]
+        # sorted() is stable, so ties keep their first-stage order
+        reranked = sorted(reranked, key=lambda hit: hit['rerank_score'], reverse=True)
+        return reranked[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters plus current cache size and batches in flight"""
+        with self._counters_lock:
+            counters = dict(self._counters)
+        with self._cache_lock:
+            return {**counters, "in_flight_batches": self._in_flight, "cached_scores": len(self._cache)}
+
+    def clear(self):
+        """Drop every cached score"""
+        with self._cache_lock:
+            self._cache.clear()
+
+    # Private helper methods
+
+    def _count(self, counter: str, amount: int = 1):
+        with self._counters_lock:
+            self._counters[counter] += amount
+
+    def _reserve(self, batches: int) -> bool:
+        """Claim room for `batches` more batches, or return False when scoring is backed up"""
+        with self._in_flight_lock:
+            # An idle reranker always accepts a request, however many batches it needs
+            if self._in_flight and self._in_flight + batches > self._max_in_flight:
+                return False
+            self._in_flight += batches
+            return True
+
+    def _release(self, future):
+        # Runs for finished and cancelled batches alike
+        with self._in_flight_lock:
+            self._in_flight -= 1
+
+    def _cached_scores(self, normalized: str, hits: List[Dict[str, Any]]) -> Dict[str, float]:
+        scores = {}
+        with self._cache_lock:
+            for hit in hits:
+                key = (normalized, hit['fragment_id'])
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[hit['fragment_id']] = self._cache[key]
+        self._count("cache_hits", len(scores))
+        return scores
+
+    def _remember(self, normalized: str, scores: Dict[str, float]):
+        with self._cache_lock:
+            for fragment_id, score in scores.items():
+                self._cache[(normalized, fragment_id)] = score
+                self._cache.move_to_end((normalized, fragment_id))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _score_batch(self, query: str, normalized: str, batch: List[Dict[str, Any]]) -> Dict[str, float]:
+        passages = [hit.get('content', '')[:self.max_passage_chars] for hit in batch]
+        if self.backend == 'cross-encoder':
+            values = self._score_cross_encoder(query, passages)
+        else:
+            values = self._score_ollama(query, passages)
+        scores = {hit['fragment_id']: value for hit, value in zip(batch, values)}
+        self._remember(normalized, scores)
+        return scores
+
+    def _score_ollama(self, query: str, passages: List[str]) -> List[float]:
+        """Ask the model for a 0-10 relevance grade per passage in a single JSON answer"""
+        numbered = "\n\n".join(f"[{number}] {passage}" for number, passage in enumerate(passages, start=1))
+        prompt = f"""Evalúa la relevancia de cada pasaje para responder la pregunta.
+Asigna a cada pasaje una puntuación de 0 (irrelevante) a 10 (responde directamente).
+Responde solo con JSON de la forma {{"scores": [n1, n2, ...]}} con {len(passages)} números en el orden de los pasajes.
+
+Pregunta: {query}
+
+Pasajes:
+{numbered}"""
+        result = get_llm_client().generate(
+            prompt,
+            model=self.model,
+            options={"temperature": 0},
+            read_timeout=self.budget_seconds,
+            response_format="json"
+        )
+        grades = self._parse_grades(result.get("response", ""))
+        if len(grades) != len(passages):
+            raise ValueError(f"Reranker returned {len(grades)} scores for {len(passages)} passages")
+        return [min(max(grade, 0.0), 10.0) / 10.0 for grade in grades]
+
+    @staticmethod
+    def _parse_grades(text: str) -> List[float]:
+        try:
+            data = json.loads(text)
+            if isinstance(data, dict):
+                data = data.get("scores", [])
+            return [float(value) for value in data]
+        except (ValueError, TypeError):
+            # Models occasionally wrap the answer in prose; take the numbers in order
+            return [float(value) for value in re.findall(r"-?\d+(?:\.\d+)?", text)]
+
+    def _score_cross_encoder(self, query: str, passages: List[str]) -> List[float]:
+        """Local cross-encoder relevance, squashed to 0-1"""
+        import numpy as np
+        logits = np.asarray(self._get_cross_encoder().predict([(query, passage) for passage in passages]), dtype=np.float64)
+        return (1.0 / (1.0 + np.exp(-logits))).tolist()
+
+    def _get_cross_encoder(self):
+        with self._cross_encoder_lock:
+            if self._cross_encoder is None:
+                try:
+                    from sentence_transformers import CrossEncoder
+                except ImportError:
+                    raise ImportError("RERANK_BACKEND=cross-encoder requires the sentence-transformers package")
+                self._cross_encoder = CrossEncoder(self.model)
+            return self._cross_encoder
+
+
+_reranker: Optional[Reranker] = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> Optional[Reranker]:
+    """Get the process-wide reranker, or None unless enabled via RERANK_ENABLED"""
+    global _reranker
+    if os.getenv('RERANK_ENABLED', 'false').lower() not in ('1', 'true', 'yes'):
+        return None
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = Reranker()
+        return _reranker
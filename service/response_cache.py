@@ -0,0 +1,163 @@
+import os
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional
+
+import numpy as np
+
+
+@dataclass
+class ResponseCacheEntry:
+    """Cached LLM answer together with the retrieval state it was generated from"""
+    normalized_query: str
+    embedding: Optional[np.ndarray]
+    fragment_ids: FrozenSet[str]
+    metadata_ids: FrozenSet[str]
+    response: Dict[str, Any]
+    created_at: float = field(default_factory=time.time)
+
+
+class SemanticResponseCache:
+    """
+    LLM response cache keyed by query embedding plus the set of retrieved fragment IDs.
+    Hits on an exact normalized-query match or on cosine similarity above a threshold,
+    with TTL expiry, LRU eviction and invalidation by source document.
+    """
+
+    def __init__(self,
+                 max_entries: Optional[int] = None,
+                 ttl_seconds: Optional[float] = None,
+                 similarity_threshold: Optional[float] = None):
+        self.max_entries = max_entries or int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1000'))
+        self.ttl_seconds = ttl_seconds or float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '3600'))
+        self.similarity_threshold = similarity_threshold or float(os.getenv('RESPONSE_CACHE_SIMILARITY', '0.95'))
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, ResponseCacheEntry]" = OrderedDict()
+        self._by_fragments: Dict[FrozenSet[str], List[int]] = {}
+        self._next_key = 0
+        self._counters = {"hits": 0, "semantic_hits": 0, "misses": 0, "invalidations": 0}
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Lowercase, strip accents and punctuation, collapse whitespace"""
+        text = unicodedata.normalize("NFKD", query.lower())
+        text = "".join(char for char in text if not unicodedata.combining(char))
+        text = re.sub(r"[^\w\s]", " ", text)
+        return re.sub(r"\s+", " ", text).strip()
+
+    def get(self, query: str, query_embedding: Optional[List[float]],
+            fragment_ids: Iterable[str]) -> Optional[Dict[str, Any]]:
+        """Return a cached response for this query and retrieval result, or None"""
+        normalized = self.normalize_query(query)
+        fragments = frozenset(fragment_ids)
+        vector = self._unit_vector(query_embedding)
+        now = time.time()
+
+        with self._lock:
+            best_key, best_score = None, -1.0
+            for key in list(self._by_fragments.get(fragments, [])):
+                entry = self._entries[key]
+                if now - entry.created_at > self.ttl_seconds:
+                    self._remove_locked(key)
+                    continue
+                if entry.normalized_query == normalized:
+                    best_key, best_score = key, 1.0
+                    break
+                if vector is not None and entry.embedding is not None:
+                    score = float(entry.embedding @ vector)
+                    if score >= self.similarity_threshold and score > best_score:
+                        best_key, best_score = key, score
+
+            if best_key is None:
+                self._counters["misses"] += 1
+                return None
+
+            self._entries.move_to_end(best_key)
+            self._counters["hits"] += 1
+            if self._entries[best_key].normalized_query != normalized:
+                self._counters["semantic_hits"] += 1
+            return dict(self._entries[best_key].response, cache_similarity=best_score)
+
+    def put(self, query: str, query_embedding: Optional[List[float]], fragment_ids: Iterable[str],
+            metadata_ids: Iterable[str], response: Dict[str, Any]):
+        """Cache a generated response"""
+        entry = ResponseCacheEntry(
+            normalized_query=self.normalize_query(query),
+            embedding=self._unit_vector(query_embedding),
+            fragment_ids=frozenset(fragment_ids),
+            metadata_ids=frozenset(metadata_ids),
+            response=dict(response)
+        )
+        with self._lock:
+            # Replace an existing entry for the same query and retrieval result
+            for key in list(self._by_fragments.get(entry.fragment_ids, [])):
+                if self._entries[key].normalized_query == entry.normalized_query:
+                    self._remove_locked(key)
+
+            key = self._next_key
+            self._next_key += 1
+            self._entries[key] = entry
+            self._by_fragments.setdefault(entry.fragment_ids, []).append(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove_locked(next(iter(self._entries)))
+
+    def invalidate_document(self, metadata_id: str) -> int:
+        """Drop every entry generated from a source document; returns how many were removed"""
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if metadata_id in entry.metadata_ids]
+            for key in keys:
+                self._remove_locked(key)
+            self._counters["invalidations"] += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_fragments.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries)}
+
+    # Private helper methods
+
+    def _remove_locked(self, key: int):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._by_fragments.get(entry.fragment_ids, [])
+        if key in keys:
+            keys.remove(key)
+        if not keys:
+            self._by_fragments.pop(entry.fragment_ids, None)
+
+    @staticmethod
+    def _unit_vector(embedding: Optional[List[float]]) -> Optional[np.ndarray]:
+        if embedding is None:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(vector))
+        if vector.size == 0 or norm == 0.0:
+            return None
+        return vector / norm
+
+
+_response_cache: Optional[SemanticResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[SemanticResponseCache]:
+    """Get the process-wide response cache, or None when disabled via RESPONSE_CACHE_ENABLED"""
+    global _response_cache
+    if os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() not in ('1', 'true', 'yes'):
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = SemanticResponseCache()
+        return _response_cache
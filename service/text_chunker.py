@@ -0,0 +1,121 @@
+import os
+import hashlib
+from collections import deque
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, Tuple
+
+
+# Preferred break points, strongest first
+_SEPARATORS = ("\n\n", "\n", ". ", " ")
+
+
+@dataclass
+class TextChunk:
+    """A chunk of document text with its character range and source pages"""
+    chunk_index: int
+    content: str
+    start: int
+    end: int
+    page_start: Optional[int] = None
+    page_end: Optional[int] = None
+
+    @property
+    def content_hash(self) -> str:
+        return content_hash(self.content)
+
+
+def content_hash(content: str) -> str:
+    """Stable hash of chunk content, used to detect unchanged chunks on re-ingestion"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class TextChunker:
+    """
+    Streaming chunker over (page, text) segments.
+    Holds at most one chunk plus the current segment in memory and yields chunks of up to
+    chunk_size characters, breaking on paragraph, line, sentence or word boundaries,
+    with the last `overlap` characters of each chunk repeated at the start of the next.
+    """
+
+    def __init__(self, chunk_size: Optional[int] = None, overlap: Optional[int] = None):
+        self.chunk_size = max(1, chunk_size or int(os.getenv('CHUNK_SIZE', '1000')))
+        self.overlap = overlap if overlap is not None else int(os.getenv('CHUNK_OVERLAP', '200'))
+        self.overlap = max(0, min(self.overlap, self.chunk_size // 2))
+
+    def iter_chunks(self, segments: Iterable[Tuple[Optional[int], str]]) -> Iterator[TextChunk]:
+        buffer = ""
+        buffer_start = 0  # document offset of buffer[0]
+        page_starts = deque()  # (document offset, page number), oldest first
+        chunk_index = 0
+
+        for page_number, text in segments:
+            if page_number is not None:
+                page_starts.append((buffer_start + len(buffer), page_number))
+            buffer += text
+
+            while len(buffer) > self.chunk_size:
+                cut = self._find_break(buffer)
+                chunk = self._make_chunk(buffer, buffer_start, cut, chunk_index, page_starts)
+                if chunk:
+                    yield chunk
+                    chunk_index += 1
+
+                next_start = self._overlap_start(buffer, cut)
+                buffer = buffer[next_start:]
+                buffer_start += next_start
+                # Keep only the page that the buffer currently starts in, plus later ones
+                while len(page_starts) > 1 and page_starts[1][0] <= buffer_start:
+                    page_starts.popleft()
+
+        chunk = self._make_chunk(buffer, buffer_start, len(buffer), chunk_index, page_starts)
+        if chunk:
+            yield chunk
+
+    # Private helper methods
+
+    def _find_break(self, buffer: str) -> int:
+        """End of the next chunk: the last separator in the second half of the window"""
+        window = buffer[:self.chunk_size]
+        minimum = self.chunk_size // 2
+        for separator in _SEPARATORS:
+            position = window.rfind(separator, minimum)
+            if position != -1:
+                return position + len(separator)
+        return self.chunk_size
+
+    def _overlap_start(self, buffer: str, cut: int) -> int:
+        """Start of the next chunk: `overlap` characters before the cut, moved to a word start"""
+        if self.overlap == 0 or cut <= self.overlap:
+            return cut
+        start = cut - self.overlap
+        space = buffer.find(" ", start, cut)
+        if start > 0 and not buffer[start - 1].isspace() and space != -1 and space + 1 < cut:
+            start = space + 1
+        return start
+
+    @staticmethod
+    def _make_chunk(buffer: str, buffer_start: int, cut: int, chunk_index: int,
+                    page_starts: deque) -> Optional[TextChunk]:
+        raw = buffer[:cut]
+        content = raw.strip()
+        if not content:
+            return None
+        start = buffer_start + (len(raw) - len(raw.lstrip()))
+        end = start + len(content)
+        return TextChunk(
+            chunk_index=chunk_index,
+            content=content,
+            start=start,
+            end=end,
+            page_start=_page_at(page_starts, start),
+            page_end=_page_at(page_starts, end - 1)
+        )
+
+
+def _page_at(page_starts: deque, offset: int) -> Optional[int]:
+    page = None
+    for page_offset, page_number in page_starts:
+        if page_offset > offset:
+            break
+        page = page_number
+    return page
@@ -0,0 +1,204 @@
+import os
+import time
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+
+SUPPORTED_EXTENSIONS = ('.txt', '.md', '.pdf', '.doc', '.docx')
+
+# (page number or None for unpaginated formats, text)
+TextSegment = Tuple[Optional[int], str]
+
+
+class PageStream:
+    """
+    Lazily extracted document text, yielded one page (or block) at a time.
+    Tracks the page count and pages/second while it is consumed.
+    """
+
+    def __init__(self, file_path: str, file_extension: str):
+        self.file_path = file_path
+        self.file_extension = file_extension
+        self.page_count = 0
+        self.elapsed_seconds = 0.0
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.page_count / self.elapsed_seconds if self.elapsed_seconds > 0 else 0.0
+
+    def __iter__(self) -> Iterator[TextSegment]:
+        segments = self._iter_segments()
+        while True:
+            # Only time spent extracting counts, not the downstream stages consuming the pages
+            started = time.perf_counter()
+            try:
+                page_number, text = next(segments)
+            except StopIteration:
+                break
+            except Exception as e:
+                raise Exception(f"Error extracting text from {self.file_extension}: {str(e)}")
+            finally:
+                self.elapsed_seconds += time.perf_counter() - started
+            if page_number is not None:
+                self.page_count += 1
+            yield page_number, text
+
+        if self.page_count:
+            print(f"Extracted {self.page_count} pages from {os.path.basename(self.file_path)} "
+                  f"in {self.elapsed_seconds:.2f}s ({self.pages_per_second:.1f} pages/s)")
+
+    def _iter_segments(self) -> Iterator[TextSegment]:
+        if self.file_extension in ('.txt', '.md'):
+            block_size = int(os.getenv('TEXT_READ_BLOCK_SIZE', str(64 * 1024)))
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                for block in iter(lambda: f.read(block_size), ''):
+                    yield None, block
+
+        elif self.file_extension == '.pdf':
+            for page_number, page_text in enumerate(_iter_pdf_pages(self.file_path), start=1):
+                yield page_number, page_text + "\n"
+
+        elif self.file_extension in ('.doc', '.docx'):
+            try:
+                import docx
+            except ImportError:
+                raise Exception("python-docx library not available for DOC/DOCX files.")
+            for paragraph in docx.Document(self.file_path).paragraphs:
+                yield None, paragraph.text + "\n"
+
+        else:
+            raise Exception(f"Unsupported file format: {self.file_extension}")
+
+
+def extract_pdf_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """Extract the text of pages [start, end) of a PDF (runs inside the extraction pool)"""
+    pdf = _open_pdf(file_path)
+    return [pdf.pages[number].extract_text() or "" for number in range(start, end)]
+
+
+# Private helpers
+
+# Each process keeps the last PDF it opened, so consecutive page ranges of a file
+# handled by the same process (or the sequential path) parse its structure once
+_open_pdf_key: Optional[Tuple[str, int, int]] = None
+_open_pdf_document = None
+
+
+def _open_pdf(file_path: str):
+    """Parsed PDF (PyPDF2 reader, or pdfplumber document as a fallback), reused while the file is unchanged"""
+    global _open_pdf_key, _open_pdf_document
+    stat = os.stat(file_path)
+    key = (file_path, stat.st_size, stat.st_mtime_ns)
+    if key == _open_pdf_key:
+        return _open_pdf_document
+
+    _close_pdf()
+    try:
+        import PyPDF2
+        # Given a path, PyPDF2 reads the file into memory and keeps no handle open
+        document = PyPDF2.PdfReader(file_path)
+    except ImportError:
+        # Fallback using pdfplumber if available
+        try:
+            import pdfplumber
+        except ImportError:
+            raise Exception("PDF processing libraries not available. Install PyPDF2 or pdfplumber.")
+        document = pdfplumber.open(file_path)
+    _open_pdf_key, _open_pdf_document = key, document
+    return document
+
+
+def _close_pdf():
+    """Release the PDF kept by _open_pdf"""
+    global _open_pdf_key, _open_pdf_document
+    if _open_pdf_document is not None and hasattr(_open_pdf_document, "close"):
+        _open_pdf_document.close()
+    _open_pdf_key = _open_pdf_document = None
+
+
+def _count_pdf_pages(file_path: str) -> int:
+    return len(_open_pdf(file_path).pages)
+
+
+def _page_ranges(page_count: int, pages_per_task: int) -> List[Tuple[int, int]]:
+    return [(start, min(start + pages_per_task, page_count))
+            for start in range(0, page_count, pages_per_task)]
+
+
+def _iter_pdf_pages(file_path: str) -> Iterator[str]:
+    """Yield page texts in order, splitting large PDFs into page ranges across the extraction pool"""
+    page_count = _count_pdf_pages(file_path)
+    min_pages = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '32'))
+    pages_per_task = max(1, int(os.getenv('PDF_PAGES_PER_TASK', '16')))
+
+    pool = _get_extraction_pool() if page_count >= min_pages else None
+    if pool is None:
+        try:
+            for start, end in _page_ranges(page_count, pages_per_task):
+                yield from extract_pdf_page_range(file_path, start, end)
+        finally:
+            _close_pdf()
+        return
+    _close_pdf()
+
+    # Keep a bounded window of ranges in flight so extracted pages never pile up in memory
+    window = 2 * _extraction_workers()
+    ranges = iter(_page_ranges(page_count, pages_per_task))
+    pending = deque()
+    for start, end in ranges:
+        pending.append(pool.submit(extract_pdf_page_range, file_path, start, end))
+        if len(pending) >= window:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+def _extraction_workers() -> int:
+    """
+    PDF_EXTRACTION_WORKERS, defaulting to the CPU count. Ingestion workers share the CPUs
+    between them (see limit_extraction_workers), which usually disables the nested pool there.
+    """
+    return int(os.getenv('PDF_EXTRACTION_WORKERS', str(os.cpu_count() or 1)))
+
+
+def limit_extraction_workers(process_count: int):
+    """
+    Size this process's extraction pool for `process_count` processes extracting at once
+    (cpu_count // process_count), unless PDF_EXTRACTION_WORKERS is set explicitly.
+    Used as the ingestion pool initializer so bulk uploads do not start cpu_count² processes.
+    """
+    if 'PDF_EXTRACTION_WORKERS' not in os.environ:
+        os.environ['PDF_EXTRACTION_WORKERS'] = str(max(1, (os.cpu_count() or 1) // max(1, process_count)))
+
+
+_extraction_pool: Optional[ProcessPoolExecutor] = None
+_extraction_pool_lock = threading.Lock()
+
+
+def _get_extraction_pool() -> Optional[ProcessPoolExecutor]:
+    """Process-wide extraction pool, or None when parallel extraction is disabled or not possible"""
+    global _extraction_pool
+    workers = _extraction_workers()
+    # Daemonic processes (e.g. multiprocessing.Pool workers) cannot have children
+    if workers <= 1 or multiprocessing.current_process().daemon:
+        return None
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            context = multiprocessing.get_context(os.getenv('PDF_EXTRACTION_START_METHOD', 'spawn'))
+            _extraction_pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        return _extraction_pool
+
+
+def _reset_after_fork():
+    """A forked child must not reuse the parent's pool"""
+    global _extraction_pool, _extraction_pool_lock, _open_pdf_key, _open_pdf_document
+    _extraction_pool = None
+    _extraction_pool_lock = threading.Lock()
+    _open_pdf_key = _open_pdf_document = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
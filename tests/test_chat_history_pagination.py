@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from flask import Flask
+
+mongomock = pytest.importorskip("mongomock")
+
+from repository.base_repository import BaseRepository
+from repository.chat_history_repository import ChatHistoryRepository, CONVERSATIONS_BACKFILL, MIGRATIONS_COLLECTION
+from service.chat_service_impl import ChatServiceImpl
+import controller.web_controller as web_controller
+
+
+@pytest.fixture
+def chat_repository(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(BaseRepository, "_get_mongo_client", lambda self: client)
+    return ChatHistoryRepository()
+
+
+@pytest.fixture
+def chat_service(chat_repository):
+    # Only the history reads are exercised; skip the retrieval and LLM setup
+    service = ChatServiceImpl.__new__(ChatServiceImpl)
+    service.chat_repository = chat_repository
+    return service
+
+
+def _insert_turns(chat_repository, count, date):
+    """Insert `count` turns all saved in the same millisecond, returned in (date, _id) order"""
+    ids = sorted(ObjectId() for _ in range(count))
+    chat_repository.collection.insert_many([
+        {"_id": entry_id, "conversation_id": "conv", "prompt": f"p{number}", "response": f"r{number}", "date": date}
+        for number, entry_id in enumerate(ids)
+    ])
+    return [f"p{number}" for number in range(count)]
+
+
+def _prompts(page):
+    return [entry["prompt"] for entry in page["entries"]]
+
+
+def test_cursor_round_trip():
+    doc = {"date": datetime(2025, 3, 4, 5, 6, 7, 123000), "_id": ObjectId()}
+    cursor = ChatServiceImpl._encode_cursor(doc)
+    assert ChatServiceImpl._decode_cursor(cursor) == (doc["date"], doc["_id"])
+    assert ChatServiceImpl._decode_cursor(None) is None
+
+
+def test_pages_through_same_date_turns_without_gaps(chat_service, chat_repository):
+    prompts = _insert_turns(chat_repository, 7, datetime(2025, 1, 1))
+
+    latest = chat_service.get_conversation_history("conv", page_size=3)
+    assert _prompts(latest) == prompts[4:]
+    assert latest["next_cursor"] is None
+
+    middle = chat_service.get_conversation_history("conv", before=latest["previous_cursor"], page_size=3)
+    assert _prompts(middle) == prompts[1:4]
+    first = chat_service.get_conversation_history("conv", before=middle["previous_cursor"], page_size=3)
+    assert _prompts(first) == prompts[:1]
+    assert first["previous_cursor"] is None
+
+    # Forward again from the first page
+    forward = chat_service.get_conversation_history("conv", after=first["next_cursor"], page_size=3)
+    assert _prompts(forward) == prompts[1:4]
+
+
+def test_keyset_bounds_break_date_ties_on_id(chat_repository):
+    date = datetime(2025, 1, 1)
+    _insert_turns(chat_repository, 4, date)
+    chat_repository.collection.insert_one(
+        {"conversation_id": "conv", "prompt": "later", "response": "", "date": date + timedelta(seconds=1)}
+    )
+    turns = chat_repository.find_by_conversation_id("conv")
+    key = (turns[1]["date"], turns[1]["_id"])
+
+    assert [turn["prompt"] for turn in chat_repository.find_page("conv", key, 10)] == ["p2", "p3", "later"]
+    assert [turn["prompt"] for turn in chat_repository.find_recent_by_conversation_id("conv", 10, before=key)] == ["p0"]
+
+
+def test_bad_cursor_is_rejected(chat_service, monkeypatch):
+    with pytest.raises(ValueError):
+        chat_service.get_conversation_history("conv", before="not-a-cursor")
+
+    app = Flask(__name__, template_folder="../view/templates", static_folder="../view/static")
+    app.register_blueprint(web_controller.web_bp)
+    monkeypatch.setattr(web_controller.get_chat_service, "instance", chat_service, raising=False)
+    monkeypatch.setattr(chat_service, "get_user_conversations", lambda limit=10: [])
+
+    response = app.test_client().get("/conversation/conv?after=123.nope")
+    assert response.status_code == 400
+
+
+def test_backfill_migration_is_claimed_once(chat_repository, monkeypatch):
+    assert chat_repository._claim_migration(CONVERSATIONS_BACKFILL)
+    # Another process sees the running marker
+    assert not chat_repository._claim_migration(CONVERSATIONS_BACKFILL)
+
+    # An abandoned run is taken over once the lock expires
+    monkeypatch.setenv("MIGRATION_LOCK_SECONDS", "60")
+    chat_repository.db[MIGRATIONS_COLLECTION].update_one(
+        {"_id": CONVERSATIONS_BACKFILL}, {"$set": {"started_at": datetime.now() - timedelta(minutes=5)}}
+    )
+    assert chat_repository._claim_migration(CONVERSATIONS_BACKFILL)
+
+    # A completed migration is never claimed again
+    chat_repository._complete_migration(CONVERSATIONS_BACKFILL, 0)
+    assert not chat_repository._claim_migration(CONVERSATIONS_BACKFILL)
+    assert chat_repository.db[MIGRATIONS_COLLECTION].find_one({"_id": CONVERSATIONS_BACKFILL})["status"] == "done"
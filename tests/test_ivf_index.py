@@ -0,0 +1,30 @@
+import numpy as np
+
+from repository.ivf_index import IVFIndex
+
+
+def _vectors(count, dimension=16, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, dimension)).astype(np.float32)
+
+
+def _fragment_id(number):
+    return f"{number:024x}"
+
+
+def test_merge_folds_delta_into_base(tmp_path, monkeypatch):
+    monkeypatch.setenv('IVF_MERGE_MIN', '5')
+    index = IVFIndex(str(tmp_path / "index"), nlist=4, nprobe=4)
+    index.build((_fragment_id(number), vector, None) for number, vector in enumerate(_vectors(20)))
+    assert len(index) == 20
+
+    added = _vectors(5, seed=1)
+    for number, vector in enumerate(added, start=20):
+        index.add(_fragment_id(number), vector)
+    merge_thread = index._merge_thread
+    assert merge_thread is not None
+    merge_thread.join(timeout=30)
+
+    assert len(index._delta) == 0
+    assert index._base_count() == 25
+    assert len(index) == 25
+    assert index.search(added[0], 1)[0][0] == _fragment_id(20)
@@ -0,0 +1,38 @@
+import numpy as np
+
+from repository.vector_index import VectorIndex
+
+
+def _vectors(count, dimension=8, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, dimension)).astype(np.float32)
+
+
+def test_document_code_is_freed_with_last_row():
+    index = VectorIndex()
+    vectors = _vectors(3)
+    index.add("a1", vectors[0], "doc-a")
+    index.add("a2", vectors[1], "doc-a")
+    index.add("b1", vectors[2], "doc-b")
+
+    index.remove("a1")
+    assert "doc-a" in index._document_codes
+    index.remove("a2")
+    assert "doc-a" not in index._document_codes
+    assert index.search(vectors[0], 5, document_ids=["doc-a"]) == []
+
+    # The freed code is reused and does not leak the old document's rows
+    index.add("c1", vectors[0], "doc-c")
+    assert len(index._document_names) == 2
+    assert [hit[0] for hit in index.search(vectors[0], 5, document_ids=["doc-c"])] == ["c1"]
+    assert [hit[0] for hit in index.search(vectors[0], 5, exclude_document_ids=["doc-c"])] == ["b1"]
+
+
+def test_replacing_a_row_moves_it_to_the_new_document():
+    index = VectorIndex()
+    vector = _vectors(1)[0]
+    index.add("f1", vector, "doc-a")
+    index.add("f1", vector, "doc-b")
+
+    assert "doc-a" not in index._document_codes
+    assert index.search(vector, 5, document_ids=["doc-a"]) == []
+    assert [hit[0] for hit in index.search(vector, 5, document_ids=["doc-b"])] == ["f1"]